@@ -0,0 +1,238 @@
+"""Micro-benchmarks of the dataset, transform, and model hot paths.
+
+The benchmarks run on mock BAHAMAS stacks (see ``utils.mock_data``) and a
+randomly initialised CVAE with the layout of the fiducial model, so they don't
+need any of the simulation data. The results are written as JSON, together
+with the commit and environment, so that runs on different commits can be
+compared.
+
+Example
+-------
+::
+
+    python -m baryon_painter.benchmarks --output benchmarks.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+import torch
+
+from baryon_painter.utils import datasets, data_transforms, mock_data
+
+range_compress_k_values = {"log"          : 4.0,
+                           "shift-log"    : 4.0,
+                           "shift-log-2p" : (1.0, 4.0),
+                           "log-tanh"     : 4.0,
+                           "x/(1+x)"      : (2.0, 1.0),
+                           "1/x"          : 1.5}
+
+def time_function(f, repeat=5, number=1, warmup=1):
+    """Times ``f()``.
+
+    Arguments
+    ---------
+    f : callable
+        Function to time, without arguments.
+    repeat : int, optional
+        Number of timings. (default 5).
+    number : int, optional
+        Number of calls of ``f`` per timing. (default 1).
+    warmup : int, optional
+        Number of calls before the timings. (default 1).
+
+    Returns
+    -------
+    timings : dict
+        Minimum, median, mean, and standard deviation of the time per call in
+        seconds, as well as ``repeat`` and ``number``.
+    """
+    for _ in range(warmup):
+        f()
+    t = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        for _ in range(number):
+            f()
+        t.append((time.perf_counter()-t_start)/number)
+    return {"min"    : float(np.min(t)),
+            "median" : float(np.median(t)),
+            "mean"   : float(np.mean(t)),
+            "std"    : float(np.std(t)),
+            "repeat" : repeat,
+            "number" : number}
+
+def get_metadata():
+    """Returns the commit, versions, and machine the benchmarks ran on."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit"        : commit,
+            "time"          : time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "host"          : socket.gethostname(),
+            "platform"      : platform.platform(),
+            "python"        : sys.version.split()[0],
+            "numpy"         : np.__version__,
+            "torch"         : torch.__version__,
+            "torch_threads" : torch.get_num_threads()}
+
+def run_benchmarks(data_path, n_grid=2048, n_tile=4, n_stack=2, batch_size=4, width=1,
+                   repeat=5, compute_device="cpu", seed=0, verbose=True):
+    """Runs the benchmarks.
+
+    Arguments
+    ---------
+    data_path : str
+        Directory for the mock stacks and model. The stacks are only written
+        if they don't exist yet.
+    n_grid : int, optional
+        Size of the mock stacks. (default 2048).
+    n_tile : int, optional
+        Number of tiles on each side of the stacks, setting the tile size to
+        ``n_grid//n_tile``. (default 4).
+    n_stack : int, optional
+        Number of mock stacks. (default 2).
+    batch_size : int, optional
+        Batch size of ``get_batch`` and the training step. (default 4).
+    width : float, optional
+        Width factor of the CVAE (see ``mock_data.create_mock_architecture``).
+        (default 1).
+    repeat : int, optional
+        Number of timings of each benchmark. (default 5).
+    compute_device : str, optional
+        Device of the CVAE. (default "cpu").
+    seed : int, optional
+        Seed of the mock data, sampling, and model. (default 0).
+    verbose : bool, optional
+        Print the timings. (default True).
+
+    Returns
+    -------
+    results : dict
+        Dict with the ``metadata``, ``parameters``, and ``benchmarks``. The
+        timings of each benchmark are given in seconds per call.
+    """
+    import baryon_painter.painter
+
+    files_info_filename = os.path.join(data_path, "files_info.pickle")
+    if os.path.isfile(files_info_filename):
+        import pickle
+        with open(files_info_filename, "rb") as f:
+            files_info = pickle.load(f)
+    else:
+        files_info = mock_data.write_mock_BAHAMAS_stacks(data_path, n_stack=n_stack, n_grid=n_grid, seed=seed)
+
+    transform, inv_transform = data_transforms.create_range_compress_transforms(
+                                                    k_values={"dm" : 4.0, "pressure" : 4.0},
+                                                    modes={"dm" : "shift-log", "pressure" : "shift-log"},
+                                                    eps=1e-4)
+    dataset = datasets.BAHAMASDataset(files=files_info, root_path=data_path,
+                                      n_tile=n_tile,
+                                      transform=data_transforms.chain_transformations([transform,
+                                                                                       data_transforms.atleast_3d]),
+                                      inverse_transform=data_transforms.chain_transformations([data_transforms.squeeze,
+                                                                                               inv_transform]),
+                                      scale_to_SLICS=True,
+                                      mmap_mode="r")
+    tile_size = dataset.tile_size
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    benchmarks = {}
+    def run(name, f, **kwargs):
+        benchmarks[name] = time_function(f, repeat=repeat, **kwargs)
+        if verbose: print(f"{name:<48} {benchmarks[name]['median']*1e3:10.3f} ms")
+
+    run("dataset.getitem", lambda: dataset[int(rng.integers(len(dataset)))], number=10)
+    run("dataset.get_batch", lambda: dataset.get_batch(size=batch_size))
+
+    field = dataset.input_field
+    z = dataset.redshifts[0]
+    tile = dataset.get_input_sample(0, transform=False)
+    for mode, k in range_compress_k_values.items():
+        t, inv_t = data_transforms.create_range_compress_transforms(k_values={field : k}, modes={field : mode})
+        transformed_tile = t(tile, field, z, dataset.stats)
+        run(f"transform.range_compress.{mode}", lambda: t(tile, field, z, dataset.stats), number=10)
+        run(f"transform.range_compress.{mode}.inverse",
+            lambda: inv_t(transformed_tile, field, z, dataset.stats), number=10)
+    split_scale_transform, _ = data_transforms.create_split_scale_transform(n_scale=3, step_size=4)
+    run("transform.split_scale", lambda: split_scale_transform(tile, field, z, dataset.stats))
+
+    architecture = mock_data.create_mock_architecture(tile_size=tile_size, n_x_feature=len(dataset.label_fields),
+                                                      width=width)
+    painter = baryon_painter.painter.CVAEPainter(training_data_set=dataset, test_data_set=dataset,
+                                                 architecture=architecture, compute_device=compute_device)
+    fields, _, z_batch = dataset.get_batch(size=batch_size)
+    x = torch.tensor(np.concatenate(fields[1:], axis=1), device=compute_device)
+    y = torch.tensor(fields[0], device=compute_device)
+    aux_label = torch.tensor(z_batch, device=compute_device, dtype=y.dtype)
+    optimizer = torch.optim.Adam(painter.model.parameters(), lr=1e-6)
+    def train_step():
+        painter.model.train(True)
+        ELBO = painter.model(x, y, aux_label)
+        optimizer.zero_grad()
+        (-ELBO).backward()
+        optimizer.step()
+    run("cvae.train_step", train_step)
+
+    model_filenames = (os.path.join(data_path, "model_state"), os.path.join(data_path, "model_meta"))
+    painter.save_state_to_file(model_filenames)
+    painter = baryon_painter.painter.CVAEPainter(model_filenames, compute_device=compute_device)
+    run("painter.paint", lambda: painter.paint(tile, z=z))
+    tiles = np.stack([tile]*batch_size)
+    run("painter.paint_batch", lambda: painter.paint_batch(tiles, z=z))
+
+    return {"metadata"   : get_metadata(),
+            "parameters" : {"n_grid"         : n_grid,
+                            "n_tile"         : n_tile,
+                            "tile_size"      : tile_size,
+                            "n_stack"        : n_stack,
+                            "batch_size"     : batch_size,
+                            "width"          : width,
+                            "repeat"         : repeat,
+                            "compute_device" : compute_device},
+            "benchmarks" : benchmarks}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dataset, transform, and model hot paths.")
+    parser.add_argument("--output", help="JSON output file. If not set, the results are printed.")
+    parser.add_argument("--data-path", help="Directory for the mock data. If not set, a temporary directory is used.")
+    parser.add_argument("--n-grid", type=int, default=2048)
+    parser.add_argument("--n-tile", type=int, default=4)
+    parser.add_argument("--n-stack", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--width", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compute-device", default="cpu")
+    parser.add_argument("--threads", type=int, help="Number of torch threads.")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    kwargs = dict(n_grid=args.n_grid, n_tile=args.n_tile, n_stack=args.n_stack, batch_size=args.batch_size,
+                  width=args.width, repeat=args.repeat, compute_device=args.compute_device,
+                  verbose=args.output is not None)
+    if args.data_path is not None:
+        results = run_benchmarks(args.data_path, **kwargs)
+    else:
+        with tempfile.TemporaryDirectory() as data_path:
+            results = run_benchmarks(data_path, **kwargs)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
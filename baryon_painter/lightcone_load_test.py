@@ -0,0 +1,199 @@
+"""End-to-end load test of the lightcone painting on mock SLICS inputs.
+
+Paints a full line of sight of mock SLICS planes (see
+``utils.mock_data.write_mock_SLICS``) with the same settings as
+``scripts/create_lightcone.py`` and creates the y-map. By default, the painter
+is a CVAE with random weights, so that no trained model or simulation data
+are needed. The wall time, peak RSS, and per-plane painting throughput are
+reported as JSON.
+
+Example
+-------
+::
+
+    python -m baryon_painter.lightcone_load_test --SLICS-base-path /scratch/mock_SLICS --output load_test.json
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+import baryon_painter.process_SLICS
+from baryon_painter.utils import mock_data, profiling
+from baryon_painter.benchmarks import get_metadata
+
+pi = np.pi
+
+def get_SLICS_geometry(z_SLICS):
+    """Returns the SLICS cosmology, the comoving angular distances of the
+    planes in Mpc/h, and the redshifts of the slices."""
+    import pyccl as ccl
+
+    Omega_b = 0.0473
+    Omega_L = 0.7095
+    h = 0.6898
+    cosmo = ccl.Cosmology(Omega_c=(1-Omega_L-Omega_b), Omega_b=Omega_b, Omega_k=0,
+                          h=h, sigma8=0.826, n_s=0.969, m_nu=0.0)
+    d_A = ccl.comoving_angular_distance(cosmo, 1/(1+np.array(z_SLICS)))*h
+    z_slice = np.array([1/ccl.scale_factor_of_chi(cosmo, 252.5/h*i) - 1 for i in range(len(z_SLICS))])
+    return cosmo, d_A, z_slice
+
+def run_load_test(SLICS_base_path, painter, LOS=1097, n_plane=15, tile_overlap=0.2,
+                  n_pixel_delta=7745, n_pixel_massplane=4096*3,
+                  output_resolution=7745//5, create_y_map=True, resample_plane=False,
+                  memory_budget=None, spill_path=None, verbose=True):
+    """Paints a line of sight and reports the performance.
+
+    Arguments
+    ---------
+    SLICS_base_path : str
+        Directory with the ``delta``, ``massplanes``, and ``random_shifts``
+        directories.
+    painter : Painter
+        Painter to use.
+    LOS : int, optional
+        Line of sight. (default 1097).
+    n_plane : int, optional
+        Number of planes to paint. (default 15).
+    tile_overlap : float, optional
+        Minimum overlap of the tiles. (default 0.2).
+    n_pixel_delta, n_pixel_massplane : int, optional
+        Sizes of the delta and mass plane files. (default 7745, 12288).
+    output_resolution : int, optional
+        Resolution of the y-map. (default 1549).
+    create_y_map : bool, optional
+        Create the y-map from the painted planes. (default True).
+    resample_plane : bool, optional
+        Resample each plane once instead of zooming every tile (see 
+        ``process_SLICS``). (default False).
+    memory_budget : int, optional
+        Memory budget in bytes for the painted planes (see ``process_SLICS``).
+        (default None).
+    spill_path : str, optional
+        Directory for the planes that exceed the memory budget. (default None).
+    verbose : bool, optional
+        Verbosity of the output. (default True).
+
+    Returns
+    -------
+    report : dict
+        Wall times in seconds, the peak RSS of the whole run in bytes, for 
+        each plane the number of tiles, the time spent painting, the 
+        throughput in tiles and megapixels per second, and the peak RSS 
+        sampled while the plane was processed, and the ``profile`` of all 
+        stages (see ``utils.profiling.StageTimer``).
+    """
+    z_SLICS = np.array(mock_data.SLICS_redshifts[:n_plane])
+    cosmo, d_A, z_slice = get_SLICS_geometry(z_SLICS)
+
+    n_pixel_tile = painter.model.dim_y[-1]
+    timer = profiling.StageTimer()
+    t_start = time.perf_counter()
+    painted_planes = baryon_painter.process_SLICS.process_SLICS(
+                                   painter,
+                                   tile_size=100.0, n_pixel_tile=n_pixel_tile,
+                                   LOS=LOS,
+                                   z_SLICS=z_SLICS, delta_size=d_A*10/180*pi,
+                                   delta_path=os.path.join(SLICS_base_path, "delta"),
+                                   massplane_path=os.path.join(SLICS_base_path, "massplanes"),
+                                   shifts_path=os.path.join(SLICS_base_path, "random_shifts"),
+                                   z_slice=z_slice,
+                                   min_tiling_overlap=tile_overlap,
+                                   n_pixel_delta=n_pixel_delta,
+                                   n_pixel_massplane=n_pixel_massplane,
+                                   resample_plane=resample_plane,
+                                   memory_budget=memory_budget,
+                                   spill_path=spill_path,
+                                   timer=timer,
+                                   verbose=verbose)
+    t_paint = time.perf_counter()
+    if create_y_map:
+        baryon_painter.process_SLICS.create_y_map(painted_planes, z_SLICS, resolution=output_resolution,
+                                                  map_size=10.0, cosmo=cosmo, order=5, verbose=verbose,
+                                                  timer=timer)
+    t_end = time.perf_counter()
+
+    planes = []
+    for i, plane in enumerate(painted_planes):
+        plane_report = timer.planes[f"{z_SLICS[i]:.3f}"]
+        stats = plane_report["stages"]["paint"]
+        planes.append({"z"               : float(z_SLICS[i]),
+                       "n_pixel_plane"   : plane.shape[-1],
+                       "n_tile"          : stats["count"],
+                       "paint_time"      : stats["time"],
+                       "tiles_per_s"     : stats["count"]/stats["time"],
+                       "Mpixel_per_s"    : stats["count"]*n_pixel_tile**2/stats["time"]/1e6,
+                       "peak_rss"        : plane_report["peak_rss"]})
+
+    return {"metadata"        : get_metadata(),
+            "parameters"      : {"LOS"               : LOS,
+                                 "n_plane"           : n_plane,
+                                 "tile_overlap"      : tile_overlap,
+                                 "n_pixel_delta"     : n_pixel_delta,
+                                 "n_pixel_massplane" : n_pixel_massplane,
+                                 "n_pixel_tile"      : n_pixel_tile,
+                                 "resample_plane"    : resample_plane,
+                                 "memory_budget"     : memory_budget,
+                                 "output_resolution" : output_resolution},
+            "wall_time"       : t_end - t_start,
+            "process_time"    : t_paint - t_start,
+            "y_map_time"      : t_end - t_paint,
+            "peak_rss"        : profiling.get_peak_rss(),
+            "planes"          : planes,
+            "profile"         : timer.get_report(LOS=LOS)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paint a line of sight of mock SLICS planes and report the performance.")
+    parser.add_argument("--SLICS-base-path", help="Directory of the mock SLICS planes. They are written if they don't exist yet. "
+                                                  "If not set, a temporary directory is used.")
+    parser.add_argument("--LOS", type=int, default=1097)
+    parser.add_argument("--n-plane", type=int, default=15)
+    parser.add_argument("--n-massplane", type=int, default=3)
+    parser.add_argument("--tile-overlap", type=float, default=0.2)
+    parser.add_argument("--n-pixel-delta", type=int, default=7745)
+    parser.add_argument("--n-pixel-massplane", type=int, default=4096*3)
+    parser.add_argument("--output-resolution", type=int, default=7745//5)
+    parser.add_argument("--no-y-map", action="store_true")
+    parser.add_argument("--resample-plane", action="store_true")
+    parser.add_argument("--memory-budget", type=float, help="Memory budget for the painted planes in GB.")
+    parser.add_argument("--spill-path", help="Directory for the planes that exceed the memory budget.")
+    parser.add_argument("--model-path", help="Directory with model_state and model_meta. If not set, a CVAE with random weights is used.")
+    parser.add_argument("--width", type=float, default=1.0, help="Width factor of the random-weight CVAE.")
+    parser.add_argument("--output", help="JSON output file. If not set, the report is printed.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        SLICS_base_path = args.SLICS_base_path or os.path.join(tmp_path, "SLICS")
+        if not os.path.isdir(os.path.join(SLICS_base_path, "delta")):
+            print(f"Writing mock SLICS planes to {SLICS_base_path}.")
+            mock_data.write_mock_SLICS(SLICS_base_path, LOS=args.LOS,
+                                       z_SLICS=mock_data.SLICS_redshifts[:args.n_plane],
+                                       n_massplane=args.n_massplane,
+                                       n_pixel_delta=args.n_pixel_delta,
+                                       n_pixel_massplane=args.n_pixel_massplane)
+
+        if args.model_path is not None:
+            import baryon_painter.painter
+            painter = baryon_painter.painter.CVAEPainter((os.path.join(args.model_path, "model_state"),
+                                                          os.path.join(args.model_path, "model_meta")))
+        else:
+            painter = mock_data.create_mock_painter(os.path.join(tmp_path, "model"), width=args.width)
+
+        report = run_load_test(SLICS_base_path, painter, LOS=args.LOS, n_plane=args.n_plane,
+                               tile_overlap=args.tile_overlap,
+                               n_pixel_delta=args.n_pixel_delta, n_pixel_massplane=args.n_pixel_massplane,
+                               output_resolution=args.output_resolution, create_y_map=not args.no_y_map,
+                               resample_plane=args.resample_plane,
+                               memory_budget=int(args.memory_budget*1024**3) if args.memory_budget is not None else None,
+                               spill_path=args.spill_path,
+                               verbose=args.output is not None)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -43,6 +43,9 @@ class CVAE(torch.nn.Module):
                 self.predict_var = False
                 self.p_var_out = None
             self.use_aux_label = architecture["aux_label"]
+            # Add the aux labels as a bias to the first convolution instead of
+            # merging them as constant feature maps
+            self.aux_label_fast_path = architecture["aux_label_fast_path"] if "aux_label_fast_path" in architecture else True
             if "prior_z_y" in architecture:
                 # Use prior network to get z
                 self.prior_network = build_sequential(architecture["prior_z_y"])
@@ -60,16 +63,27 @@ class CVAE(torch.nn.Module):
         if "cuda" in self.device.type:
             self.cuda()
         
-    def sample_z(self, z_mu, z_log_var):
-        eps = torch.randn(size=(self.L, *z_mu.size()), device=self.device)
+    def sample_z(self, z_mu, z_log_var, L=None, eps=None):
+        L = L or self.L
+        if eps is None:
+            eps = torch.randn(size=(L, *z_mu.size()), device=self.device)
+        else:
+            eps = eps.to(device=z_mu.device, dtype=z_mu.dtype).view(L, *z_mu.size())
         z = z_mu + eps * (torch.exp(z_log_var/2) + self.min_z_var)
         return z.view(-1, *self.dim_z)
     
+    def _apply_with_aux_label(self, network, y, aux_label=None, repeat=1):
+        """Apply ``network`` to y with the aux labels merged into it."""
+        if aux_label is None or not self.use_aux_label:
+            return network(y)
+        elif self.aux_label_fast_path:
+            return apply_with_aux_label(network, y, aux_label, repeat)
+        else:
+            return network(merge_aux_label(y, aux_label, repeat))
+
     def Q(self, x, y, aux_label=None):
-        if aux_label is not None and self.use_aux_label:
-            y = merge_aux_label(y, aux_label)
         h_x = self.q_x_in(x)
-        h_y = self.q_y_in(y)
+        h_y = self._apply_with_aux_label(self.q_y_in, y, aux_label)
         h = torch.cat([h_x, h_y], dim=1)        
         h = self.q_out(h)
         self.z_mu = h[:,0]
@@ -84,9 +98,7 @@ class CVAE(torch.nn.Module):
             z_mu =  torch.zeros((y.shape[0], *self.dim_z), device=self.device)
             z_log_var = torch.zeros((y.shape[0], *self.dim_z), device=self.device)
         else:
-            if aux_label is not None and self.use_aux_label:
-                y = merge_aux_label(y, aux_label)
-            h = self.prior_network(y)
+            h = self._apply_with_aux_label(self.prior_network, y, aux_label)
             z_mu = h[:,0]
             z_log_var = h[:,1]
 
@@ -94,20 +106,30 @@ class CVAE(torch.nn.Module):
 
         return z_mu, z_log_var
     
-    def sample_prior(self, y, aux_label=None):
+    def sample_prior(self, y, aux_label=None, L=None, eps=None):
         with torch.no_grad():
             z_mu, z_log_var = self.prior(y, aux_label)
-            return self.sample_z(z_mu, z_log_var)
+            return self.sample_z(z_mu, z_log_var, L, eps)
 
     
     def P(self, z, y, L=1, aux_label=None):
-        if aux_label is not None and self.use_aux_label:
-            y = merge_aux_label(y, aux_label)
-        h_y = self.p_y_in(y)
+        if self.architecture["p_y_in"] is None:
+            # The aux labels are the last channels of the input of p_y_z_in
+            h_y = y
+        else:
+            h_y = self._apply_with_aux_label(self.p_y_in, y, aux_label)
+            aux_label = None
         h_z = self.p_z_in(z)
         
-        h = torch.cat([h_z, h_y.repeat(L, 1, 1, 1)], dim=1)
-        h = self.p_y_z_in(h)
+        if L > 1:
+            # Concatenate the L samples of h_z with a broadcast view of h_y 
+            # instead of a repeated copy
+            h_z = h_z.view(L, -1, *h_z.shape[1:])
+            h = torch.cat([h_z, h_y.expand(L, *h_y.shape)], dim=2)
+            h = h.view(-1, *h.shape[2:])
+        else:
+            h = torch.cat([h_z, h_y], dim=1)
+        h = self._apply_with_aux_label(self.p_y_z_in, h, aux_label, repeat=L)
         
         x_mu = self.p_mu_out(h)
         assert x_mu.size()[1:] == self.dim_x, "Dimension of x_mu does not match dim_x: {} vs {}.".format(x_mu.size()[1:], self.dim_x)
@@ -132,27 +154,70 @@ class CVAE(torch.nn.Module):
         params = self.P(z, y, self.L, aux_label)
         x_mu = params[0]
         self.x_mu = x_mu
+        # Residuals of shape (L, M, C, H, W), broadcasting x over the L samples
+        self._residual = x_mu.view(self.L, M, *x_mu.shape[1:]) - x
+        self._log_likelihood_fixed_var = None
+        self._log_likelihood_free_var = None
         if self.predict_var: 
-            log_x_var = params[1]#/math.log(self.dim_x[0]*self.dim_x[1]*self.dim_x[2]) * math.log(self.min_x_var)
-            self.x_var = torch.exp(log_x_var)
-            self.log_likelihood_fixed_var = -0.5*math.log(2*pi) + (-0.5 * (x.repeat(self.L, 1, 1, 1) - x_mu)**2).sum(dim=[3,2,0])/(M*self.L)
-            self.log_likelihood_free_var = -0.5*math.log(2*pi) + (-0.5*log_x_var - 0.5*(x.repeat(self.L, 1, 1, 1) - x_mu)**2/self.x_var).sum(dim=[3,2,0])/(M*self.L)
-            self.log_likelihood =    (1-self.alpha_var)*self.log_likelihood_fixed_var \
-                                   + self.alpha_var*self.log_likelihood_free_var   
+            self._log_x_var = params[1].view(self.L, M, *x_mu.shape[1:])
+            # Only compute the terms with non-zero weight, the others get 
+            # computed when they are accessed
+            if self.alpha_var == 0:
+                self.log_likelihood = self.log_likelihood_fixed_var
+            elif self.alpha_var == 1:
+                self.log_likelihood = self.log_likelihood_free_var
+            else:
+                self.log_likelihood =    (1-self.alpha_var)*self.log_likelihood_fixed_var \
+                                       + self.alpha_var*self.log_likelihood_free_var   
         else:
             # Fixed variance
-            self.log_likelihood = -0.5*math.log(2*pi) + 1/(M*self.L)*(-0.5 * (x.repeat(self.L, 1, 1, 1) - x_mu)**2).sum(dim=[3,2,0])
+            self._log_x_var = None
+            self.log_likelihood = self.log_likelihood_fixed_var
 
         self.ELBO = -self.KL_term*self.beta_KL + self.likelihood_scaling*self.log_likelihood.sum()
+        # Terms computed later are only statistics, they don't need the graph
+        self._residual = self._residual.detach()
+        if self._log_x_var is not None:
+            self._log_x_var = self._log_x_var.detach()
         return self.ELBO
     
-    def sample_P(self, y, return_var=False, aux_label=None, z=None):
+    @property
+    def log_likelihood_fixed_var(self):
+        if self._log_likelihood_fixed_var is None:
+            L, M = self._residual.shape[:2]
+            self._log_likelihood_fixed_var = -0.5*math.log(2*pi) + (-0.5 * self._residual**2).sum(dim=[4,3,1,0])/(M*L)
+        return self._log_likelihood_fixed_var
+
+    @property
+    def log_likelihood_free_var(self):
+        if self._log_likelihood_free_var is None:
+            L, M = self._residual.shape[:2]
+            self._log_likelihood_free_var = -0.5*math.log(2*pi) + (-0.5*self._log_x_var - 0.5*self._residual**2*torch.exp(-self._log_x_var)).sum(dim=[4,3,1,0])/(M*L)
+        return self._log_likelihood_free_var
+
+    @property
+    def x_var(self):
+        return torch.exp(self._log_x_var.view(-1, *self._log_x_var.shape[2:]))
+
+    def sample_P(self, y, return_var=False, aux_label=None, z=None, n_sample=1, eps=None):
+        """Sample from the model.
+
+        With ``n_sample`` > 1, ``n_sample`` realisations are drawn for each 
+        input in a single batched pass, with the prior, ``p_y_in``, and the aux
+        labels evaluated only once. The outputs then have shape 
+        ``(n_sample, *y.shape)``.
+
+        The standard normal noise of the latent samples can be provided as 
+        ``eps``, with shape ``(n_sample, y.shape[0], *dim_z)``, instead of 
+        drawing it from the global RNG."""
         with torch.no_grad():
             if z is None:
-                z = self.sample_prior(y, aux_label)
+                z = self.sample_prior(y, aux_label, L=n_sample, eps=eps)
             else:
-                z = torch.tensor(z, device=self.device, dtype=y.dtype)
-            p = self.P(z, y, L=1, aux_label=aux_label)
+                z = torch.as_tensor(z, device=self.device, dtype=y.dtype).reshape(-1, *self.dim_z)
+            p = self.P(z, y, L=n_sample, aux_label=aux_label)
+            if n_sample > 1:
+                p = [q.view(n_sample, -1, *q.shape[1:]) for q in p]
             mu = p[0]
             if len(p) == 2:
                 var = torch.exp(p[1])
@@ -161,14 +226,21 @@ class CVAE(torch.nn.Module):
             
             return mu
                 
-    def get_stats(self):
+    def get_stats(self, as_tensor=False):
+        """Returns the terms of the last forward pass in the order of ``get_stats_labels``.
+
+        If ``as_tensor`` is True, the terms are returned as a single detached
+        tensor on the model device, without synchronising with the host."""
+        terms = [self.ELBO.detach().reshape(1), -self.KL_term.detach().reshape(1),
+                 self.log_likelihood.detach()]
         if self.predict_var:
-            return (self.ELBO.item(), -self.KL_term.item(), 
-                    *self.log_likelihood.detach().cpu().numpy(), 
-                    *self.log_likelihood_fixed_var.detach().cpu().numpy(),
-                    *self.log_likelihood_free_var.detach().cpu().numpy())
+            terms += [self.log_likelihood_fixed_var.detach(),
+                      self.log_likelihood_free_var.detach()]
+        stats = torch.cat(terms)
+        if as_tensor:
+            return stats
         else:
-            return (self.ELBO.item(), -self.KL_term.item(), *self.log_likelihood.detach().cpu().numpy())
+            return tuple(stats.cpu().tolist())
     
     def get_stats_labels(self):
         if self.predict_var:
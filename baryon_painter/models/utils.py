@@ -156,7 +156,7 @@ def build_sequential(architecture):
     
     return torch.nn.Sequential(*modules)
 
-def merge_aux_label(y, aux_label):
+def merge_aux_label(y, aux_label, repeat=1):
     """Merge aux labels as constant feature maps into y.
     
     Arguments
@@ -165,18 +165,81 @@ def merge_aux_label(y, aux_label):
         Input tensor. Should be of shape (N,C_y,H,W).
     aux_label : torch.Tensor
         Tensor of labels to be merged. Should have shape (N,C_aux) or (N).
+    repeat : int, optional
+        Number of times the labels are repeated along the batch dimension to
+        match y, for example for multiple latent samples. (default 1).
         
     Returns
     -------
     out : torch.Tensor
         Tensor of shape (N,C_y+C_aux,H,W).
     """
+    aux_label = _reshape_aux_label(y, aux_label, repeat)
+    if repeat > 1:
+        aux_label = aux_label.repeat(repeat, 1)
+    # Expand aux_label to (N,C,H,W)
+    aux = aux_label.reshape(*aux_label.shape, 1, 1)
+    aux = aux.expand((*aux_label.shape, *y.shape[-2:]))
+    return torch.cat((y, aux), dim=1)
+
+def _reshape_aux_label(y, aux_label, repeat=1):
     # Assume scalar labels and matching batch size
     if aux_label.dim() == 0 or aux_label.dim() == 1:
         aux_label = aux_label.reshape(-1,1)
-    if aux_label.shape[0] != y.shape[0]:
+    if aux_label.shape[0]*repeat != y.shape[0]:
         raise ValueError("aux_label batch size needs to match that of y")
-    # Expand aux_label to (N,C,H,W)
-    aux = aux_label.reshape(*aux_label.shape, 1, 1)
-    aux = aux.expand((*aux_label.shape, *y.shape[-2:]))
-    return torch.cat((y, aux), dim=1)
\ No newline at end of file
+    return aux_label
+
+def _border_validity(n_in, kernel_size, stride, padding, dilation, device, dtype):
+    """Returns a (n_out, kernel_size) matrix that is 1 where a kernel element
+    lies inside the input and 0 where it lies in the zero padding."""
+    n_out = (n_in + 2*padding - dilation*(kernel_size-1) - 1)//stride + 1
+    idx =   torch.arange(n_out, device=device)[:,None]*stride - padding \
+          + torch.arange(kernel_size, device=device)[None,:]*dilation
+    return ((idx >= 0) & (idx < n_in)).to(dtype)
+
+def apply_with_aux_label(network, y, aux_label, repeat=1):
+    """Equivalent to ``network(merge_aux_label(y, aux_label))``, without 
+    materialising the constant aux feature maps.
+
+    If the first layer of ``network`` is a convolution, its response to the 
+    constant aux channels is added as a per-sample bias to the convolution of
+    y. The response is computed from the kernel weights and is exact at the
+    zero-padded borders. Otherwise the aux labels get merged into y.
+    
+    Arguments
+    ---------
+    network : torch.nn.Sequential
+        Network that expects the aux labels as the last input channels.
+    y : torch.Tensor
+        Input tensor. Should be of shape (N,C_y,H,W).
+    aux_label : torch.Tensor
+        Tensor of labels. Should have shape (N,C_aux) or (N).
+    repeat : int, optional
+        Number of times the labels are repeated along the batch dimension to
+        match y. (default 1).
+        
+    Returns
+    -------
+    out : torch.Tensor
+        Output of ``network``.
+    """
+    aux_label = _reshape_aux_label(y, aux_label, repeat)
+    n_aux = aux_label.shape[1]
+    conv = network[0] if isinstance(network, torch.nn.Sequential) and len(network) > 0 else None
+    if not isinstance(conv, torch.nn.Conv2d) or conv.groups != 1 or conv.padding_mode != "zeros" \
+            or isinstance(conv.padding, str) or conv.in_channels != y.shape[1] + n_aux:
+        return network(merge_aux_label(y, aux_label, repeat))
+
+    weight_y = conv.weight[:,:-n_aux]
+    weight_aux = conv.weight[:,-n_aux:]
+    h = torch.nn.functional.conv2d(y, weight_y, conv.bias, conv.stride, conv.padding, conv.dilation)
+    
+    # Response of the kernel to constant unit maps, (C_out,C_aux,H_out,W_out)
+    validity = [_border_validity(y.shape[2+i], conv.kernel_size[i], conv.stride[i], conv.padding[i], conv.dilation[i],
+                                 device=y.device, dtype=weight_aux.dtype) for i in range(2)]
+    response = torch.einsum("ockl,ik,jl->ocij", weight_aux, validity[0], validity[1])
+    bias = torch.einsum("nc,ocij->noij", aux_label.to(response.dtype), response)
+    # The repeated batches of y share the labels
+    h = (h.view(-1, *bias.shape) + bias).view(h.shape)
+    return network[1:](h)
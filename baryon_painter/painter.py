@@ -1,6 +1,5 @@
 import os
 import pickle
-import collections
 
 import dill
 
@@ -9,9 +8,17 @@ import numpy as np
 import torch
 import torch.utils.data
 
-from baryon_painter.utils import validation_plotting
 import baryon_painter.models as models
 import baryon_painter.utils.datasets as datasets
+import baryon_painter.utils.distributed as distributed
+from baryon_painter.utils import profiling
+from baryon_painter.utils.noise import standard_normal
+from baryon_painter.utils.training_stats import TrainingStats
+from baryon_painter.utils.validation_metrics import get_validation_metric_labels, compute_validation_metrics
+from baryon_painter.utils.sample_index_log import SampleIndexLog
+from baryon_painter.utils.checkpointing import CheckpointWriter, atomic_dump, snapshot, \
+                                              load_checkpoint, find_latest_checkpoint, \
+                                              get_rng_state, set_rng_state
 
 class Painter:
     """Abstract base class for a baryon painter.
@@ -29,6 +36,18 @@ class Painter:
     def paint(self, input, **kwargs):
         raise NotImplementedError("This is an abstract base class.")
 
+    def paint_batch(self, inputs, z=0.0, seeds=None, **kwargs):
+        """Paint on a batch of tiles. 
+        
+        The default implementation calls ``paint`` on each tile. ``z`` can be a 
+        scalar or one redshift per tile, and ``seeds`` a list with the ``seed``
+        argument of ``paint`` for each tile."""
+        z = np.broadcast_to(z, (len(inputs),))
+        if seeds is None:
+            return np.stack([self.paint(input, z=z_, **kwargs) for input, z_ in zip(inputs, z)])
+        else:
+            return np.stack([self.paint(input, z=z_, seed=seed, **kwargs) for input, z_, seed in zip(inputs, z, seeds)])
+
 
 class CVAEPainter(Painter):
     def __init__(self, filename=None,
@@ -62,7 +81,10 @@ class CVAEPainter(Painter):
                     validation_pepochs=[0, 1], validation_batch_size=4,
                     validation_loss_frequency=100,
                     validation_loss_batch_size=16,
+                    validation_metrics=True,
                     checkpoint_frequency=1000, statistics_report_frequency=50, 
+                    checkpoint_keep_last=None, checkpoint_keep_every=None,
+                    asynchronous_checkpointing=True,
                     loss_plot_frequency=1000, mavg_window_size=20,
                     plot_sample_var=False,
                     plot_power_spectra=["auto"],
@@ -72,23 +94,78 @@ class CVAEPainter(Painter):
                     output_path=None,
                     verbose=True,
                     pepoch_size=3136,
-                    var_anneal_fn=None, KL_anneal_fn=None):
+                    var_anneal_fn=None, KL_anneal_fn=None,
+                    resume_from=None, shuffle_seed=None,
+                    timing_synchronize=False):
         """Train. We use pseudo epoch as a unit of training time with 
-        1 pepoch = 3136 samples and 64 pepoch = 1 epoch (assuming 4x4 tiling of the stacks)."""
+        1 pepoch = 3136 samples and 64 pepoch = 1 epoch (assuming 4x4 tiling of the stacks).
+
+        Checkpoints are written every ``checkpoint_frequency`` samples, in a 
+        background thread if ``asynchronous_checkpointing`` is set. If 
+        ``checkpoint_keep_last`` is set, only the last ``checkpoint_keep_last``
+        checkpoints plus every ``checkpoint_keep_every``-th are kept on disk.
+
+        Besides the model state and metadata, each checkpoint has a ``_train``
+        file with the full training state (optimizer, scheduler, counters, 
+        statistics, data order, and RNG states). Passing it as ``resume_from``
+        continues the run where the checkpoint was made. With 
+        ``resume_from="latest"``, the most recent checkpoint in ``output_path``
+        is used, or training starts from scratch if there is none. The final
+        checkpoint has a ``_train`` file as well, which marks the run as 
+        finished: resuming from it returns the loaded statistics without 
+        training or overwriting ``model_state``. The order of the training 
+        samples is determined by ``shuffle_seed``. The training data set 
+        gathers whole batches, which it augments if it was created with 
+        ``augment``. The augmentations depend on the epoch of the permutation
+        and are therefore reproduced by resumed runs as well.
+
+        If a process group has been initialised (see 
+        ``baryon_painter.utils.distributed``), the model is trained with 
+        distributed data parallelism. Each rank processes a disjoint shard of
+        the training samples with a batch size of ``batch_size`` and the 
+        gradients are averaged over all ranks. The sample counters, and 
+        therefore pepochs and all frequencies, count the samples of all ranks.
+        Validation, statistics reports, plots, and checkpoints are only done by
+        rank 0, and only rank 0 writes the training and validation statistics.
+        The training statistics are the means over all ranks, so the logged 
+        loss is that of the data-parallel batch. Each rank writes its own log
+        of sample indices.
+
+        The time of each step is split into data wait, host-to-device copy, 
+        forward, backward, optimizer step, statistics, validation, and 
+        checkpointing, and written as JSON lines to ``training_timings.jsonl``
+        in ``output_path`` (one file per rank), together with the throughput 
+        and peak memory. The statistics reports include a summary of the 
+        timings since the last report. On GPUs, ``timing_synchronize`` makes
+        the timings of the phases accurate by synchronising after each phase.
+        When resuming, the steps recorded after the checkpoint are removed 
+        from the timings.
+
+        If ``validation_metrics`` is set, each validation loss evaluation also
+        samples the model and records the fractional deviations of the auto 
+        and cross power spectra in three k bands and the distance between the
+        one-point PDFs of the predicted and true fields (see 
+        ``baryon_painter.utils.validation_metrics``) as additional columns of
+        the validation statistics."""
         
+        if getattr(self, "read_only", False):
+            raise RuntimeError("Trying to train a read-only painter.")
+
         if self.training_data is None:
             raise RuntimeError("Trying to train but no training data specified.")
         
         if len(validation_pepochs) > 0 and self.test_data is None:
             raise RuntimeError("Trying to validate but no test data specified.")            
 
+        rank = distributed.get_rank()
+        world_size = distributed.get_world_size()
+        is_main_process = rank == 0
+        verbose = verbose and is_main_process
+
         self.model.train(True)
         
-        if adaptive_batch_size is None and batch_size > 0:
-            dataloader = torch.utils.data.DataLoader(self.training_data, batch_size=batch_size, shuffle=True)
-        else:
+        if adaptive_batch_size is not None or batch_size <= 0:
             batch_size = adaptive_batch_size(0)
-            dataloader = torch.utils.data.DataLoader(self.training_data, batch_size=batch_size, shuffle=True)
 
         optimizer = torch.optim.Adam(self.model.parameters(), lr=learning_rate)
         if adaptive_learning_rate is not None:
@@ -118,7 +195,11 @@ class CVAEPainter(Painter):
                 for i, l in enumerate(stats_labels):
                     stats_labels[i] = l.replace(f"{j*n_feature_per_field + k}", 
                                                 f"{f}_{k}")
+        validation_stats_labels = list(stats_labels)
+        if validation_metrics:
+            validation_stats_labels += get_validation_metric_labels(self.training_data.label_fields)
         stats_labels += ["lr", "batch_size"]
+        validation_stats_labels += ["lr", "batch_size"]
             
              
         if output_path is not None:
@@ -128,7 +209,15 @@ class CVAEPainter(Painter):
             validation_filename_template = os.path.join(output_path, "{{plot_type}}_epoch{epoch}_batch{batch}_sample{sample}{suffix}.png")
             training_stats_filename = os.path.join(output_path, "training_stats.txt")
             validation_stats_filename = os.path.join(output_path, "validation_stats.txt")
-            training_sample_idx_file = os.path.join(output_path, "training_sample_indicies.txt")
+            if world_size > 1:
+                training_sample_idx_file = os.path.join(output_path, f"training_sample_indicies_rank{rank}.bin")
+                training_timings_filename = os.path.join(output_path, f"training_timings_rank{rank}.jsonl")
+            else:
+                training_sample_idx_file = os.path.join(output_path, "training_sample_indicies.bin")
+                training_timings_filename = os.path.join(output_path, "training_timings.jsonl")
+            if not is_main_process:
+                training_stats_filename = None
+                validation_stats_filename = None
         else:
             if save_plots:
                 raise ValueError("save_plots=True requires output_path to be set.")
@@ -137,14 +226,34 @@ class CVAEPainter(Painter):
             training_stats_filename = None
             validation_stats_filename = None
             training_sample_idx_file = None
+            training_timings_filename = None
+        validation_filename = None
+
+        if resume_from == "latest":
+            if output_path is not None:
+                # A finished run takes precedence over its periodic checkpoints
+                resume_from = find_latest_checkpoint(output_path, pattern="checkpoint_sample*_final_train") \
+                              or find_latest_checkpoint(output_path)
+            else:
+                resume_from = None
+            # Make sure all ranks resume from the same checkpoint
+            resume_from = distributed.broadcast_object(resume_from)
+        resume = resume_from is not None
+        if resume:
+            if verbose: print(f"Resuming training from {resume_from}.")
+            training_state = load_checkpoint(resume_from)
             
-            
+        # The training stats are averaged over the ranks whenever they get 
+        # synchronised, which happens at the same steps on all ranks
         training_stats = TrainingStats(stats_labels, mavg_window_size, 
-                                       stats_filename=training_stats_filename)
+                                       stats_filename=training_stats_filename,
+                                       append=resume,
+                                       reduce=distributed.all_reduce_mean if world_size > 1 else None)
         
-        validation_stats = TrainingStats(stats_labels, mavg_window_size, 
+        validation_stats = TrainingStats(validation_stats_labels, mavg_window_size, 
                                          stats_filename=validation_stats_filename,
-                                         dump_to_file_frequency=1)
+                                         dump_to_file_frequency=1,
+                                         append=resume)
    
                     
         if show_plots:
@@ -153,7 +262,17 @@ class CVAEPainter(Painter):
         if n_pepoch is None:
             n_pepoch = n_epoch*len(self.training_data)//pepoch_size
             
-        training_sample_indicies = []
+        if training_sample_idx_file is not None:
+            sample_index_log = SampleIndexLog(training_sample_idx_file, append=resume)
+        else:
+            sample_index_log = None
+
+        checkpoint_writer = CheckpointWriter(keep_last=checkpoint_keep_last, 
+                                             keep_every=checkpoint_keep_every,
+                                             asynchronous=asynchronous_checkpointing)
+
+        step_timer = profiling.StepTimer(training_timings_filename, append=resume, device=self.model.device,
+                                         synchronize=timing_synchronize)
         
         n_processed_samples = 0
         n_processed_batches = 0
@@ -166,6 +285,134 @@ class CVAEPainter(Painter):
         
         i_epoch = 0
         i_pepoch = 0
+        finished = False
+
+        # Position in the permutations of the training samples
+        if shuffle_seed is None:
+            shuffle_seed = int(np.random.randint(2**31))
+        # All ranks need to use the same permutations
+        shuffle_seed = distributed.broadcast_object(shuffle_seed)
+        sampler_epoch = 0
+        sampler_position = 0
+
+        ELBO = None
+
+        if resume:
+            self.model.load_state_dict(training_state["model"])
+            optimizer.load_state_dict(training_state["optimizer"])
+            if scheduler is not None:
+                scheduler.load_state_dict(training_state["scheduler"])
+            training_stats.load_state_dict(training_state["training_stats"])
+            validation_stats.load_state_dict(training_state["validation_stats"])
+            if sample_index_log is not None:
+                sample_index_log.truncate(training_state["n_sample_index_log"])
+            checkpoint_writer.load_state_dict(training_state["checkpoint_writer"])
+            if len(training_state.get("step_timer_states", [])) == world_size:
+                step_timer.load_state_dict(training_state["step_timer_states"][rank])
+
+            counters = training_state["counters"]
+            n_processed_samples = counters["n_processed_samples"]
+            n_processed_batches = counters["n_processed_batches"]
+            last_pepoch_processed_samples = counters["last_pepoch_processed_samples"]
+            last_loss_plot = counters["last_loss_plot"]
+            last_validation_loss_dump = counters["last_validation_loss_dump"]
+            last_stat_dump = counters["last_stat_dump"]
+            last_checkpoint_dump = counters["last_checkpoint_dump"]
+            i_epoch = counters["i_epoch"]
+            i_pepoch = counters["i_pepoch"]
+            batch_size = counters["batch_size"]
+            shuffle_seed = counters["shuffle_seed"]
+            sampler_epoch = counters["sampler_epoch"]
+            sampler_position = counters["sampler_position"]
+            finished = counters["finished"]
+
+            self.model.alpha_var = training_state["alpha_var"]
+            self.model.beta_KL = training_state["beta_KL"]
+            if training_state["ELBO"] is not None:
+                ELBO = torch.tensor(training_state["ELBO"])
+
+            if world_size > 1:
+                if training_state.get("world_size", 1) != world_size:
+                    raise ValueError(f"Checkpoint was saved with {training_state.get('world_size', 1)} processes but training uses {world_size}.")
+                set_rng_state(training_state["rng_state_per_rank"][rank])
+            else:
+                set_rng_state(training_state["rng_state"])
+            del training_state
+
+        if finished:
+            if verbose: print("Training has already finished.")
+            checkpoint_writer.close()
+            step_timer.close()
+            if sample_index_log is not None:
+                sample_index_log.close()
+            return training_stats, validation_stats
+
+        if world_size > 1:
+            # Broadcasts the parameters of rank 0 and averages the gradients
+            # The variance output doesn't contribute to the loss if alpha_var is 0
+            train_model = torch.nn.parallel.DistributedDataParallel(self.model, 
+                                                                    find_unused_parameters=self.model.predict_var)
+        else:
+            train_model = self.model
+
+        def get_training_state(checkpoint_filenames):
+            # Needs to be called on all ranks
+            rng_states = distributed.all_gather_object(get_rng_state())
+            # Each rank writes its own timings file
+            step_timer_states = distributed.all_gather_object(step_timer.state_dict())
+            if ELBO is not None:
+                # Mean over ranks, as used by the plateau scheduler
+                ELBO_mean = float(distributed.all_reduce_mean(ELBO))
+            else:
+                ELBO_mean = None
+            if sample_index_log is not None:
+                sample_index_log.flush()
+            counters = {"n_processed_samples"           : n_processed_samples,
+                        "n_processed_batches"           : n_processed_batches,
+                        "last_pepoch_processed_samples" : last_pepoch_processed_samples,
+                        "last_loss_plot"                : last_loss_plot,
+                        "last_validation_loss_dump"     : last_validation_loss_dump,
+                        "last_stat_dump"                : last_stat_dump,
+                        "last_checkpoint_dump"          : last_checkpoint_dump,
+                        "i_epoch"                       : i_epoch,
+                        "i_pepoch"                      : i_pepoch,
+                        "batch_size"                    : batch_size,
+                        "shuffle_seed"                  : shuffle_seed,
+                        "sampler_epoch"                 : sampler_epoch,
+                        "sampler_position"              : sampler_position,
+                        "finished"                      : finished,
+                       }
+            return {"model"              : self.model.state_dict(),
+                    "optimizer"          : optimizer.state_dict(),
+                    "scheduler"          : scheduler.state_dict() if scheduler is not None else None,
+                    "counters"           : counters,
+                    "alpha_var"          : self.model.alpha_var,
+                    "beta_KL"            : self.model.beta_KL,
+                    "ELBO"               : ELBO_mean,
+                    "training_stats"     : training_stats.state_dict(),
+                    "validation_stats"   : validation_stats.state_dict(),
+                    "n_sample_index_log" : len(sample_index_log) if sample_index_log is not None else None,
+                    "step_timer_states"  : step_timer_states,
+                    "checkpoint_writer"  : checkpoint_writer.state_dict(checkpoint_filenames),
+                    "rng_state"          : rng_states[0],
+                    "rng_state_per_rank" : rng_states,
+                    "world_size"         : world_size,
+                   }
+
+        def create_dataloader():
+            sampler = datasets.ShuffledSampler(len(self.training_data), seed=shuffle_seed,
+                                               epoch=sampler_epoch, start=sampler_position,
+                                               rank=rank, world_size=world_size)
+            # The data set gathers (and augments) whole batches
+            batch_sampler = torch.utils.data.BatchSampler(sampler, batch_size=batch_size, drop_last=False)
+            if hasattr(self.training_data, "set_epoch"):
+                self.training_data.set_epoch(sampler_epoch)
+            # Use a separate generator so that creating the dataloader doesn't
+            # advance the global RNG
+            return torch.utils.data.DataLoader(self.training_data, batch_size=None, sampler=batch_sampler,
+                                               generator=torch.Generator())
+
+        dataloader = create_dataloader()
 
         while i_epoch < n_epoch:
             i_epoch = n_processed_samples//len(self.training_data)
@@ -175,6 +422,7 @@ class CVAEPainter(Painter):
                 break
                 
             for i_batch, batch_data in enumerate(dataloader):
+                step_timer.lap("data_wait")
 
                 if n_processed_samples - pepoch_size >= last_pepoch_processed_samples or n_processed_samples == 0:
                     if n_processed_samples != 0:
@@ -185,7 +433,7 @@ class CVAEPainter(Painter):
                             
                         if scheduler is not None: 
                             if adaptive_learning_rate == "avoid_plateau":
-                                scheduler.step(float(ELBO.item()))
+                                scheduler.step(float(distributed.all_reduce_mean(ELBO).item()))
                             else:
                                 scheduler.step()
 
@@ -195,7 +443,7 @@ class CVAEPainter(Painter):
                         self.model.beta_KL = KL_anneal_fn(i_pepoch)
                         
                     # Make diagnostic plots
-                    if i_pepoch in validation_pepochs:
+                    if i_pepoch in validation_pepochs and is_main_process:
                         if save_plots:
                             validation_filename = validation_filename_template.format(epoch=i_epoch, batch=i_batch, sample=n_processed_samples, suffix="")
                         self.validate(validation_batch_size=validation_batch_size, 
@@ -211,8 +459,10 @@ class CVAEPainter(Painter):
                         new_batch_size = adaptive_batch_size(i_pepoch)
                         if new_batch_size != batch_size:
                             batch_size = new_batch_size
-                            dataloader = torch.utils.data.DataLoader(self.training_data, batch_size=batch_size, shuffle=True)
+                            # Continue with the samples that haven't been processed yet
+                            dataloader = create_dataloader()
                             break
+                    step_timer.lap("pepoch")
 
                 x = torch.cat(batch_data[0][1:], dim=1).to(self.model.device)
                 y = batch_data[0][0].to(self.model.device)
@@ -220,27 +470,36 @@ class CVAEPainter(Painter):
                     aux_label = batch_data[2].to(device=self.model.device, dtype=y.dtype)
                 else:
                     aux_label = None
+                step_timer.lap("h2d")
                     
-                ELBO = self.model(x, y, aux_label)
+                ELBO = train_model(x, y, aux_label)
+                step_timer.lap("forward")
                 
                 optimizer.zero_grad()
                 (-ELBO).backward()
+                step_timer.lap("backward")
                 optimizer.step()
+                step_timer.lap("optimizer")
                 
-                n_processed_samples += x.size(0)
+                n_processed_samples += x.size(0)*world_size
                 n_processed_batches += 1
+                sampler_position += x.size(0)*world_size
                                 
                 with torch.no_grad():
-                    training_sample_indicies += list(batch_data[1].numpy())
+                    if sample_index_log is not None:
+                        sample_index_log.append(batch_data[1], n_processed_batches-1)
                     
                     lr = [p["lr"] for p in optimizer.param_groups]
-                    training_stats.push_loss(n_processed_samples, *self.model.get_stats(), lr[0], batch_size)
+                    training_stats.push_loss(n_processed_samples, self.model.get_stats(as_tensor=True), lr[0], batch_size)
+                    step_timer.lap("stats")
                     if n_processed_samples - validation_loss_frequency >= last_validation_loss_dump:
                         last_validation_loss_dump = n_processed_samples
-                        # Get validation loss
-                        stats = self.validate(validation_batch_size=validation_loss_batch_size,
-                                              compute_loss=True)
-                        validation_stats.push_loss(n_processed_samples, *stats, lr[0], batch_size)
+                        if is_main_process:
+                            # Get validation loss
+                            stats = self.validate(validation_batch_size=validation_loss_batch_size,
+                                                  compute_loss=True, compute_metrics=validation_metrics)
+                            validation_stats.push_loss(n_processed_samples, stats, lr[0], batch_size)
+                        step_timer.lap("validation")
 
                     if n_processed_samples - checkpoint_frequency >= last_checkpoint_dump and model_checkpoint_template is not None:
                         last_checkpoint_dump = n_processed_samples
@@ -248,52 +507,96 @@ class CVAEPainter(Painter):
                                                                                     batch=i_batch, 
                                                                                     sample=n_processed_samples,
                                                                                     suffix="")
-                        self.save_state_to_file((checkpoint_base_filename+"_state", checkpoint_base_filename+"_meta"))
+                        checkpoint_filenames = (checkpoint_base_filename+"_state", 
+                                                checkpoint_base_filename+"_meta", 
+                                                checkpoint_base_filename+"_train")
+                        training_state = get_training_state(checkpoint_filenames)
+                        if is_main_process:
+                            self.save_state_to_file(checkpoint_filenames,
+                                                    checkpoint_writer=checkpoint_writer,
+                                                    training_state=training_state)
+                        del training_state
+                        step_timer.flush()
+                        step_timer.lap("checkpoint")
                         
                     if n_processed_samples - statistics_report_frequency >= last_stat_dump and statistics_report_frequency > 0:
                         last_stat_dump = n_processed_samples
                         
-                        print("Epoch: [{}/{}], P-Epoch: [{}/{}], Batch: [{}/{}], Loss: {:.3e}".format(i_epoch, n_epoch, 
-                                                                                                      i_pepoch, n_pepoch, 
-                                                                                                      i_batch, len(self.training_data)//batch_size,
-                                                                                                      training_stats.loss_terms["ELBO"]["mavg"][-1]))
-                        print("Processed batches: {}, processed samples: {}, batch size: {}, learning rate: {}".format(n_processed_batches, n_processed_samples, batch_size,
-                                                                                                    " ".join("{:.1e}".format(lr_) for lr_ in lr)))
-                        print(training_stats.get_pretty_str(n_col=1))
-                        
-                        if training_sample_idx_file is not None:
-                            with open(training_sample_idx_file, "wb") as f:
-                                pickle.dump(training_sample_indicies, f)
-                            
+                        if sample_index_log is not None:
+                            sample_index_log.flush()
+                        training_stats.flush_to_file()
+                        if is_main_process:
+                            print("Epoch: [{}/{}], P-Epoch: [{}/{}], Batch: [{}/{}], Loss: {:.3e}".format(i_epoch, n_epoch, 
+                                                                                                          i_pepoch, n_pepoch, 
+                                                                                                          i_batch, len(self.training_data)//batch_size,
+                                                                                                          training_stats.get_mavg("ELBO")))
+                            print("Processed batches: {}, processed samples: {}, batch size: {}, learning rate: {}".format(n_processed_batches, n_processed_samples, batch_size,
+                                                                                                        " ".join("{:.1e}".format(lr_) for lr_ in lr)))
+                            print(training_stats.get_pretty_str(n_col=1))
+                            print(step_timer.get_pretty_str())
                     
                     if n_processed_samples - loss_plot_frequency >= last_loss_plot and loss_plot_frequency > 0:
                         last_loss_plot = n_processed_samples
-                        training_stats.plot_loss(window_size=200)
-                        if show_plots:
-                            plt.show()
+                        training_stats.flush_to_file()
+                        if is_main_process:
+                            training_stats.plot_loss(window_size=200)
+                            if show_plots:
+                                plt.show()
+                    step_timer.lap("stats")
+                    step_timer.end_step(x.size(0)*world_size, batch=n_processed_batches, 
+                                        sample=n_processed_samples, batch_size=batch_size)
+            else:
+                # All samples have been processed, start the next permutation
+                sampler_epoch += 1
+                sampler_position = 0
+                dataloader = create_dataloader()
                         
-        if save_plots:
-            validation_filename = validation_filename_template.format(epoch=i_epoch, batch=i_batch, sample=n_processed_samples, suffix="_final")
-        self.validate(validation_batch_size=validation_batch_size, 
-                      plot_sample_var=plot_sample_var,
-                      plot_power_spectra=plot_power_spectra,
-                      plot_histogram=plot_histogram,
-                      show_plots=show_plots,
-                      save_plots=save_plots,
-                      filename_template=validation_filename
-                     )
+        if self.test_data is not None and is_main_process:
+            if save_plots:
+                validation_filename = validation_filename_template.format(epoch=i_epoch, batch=i_batch, sample=n_processed_samples, suffix="_final")
+            self.validate(validation_batch_size=validation_batch_size, 
+                          plot_sample_var=plot_sample_var,
+                          plot_power_spectra=plot_power_spectra,
+                          plot_histogram=plot_histogram,
+                          show_plots=show_plots,
+                          save_plots=save_plots,
+                          filename_template=validation_filename
+                         )
         
-        checkpoint_base_filename = model_checkpoint_template.format(epoch=i_epoch, 
-                                                                    batch=i_batch, 
-                                                                    sample=n_processed_samples,
-                                                                    suffix="_final")
-        self.save_state_to_file((checkpoint_base_filename+"_state", checkpoint_base_filename+"_meta"))
-        self.save_state_to_file((os.path.join(output_path, "model_state"), os.path.join(output_path, "model_meta")))
+        if world_size > 1:
+            # Buffers are only synchronised at the start of a forward pass, 
+            # make sure all ranks end up with the model of rank 0
+            distributed.broadcast_buffers(self.model)
+
+        finished = True
+        if model_checkpoint_template is not None:
+            checkpoint_base_filename = model_checkpoint_template.format(epoch=i_epoch, 
+                                                                        batch=i_batch, 
+                                                                        sample=n_processed_samples,
+                                                                        suffix="_final")
+            # The final checkpoint is exempt from the retention policy
+            training_state = get_training_state(None)
+            if is_main_process:
+                self.save_state_to_file((checkpoint_base_filename+"_state", 
+                                         checkpoint_base_filename+"_meta",
+                                         checkpoint_base_filename+"_train"),
+                                        checkpoint_writer=checkpoint_writer, protect=True,
+                                        training_state=training_state)
+                self.save_state_to_file((os.path.join(output_path, "model_state"), os.path.join(output_path, "model_meta")),
+                                        checkpoint_writer=checkpoint_writer, protect=True)
+            del training_state
+        checkpoint_writer.close()
+        step_timer.close()
+
+        training_stats.flush_to_file()
+        validation_stats.flush_to_file()
+        if sample_index_log is not None:
+            sample_index_log.close()
 
         return training_stats, validation_stats
 
     def validate(self, validation_batch_size=8,
-                       compute_loss=False,
+                       compute_loss=False, compute_metrics=False,
                        validation_redshift=None,
                        plot_samples=1, plot_sample_var=False, 
                        plot_power_spectra=["auto"], 
@@ -301,8 +604,6 @@ class CVAEPainter(Painter):
                        show_plots=True,
                        save_plots=False,
                        filename_template="{plot_type}.png"):
-        import matplotlib.pyplot as plt
-
         with torch.no_grad():
             fields, indicies, z = self.test_data.get_batch(size=validation_batch_size, z=validation_redshift)
             x = torch.tensor(np.concatenate(fields[1:], axis=1), device=self.model.device)
@@ -311,7 +612,24 @@ class CVAEPainter(Painter):
 
             if compute_loss:
                 ELBO = self.model(x, y, aux_label)
-                return self.model.get_stats()
+                stats = self.model.get_stats(as_tensor=True)
+                if compute_metrics:
+                    # Spectral and PDF metrics of a sample, without plotting
+                    x_pred = self.model.sample_P(y, aux_label=aux_label)
+                    inverse_transforms = [self.test_data.get_inverse_transforms(idx) for idx in indicies]
+                    metrics = compute_validation_metrics(output_true=x.cpu().numpy(), 
+                                                         input=y.cpu().numpy(), 
+                                                         output_pred=x_pred.cpu().numpy(),
+                                                         L=self.test_data.tile_L,
+                                                         input_transform=[t[0] for t in inverse_transforms],
+                                                         output_transforms=[t[1:] for t in inverse_transforms],
+                                                         n_feature_per_field=self.test_data.n_feature_per_field)
+                    stats = torch.cat([stats, torch.tensor(metrics, device=stats.device, dtype=stats.dtype)])
+                return stats
+
+            # Only load the plotting dependencies when plotting
+            import matplotlib.pyplot as plt
+            from baryon_painter.utils import validation_plotting, power_spectrum
             
             if plot_sample_var:
                 x_pred, x_pred_var = self.model.sample_P(y, return_var=True, aux_label=aux_label)
@@ -335,6 +653,14 @@ class CVAEPainter(Painter):
                     fig.savefig(filename_template.format(plot_type="sample"))
 
             if plot_power_spectra is not None:
+                # Auto and cross spectra of the whole batch from one FFT of each field
+                spectra = power_spectrum.compute_spectra(output_true=x.cpu().numpy(), 
+                                                         input=y.cpu().numpy(), 
+                                                         output_pred=x_pred.cpu().numpy(),
+                                                         L=self.test_data.tile_L,
+                                                         input_transform=[t[0] for t in inverse_transforms],
+                                                         output_transforms=[t[1:] for t in inverse_transforms],
+                                                         n_feature_per_field=self.test_data.n_feature_per_field)
                 for mode in plot_power_spectra:
                     fig, _ = validation_plotting.plot_power_spectra(output_true=x.cpu().numpy(), 
                                                            input=y.cpu().numpy(), 
@@ -342,9 +668,8 @@ class CVAEPainter(Painter):
                                                            L=self.test_data.tile_L,
                                                            output_labels=self.test_data.label_fields,
                                                            mode=mode,
-                                                           input_transform=[t[0] for t in inverse_transforms],
-                                                           output_transforms=[t[1:] for t in inverse_transforms],
-                                                           n_feature_per_field=self.test_data.n_feature_per_field)
+                                                           n_feature_per_field=self.test_data.n_feature_per_field,
+                                                           spectra=spectra)
                     if show_plots:
                         fig.show()
                     if save_plots:
@@ -368,11 +693,27 @@ class CVAEPainter(Painter):
             
             
 
-    def paint(self, input, z=0.0, transform=True, inverse_transform=True):
+    def paint(self, input, z=0.0, transform=True, inverse_transform=True, n_sample=1, seed=None):
+        """Paint on a tile.
+
+        With ``n_sample`` > 1, ``n_sample`` realisations are painted in one 
+        batched pass and returned along a new leading axis.
+
+        If ``seed`` is provided, the latent noise is derived from it instead of
+        the global RNG. ``seed`` can be an int or a tuple of ints, such as 
+        (seed, LOS, plane, tile), and realisation ``i`` uses the key 
+        ``(*seed, i)``. The painted tile then only depends on the key, not on
+        the order or batching of the painting.
+
+        If the model has more than one label field, all fields are painted in
+        the same pass and inverse transformed with their own transform. They 
+        are returned along an additional axis before the spatial axes, in the
+        order of ``label_fields``."""
         self.model.train(False)
         with torch.no_grad():
             if transform and self.transform is not None:
-                y = self.transform(input, field=self.input_field, z=z)
+                with profiling.stage("paint.transform"):
+                    y = self.transform(input, field=self.input_field, z=z)
             else:
                 y = input
             y = y.reshape(1, *y.shape)
@@ -380,22 +721,73 @@ class CVAEPainter(Painter):
                 raise ValueError(f"Shape mismatch between input and model: {input.shape} vs {self.model.dim_y}")
             y = torch.tensor(y, device=self.compute_device)
             aux_label = torch.tensor(z, device=self.compute_device, dtype=y.dtype)
-            prediction = self.model.sample_P(y, aux_label=aux_label,
-#                                              z=np.zeros((1,*self.model.dim_z))
-                                            ).cpu().numpy()
+            if seed is not None:
+                key = tuple(np.atleast_1d(seed))
+                eps = torch.stack([standard_normal((1, *self.model.dim_z), key=(*key, i), dtype=y.dtype) 
+                                   for i in range(n_sample)])
+            else:
+                eps = None
+            with profiling.stage("paint.forward"):
+                prediction = self.model.sample_P(y, aux_label=aux_label, n_sample=n_sample, eps=eps,
+#                                                  z=np.zeros((1,*self.model.dim_z))
+                                                ).cpu().numpy()
         
         if inverse_transform and self.inverse_transform is not None:
-            if len(self.label_fields) > 1:
-                raise NotImplementedError("Painting with more than one output field is not supported yet.")
-            return self.inverse_transform(prediction, field=self.label_fields[0], z=z)
+            with profiling.stage("paint.inverse_transform"):
+                if n_sample > 1:
+                    return np.stack([self._inverse_transform_fields(p, z) for p in prediction])
+                return self._inverse_transform_fields(prediction, z)
         else:
             return prediction
 
 
-    def save_state_to_file(self, filename, mode="model_state_dict+metadata"):
-        if not isinstance(filename, (tuple, list)):
-            raise ValueError("filename needs to be a tuple of (state_filename, meta_filename).")
-            
+    def _inverse_transform_fields(self, prediction, z):
+        # Each field has n_feature_per_field channels of the prediction of 
+        # shape (1, n_x_features, ...) and its own inverse transform
+        if len(self.label_fields) == 1:
+            return self.inverse_transform(prediction, field=self.label_fields[0], z=z)
+        n_feature_per_field = prediction.shape[1]//len(self.label_fields)
+        return np.stack([self.inverse_transform(prediction[:,i*n_feature_per_field:(i+1)*n_feature_per_field], 
+                                                field=field, z=z) 
+                         for i, field in enumerate(self.label_fields)])
+
+    def paint_batch(self, inputs, z=0.0, transform=True, inverse_transform=True, seeds=None):
+        """Paint on a batch of tiles in a single pass through the model.
+
+        ``z`` can be a scalar or one redshift per tile, and ``seeds`` a list 
+        with a seed for each tile (see ``paint``). The result is the same as
+        calling ``paint`` on each tile with the same seed."""
+        self.model.train(False)
+        z = np.broadcast_to(np.asarray(z, dtype=np.float64), (len(inputs),))
+        with torch.no_grad():
+            if transform and self.transform is not None:
+                with profiling.stage("paint.transform", count=len(inputs)):
+                    y = np.stack([self.transform(input, field=self.input_field, z=z_) for input, z_ in zip(inputs, z)])
+            else:
+                y = np.asarray(inputs)
+                if y.ndim == len(self.model.dim_y):
+                    y = y[:,None]
+            if y.shape[1:] != self.model.dim_y:
+                raise ValueError(f"Shape mismatch between input and model: {y.shape[1:]} vs {self.model.dim_y}")
+            y = torch.tensor(y, device=self.compute_device)
+            aux_label = torch.tensor(z, device=self.compute_device, dtype=y.dtype)
+            if seeds is not None:
+                eps = torch.stack([standard_normal(self.model.dim_z, key=(*np.atleast_1d(seed), 0), dtype=y.dtype)
+                                   for seed in seeds])[None]
+            else:
+                eps = None
+            with profiling.stage("paint.forward", count=len(inputs)):
+                prediction = self.model.sample_P(y, aux_label=aux_label, eps=eps).cpu().numpy()
+
+        if inverse_transform and self.inverse_transform is not None:
+            with profiling.stage("paint.inverse_transform", count=len(inputs)):
+                return np.stack([self._inverse_transform_fields(p[None], z_) for p, z_ in zip(prediction, z)])
+        else:
+            # Same shape as the output of paint for each tile
+            return prediction[:,None]
+
+    def get_state_metadata(self):
+        """Returns the metadata needed to paint with the model."""
         d = {"L"              : self.training_data.L,
              "n_grid"         : self.training_data.n_grid,
              "tile_L"         : self.training_data.tile_L,
@@ -412,15 +804,42 @@ class CVAEPainter(Painter):
                                                              stats=self.training_data.stats)
         
         d["model_architecture"] = self.architecture
+
+        return d
+
+    def save_state_to_file(self, filename, mode="model_state_dict+metadata", 
+                           checkpoint_writer=None, protect=False, training_state=None):
+        """Save the model state and metadata.
+
+        If a ``CheckpointWriter`` is provided, a snapshot of the state is handed
+        to it and written in the background. ``protect`` exempts the files 
+        from the writer's retention policy. If ``training_state`` is provided,
+        it gets written to a third file, ``filename[2]``."""
+        if not isinstance(filename, (tuple, list)):
+            raise ValueError("filename needs to be a tuple of (state_filename, meta_filename).")
+        if training_state is not None and len(filename) < 3:
+            raise ValueError("Saving the training state requires a tuple of (state_filename, meta_filename, training_state_filename).")
+            
+        d = self.get_state_metadata()
         
-        with open(filename[1], "wb") as f:
-            dill.dump(d, f)
-        torch.save(self.model.state_dict(), filename[0])
+        if checkpoint_writer is None:
+            atomic_dump(d, filename[1], dill.dump)
+            atomic_dump(self.model.state_dict(), filename[0], torch.save)
+            if training_state is not None:
+                atomic_dump(training_state, filename[2], torch.save)
+        else:
+            files = [(filename[1], d, dill.dump),
+                     (filename[0], snapshot(self.model.state_dict()), torch.save)]
+            if training_state is not None:
+                files.append((filename[2], snapshot(training_state), torch.save))
+            checkpoint_writer.submit(files, protect=protect)
             
             
     def load_state_from_file(self, filename, compute_device="cpu"):
         if not isinstance(filename, (tuple, list)):
             raise ValueError("filename needs to be a tuple of (state_filename, meta_filename).")
+        if getattr(self, "read_only", False):
+            raise RuntimeError("Trying to load a state into a read-only painter.")
             
         self.compute_device = compute_device
         
@@ -443,103 +862,3 @@ class CVAEPainter(Painter):
         self.scale_to_SLICS = d["scale_to_SLICS"]
         self.transform = d["transform"] if "transform" in d else None
         self.inverse_transform = d["inverse_transform"] if "inverse_transform" in d else None
-
-class TrainingStats:
-    def __init__(self, loss_terms=[], moving_average_window=100, dump_to_file_frequency=10, stats_filename=None):
-        self.mavg_window = moving_average_window
-        self.n_batches = 0
-        self.n_processed_samples = []
-        
-        self.last_dump_to_file = 0
-        self.dump_to_file_frequency = dump_to_file_frequency
-        
-        self.loss_terms = collections.OrderedDict()
-        for loss_term in loss_terms:
-            self.loss_terms[loss_term] = {"all" : [], "mavg" : []}       
-            
-        self.stats_filename = stats_filename
-        if self.stats_filename is not None:
-            with open(self.stats_filename, "w") as f:
-                f.write("# Batch nr, sample nr, {}\n".format(", ".join(loss_terms)))
-    
-    def __del__(self):
-        if self.stats_filename is not None:
-            self.flush_to_file()
-                    
-    def push_loss(self, n_sample, *args):
-        self.n_batches += 1
-        self.n_processed_samples.append(n_sample)
-        for i, loss_term in enumerate(self.loss_terms.values()):
-            loss_term["all"].append(args[i])
-            loss_term["mavg"].append(np.mean(loss_term["all"][-min(self.n_batches, self.mavg_window):]))
-        
-        if self.n_batches - self.dump_to_file_frequency >= self.last_dump_to_file \
-           and self.stats_filename is not None:
-            self.flush_to_file()
-            
-    def flush_to_file(self):
-        with open(self.stats_filename, "a") as f:
-            for s in range(self.last_dump_to_file, self.n_batches):
-                f.write(self.get_str(s) + "\n")
-        self.last_dump_to_file = self.n_batches
-        
-    def get_str(self, idx=-1):
-        batch = idx if idx >= 0 else self.n_batches + idx + 1
-        s = f"{batch} {self.n_processed_samples[idx]} "
-        for loss in self.loss_terms.values():
-            s += f"{loss['all'][idx]} "
-        return s
-        
-    def get_pretty_str(self, n_col=1):
-        s = ""
-        max_len_key = max([len(key) for key in self.loss_terms.keys()])
-        items_per_row = 0
-        for i, (key, term) in enumerate(self.loss_terms.items()):
-            s += "{key:<{width}s}: {value:8.3e}     ".format(key=key, width=max_len_key, value=term["mavg"][-1])
-            items_per_row += 1
-            if items_per_row >= n_col:
-                s += "\n"
-                items_per_row = 0
-        return s
-
-    def plot_loss(self, loss_term="ELBO", window_size=200, burn_in=100):
-        import matplotlib.pyplot as plt
-
-        fig, ax = plt.subplots(1, 2, figsize=(8, 3))
-        fig.subplots_adjust(wspace=0.3)
-        
-        n = self.n_batches
-        
-        n_sample = self.n_processed_samples
-        total_loss = self.loss_terms[loss_term]["all"]
-        total_loss_mavg = self.loss_terms[loss_term]["mavg"]
-        
-        x_range = n_sample[max(0, n-window_size):]
-        ax[1].plot(x_range, total_loss[max(0, n-window_size):], alpha=0.5, label="{}".format(loss_term))
-        ax[1].plot(x_range, total_loss_mavg[max(0, n-window_size):], label="{} mavg".format(loss_term))
-        ax[1].legend()
-        ax[1].set_ylim(min(total_loss[max(0, n-window_size):]), max(total_loss[max(0, n-window_size):]))
-        ax[1].set_xlabel("Number of samples")
-        ax[1].set_ylabel(loss_term)
-
-        if n > burn_in:
-            n_sample = n_sample[burn_in:]
-            total_loss = total_loss[burn_in:]
-            total_loss_mavg = total_loss_mavg[burn_in:]
-        if len(total_loss) > 500:
-            step = len(total_loss)//500
-            n_sample = n_sample[::step]
-            total_loss = total_loss[::step]
-            total_loss_mavg = total_loss_mavg[::step]            
-        
-        ax[0].semilogy(n_sample, 
-                       np.abs(total_loss), 
-                       alpha=0.5, label="{}".format(loss_term))
-        ax[0].semilogy(n_sample, 
-                       np.abs(total_loss_mavg), 
-                       label="{} mavg".format(loss_term))
-        ax[0].legend()
-        ax[0].set_xlabel("Number of samples")
-        ax[0].set_ylabel(loss_term)
-
-        return fig, ax
\ No newline at end of file
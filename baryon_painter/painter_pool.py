@@ -0,0 +1,308 @@
+"""Painting with several CPU worker processes.
+
+A single small forward pass per tile doesn't scale well with the number of
+intra-op threads of PyTorch. ``PainterPool`` instead partitions the cores of a
+node into several worker processes, each with its own painter and intra-op
+thread count, and optionally pinned to its own set of cores. The workers take
+tiles from a shared queue. ``autotune`` measures the throughput of different
+layouts and picks the fastest one for the node.
+
+The pool can be passed to ``process_SLICS`` in place of a painter, which then
+submits the tiles of a row while the previous row gets blended.
+
+Example
+-------
+::
+
+    factory = functools.partial(CVAEPainter, (state_filename, meta_filename))
+    layout, results = autotune(factory)
+    with PainterPool(factory, **layout) as pool:
+        painted_planes = process_SLICS(pool, ...)
+
+or from the command line::
+
+    python -m baryon_painter.painter_pool --model-path trained_models/CVAE/fiducial/
+"""
+
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import traceback
+import functools
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+
+def get_available_cores():
+    """Returns the sorted list of cores the process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def _worker(painter_factory, n_thread, cores, task_queue, result_queue):
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(n_thread)
+
+    try:
+        painter = painter_factory()
+    except Exception:
+        result_queue.put(("init", None, traceback.format_exc()))
+        return
+    result_queue.put(("init", getattr(painter, "label_fields", None), None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, input, kwargs = task
+        try:
+            result_queue.put((task_id, painter.paint(input=input, **kwargs), None))
+        except Exception:
+            result_queue.put((task_id, None, traceback.format_exc()))
+
+class PainterPool:
+    """Paints tiles with several worker processes.
+
+    Arguments
+    ---------
+    painter_factory : callable
+        Picklable callable without arguments that returns the painter, e.g.,
+        ``functools.partial(CVAEPainter, (state_filename, meta_filename))``.
+        It is called once in each worker.
+    n_worker : int, optional
+        Number of worker processes. (default number of available cores
+        divided by ``n_thread_per_worker``).
+    n_thread_per_worker : int, optional
+        Number of intra-op threads of each worker. (default 1).
+    pin_cores : bool, optional
+        Pin each worker to ``n_thread_per_worker`` of the available cores.
+        Only supported on Linux. (default False).
+    start_method : str, optional
+        Start method of the worker processes. "fork" starts faster but is not
+        safe if the parent process already used PyTorch's thread pool.
+        (default "spawn").
+    """
+    def __init__(self, painter_factory, n_worker=None, n_thread_per_worker=1, pin_cores=False,
+                 start_method="spawn"):
+        cores = get_available_cores()
+        if n_worker is None:
+            n_worker = max(1, len(cores)//n_thread_per_worker)
+        if pin_cores and n_worker*n_thread_per_worker > len(cores):
+            raise ValueError(f"Can't pin {n_worker} workers with {n_thread_per_worker} threads "
+                             f"to {len(cores)} cores.")
+        self.n_worker = n_worker
+        self.n_thread_per_worker = n_thread_per_worker
+
+        context = multiprocessing.get_context(start_method)
+        self._task_queue = context.Queue()
+        self._result_queue = context.Queue()
+        self._workers = []
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._n_task = 0
+        self._closed = False
+
+        # Stop the workers that were started if any of them fails to start
+        try:
+            for i in range(n_worker):
+                worker_cores = cores[i*n_thread_per_worker:(i+1)*n_thread_per_worker] if pin_cores else None
+                p = context.Process(target=_worker,
+                                    args=(painter_factory, n_thread_per_worker, worker_cores,
+                                          self._task_queue, self._result_queue),
+                                    daemon=True)
+                p.start()
+                self._workers.append(p)
+
+            # Wait for the painters to be loaded
+            n_ready = 0
+            while n_ready < n_worker:
+                try:
+                    _, label_fields, error = self._result_queue.get(timeout=1.0)
+                except queue.Empty:
+                    self._check_workers()
+                    continue
+                if error is not None:
+                    raise RuntimeError(f"Failed to create the painter in a worker:\n{error}")
+                n_ready += 1
+        except BaseException:
+            self.close()
+            raise
+
+        # Fields painted by the painter, if it has label_fields
+        self.label_fields = label_fields
+
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_workers(self):
+        dead = [p for p in self._workers if not p.is_alive()]
+        if len(dead) > 0 and not self._closed:
+            raise RuntimeError(f"Worker {dead[0].pid} died with exit code {dead[0].exitcode}.")
+
+    def _fail_pending(self, error):
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for f in futures.values():
+            f.set_exception(error)
+
+    def _collect(self):
+        while True:
+            try:
+                result = self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                try:
+                    self._check_workers()
+                except RuntimeError as e:
+                    self._fail_pending(e)
+                    return
+                continue
+            if result is None:
+                return
+            task_id, output, error = result
+            with self._lock:
+                future = self._futures.pop(task_id)
+            if error is not None:
+                future.set_exception(RuntimeError(f"Painting failed in a worker:\n{error}"))
+            else:
+                future.set_result(output)
+
+    def submit(self, input, **kwargs):
+        """Submits a tile to be painted with ``painter.paint(input=input, **kwargs)``.
+        Returns a ``concurrent.futures.Future``."""
+        if self._closed:
+            raise RuntimeError("Pool is closed.")
+        future = concurrent.futures.Future()
+        with self._lock:
+            task_id = self._n_task
+            self._n_task += 1
+            self._futures[task_id] = future
+        self._task_queue.put((task_id, np.asarray(input), kwargs))
+        return future
+
+    def paint(self, input, **kwargs):
+        """Paints a tile and waits for the result."""
+        return self.submit(input, **kwargs).result()
+
+    def paint_batch(self, inputs, z=0.0, seeds=None, **kwargs):
+        """Paints a batch of tiles, distributed over the workers."""
+        z = np.broadcast_to(z, (len(inputs),))
+        if seeds is None:
+            seeds = [None]*len(inputs)
+        futures = [self.submit(input, z=z_, seed=seed, **kwargs) for input, z_, seed in zip(inputs, z, seeds)]
+        return np.stack([f.result() for f in futures])
+
+    def close(self):
+        """Stops the workers."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for p in self._workers:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        if hasattr(self, "_thread"):
+            self._result_queue.put(None)
+            self._thread.join()
+        self._fail_pending(RuntimeError("Pool was closed."))
+
+def get_layouts(n_core):
+    """Returns the layouts (n_worker, n_thread_per_worker) that use all
+    ``n_core`` cores."""
+    return [(n_core//n_thread, n_thread) for n_thread in range(1, n_core+1) if n_core % n_thread == 0]
+
+def autotune(painter_factory, tile_shape=(512, 512), n_core=None, layouts=None, n_tile_per_worker=4,
+             pin_cores=False, z=0.0, seed=0, start_method="spawn", verbose=True):
+    """Measures the painting throughput of different pool layouts.
+
+    Arguments
+    ---------
+    painter_factory : callable
+        See ``PainterPool``.
+    tile_shape : tuple, optional
+        Shape of the input tiles. (default (512, 512)).
+    n_core : int, optional
+        Number of cores to use. (default all available cores).
+    layouts : list, optional
+        Layouts (n_worker, n_thread_per_worker) to try. (default all layouts
+        that use ``n_core`` cores, see ``get_layouts``).
+    n_tile_per_worker : int, optional
+        Number of tiles painted by each worker in a timing. (default 4).
+    pin_cores : bool, optional
+        Pin the workers to cores. (default False).
+    z : float, optional
+        Redshift of the tiles. (default 0).
+    seed : int, optional
+        Seed of the random tiles. (default 0).
+    start_method : str, optional
+        See ``PainterPool``. (default "spawn").
+    verbose : bool, optional
+        Print the throughput of each layout. (default True).
+
+    Returns
+    -------
+    best : dict
+        Keyword arguments ``n_worker``, ``n_thread_per_worker``, and
+        ``pin_cores`` of the fastest layout, to be passed to ``PainterPool``.
+    results : list
+        Throughput in tiles per second of each layout.
+    """
+    if n_core is None:
+        n_core = len(get_available_cores())
+    if layouts is None:
+        layouts = get_layouts(n_core)
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for n_worker, n_thread in layouts:
+        n_tile = n_worker*n_tile_per_worker
+        tiles = rng.lognormal(size=(n_tile, *tile_shape)).astype(np.float32)
+        with PainterPool(painter_factory, n_worker=n_worker, n_thread_per_worker=n_thread,
+                         pin_cores=pin_cores, start_method=start_method) as pool:
+            # Warm up each worker
+            pool.paint_batch(tiles[:n_worker], z=z)
+            t_start = time.perf_counter()
+            pool.paint_batch(tiles, z=z)
+            t = time.perf_counter() - t_start
+        results.append({"n_worker"            : n_worker,
+                        "n_thread_per_worker" : n_thread,
+                        "tiles_per_s"         : n_tile/t})
+        if verbose: print(f"{n_worker:>4} workers x {n_thread:>3} threads: {n_tile/t:8.2f} tiles/s")
+
+    best = max(results, key=lambda r: r["tiles_per_s"])
+    return {"n_worker"            : best["n_worker"],
+            "n_thread_per_worker" : best["n_thread_per_worker"],
+            "pin_cores"           : pin_cores}, results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the fastest layout of painter workers for this node.")
+    parser.add_argument("--model-path", required=True, help="Directory with model_state and model_meta.")
+    parser.add_argument("--n-pixel-tile", type=int, default=512)
+    parser.add_argument("--n-core", type=int)
+    parser.add_argument("--pin-cores", action="store_true")
+    parser.add_argument("--output", help="JSON output file for the best layout and the throughput of all layouts.")
+    args = parser.parse_args()
+
+    import baryon_painter.painter
+    painter_factory = functools.partial(baryon_painter.painter.CVAEPainter,
+                                        (os.path.join(args.model_path, "model_state"),
+                                         os.path.join(args.model_path, "model_meta")))
+    best, results = autotune(painter_factory, tile_shape=(args.n_pixel_tile, args.n_pixel_tile),
+                             n_core=args.n_core, pin_cores=args.pin_cores)
+    print(f"Best layout: {best['n_worker']} workers with {best['n_thread_per_worker']} threads each.")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"best" : best, "results" : results}, f, indent=2)
@@ -0,0 +1,327 @@
+"""Long-running local painting service.
+
+The service keeps a painter in memory and paints tiles on request, over HTTP
+on localhost or over a Unix socket. Concurrent requests are collected into
+batches of up to ``max_batch_size`` tiles, waiting at most ``max_latency``
+seconds for a batch to fill up, and painted with ``Painter.paint_batch``.
+
+Protocol
+--------
+``POST /paint``
+    The body is the raw input tile in C order. The query parameters are
+    ``shape`` (e.g., ``512,512``), ``dtype`` (default ``float32``), ``z``
+    (default 0), and optionally ``seed`` (e.g., ``1,1097,42,3,4``). The
+    response body is the raw painted tile, with its shape and dtype in the
+    ``X-Shape`` and ``X-Dtype`` headers.
+``GET /metrics``
+    JSON with the queue depth, batch size statistics, and latencies.
+
+Example
+-------
+Start the service with::
+
+    python -m baryon_painter.painting_service --model-path trained_models/CVAE/fiducial/ --socket /tmp/painter.sock
+
+and paint with::
+
+    client = PaintingClient(socket_path="/tmp/painter.sock")
+    painted_tile = client.paint(tile, z=0.1)
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import http.client
+import http.server
+import socketserver
+import urllib.parse
+import concurrent.futures
+
+import numpy as np
+
+class PaintingService:
+    """Collects painting requests into batches and paints them in a worker thread.
+
+    Arguments
+    ---------
+    painter : Painter
+        Painter that implements ``paint_batch``.
+    max_batch_size : int, optional
+        Maximum number of tiles painted in one batch. (default 16).
+    max_latency : float, optional
+        Maximum time in seconds to wait for more requests after the first
+        request of a batch arrived. (default 0.01).
+    paint_kwargs : dict, optional
+        Additional arguments passed to ``paint_batch``. (default None).
+    """
+    def __init__(self, painter, max_batch_size=16, max_latency=0.01, paint_kwargs=None):
+        self.painter = painter
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.paint_kwargs = paint_kwargs or {}
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._n_request = 0
+        self._n_error = 0
+        self._batch_size_counts = np.zeros(max_batch_size+1, dtype=np.int64)
+        self._total_latency = 0.0
+        self._total_paint_time = 0.0
+        self._max_queue_depth = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, tile, z=0.0, seed=None):
+        """Request a tile to be painted. Returns a ``concurrent.futures.Future``."""
+        future = concurrent.futures.Future()
+        self._queue.put((np.asarray(tile), float(z), seed, future, time.perf_counter()))
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def paint(self, tile, z=0.0, seed=None):
+        return self.submit(tile, z, seed).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=max(timeout, 0)) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            # Tiles of different shapes or with and without seeds can't be
+            # painted together
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[0].shape, item[2] is None), []).append(item)
+            for group in groups.values():
+                self._paint_group(group)
+
+    def _paint_group(self, group):
+        tiles, z, seeds, futures, t_submit = zip(*group)
+        t_start = time.perf_counter()
+        try:
+            kwargs = dict(self.paint_kwargs)
+            if seeds[0] is not None:
+                kwargs["seeds"] = list(seeds)
+            painted = self.painter.paint_batch(np.stack(tiles), z=np.array(z), **kwargs)
+        except Exception as e:
+            with self._lock:
+                self._n_error += len(group)
+            for f in futures:
+                f.set_exception(e)
+            return
+        t_end = time.perf_counter()
+        for f, p in zip(futures, painted):
+            f.set_result(p)
+        with self._lock:
+            self._n_request += len(group)
+            self._batch_size_counts[len(group)] += 1
+            self._total_latency += sum(t_end - t for t in t_submit)
+            self._total_paint_time += t_end - t_start
+
+    def get_metrics(self):
+        with self._lock:
+            n_batch = int(self._batch_size_counts.sum())
+            return {"queue_depth"            : self._queue.qsize(),
+                    "max_queue_depth"        : self._max_queue_depth,
+                    "n_request"              : self._n_request,
+                    "n_error"                : self._n_error,
+                    "n_batch"                : n_batch,
+                    "mean_batch_size"        : self._n_request/n_batch if n_batch > 0 else 0.0,
+                    "batch_size_histogram"   : {int(i) : int(n) for i, n in enumerate(self._batch_size_counts) if n > 0},
+                    "mean_latency_ms"        : 1e3*self._total_latency/self._n_request if self._n_request > 0 else 0.0,
+                    "mean_batch_paint_ms"    : 1e3*self._total_paint_time/n_batch if n_batch > 0 else 0.0,
+                    "max_batch_size"         : self.max_batch_size,
+                    "max_latency_ms"         : 1e3*self.max_latency,
+                   }
+
+def _parse_ints(s):
+    return tuple(int(i) for i in s.split(",")) if s else None
+
+class PaintingRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # Unix sockets don't have a client address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/metrics":
+            self._send(200, json.dumps(self.server.service.get_metrics()).encode(),
+                       {"Content-Type" : "application/json"})
+        else:
+            self._send(404, b"Not found.\n")
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path != "/paint":
+            self._send(404, b"Not found.\n")
+            return
+        try:
+            params = urllib.parse.parse_qs(url.query)
+            get = lambda key, default=None: params[key][0] if key in params else default
+            shape = _parse_ints(get("shape"))
+            # View on the request body, no copy
+            tile = np.frombuffer(body, dtype=np.dtype(get("dtype", "float32")))
+            tile = tile.reshape(shape) if shape is not None else tile
+            z = float(get("z", 0.0))
+            seed = _parse_ints(get("seed"))
+        except (ValueError, TypeError) as e:
+            self._send(400, f"Invalid request: {e}\n".encode())
+            return
+        try:
+            painted = self.server.service.paint(tile, z=z, seed=seed)
+        except Exception as e:
+            self._send(500, f"Painting failed: {e}\n".encode())
+            return
+        # Send the buffer of the array directly, in the dtype of the painter
+        painted = np.ascontiguousarray(painted)
+        self._send(200, memoryview(painted).cast("B"),
+                   {"Content-Type" : "application/octet-stream",
+                    "X-Shape"      : ",".join(str(i) for i in painted.shape),
+                    "X-Dtype"      : painted.dtype.str})
+
+    def _send(self, code, payload, headers={}):
+        self.send_response(code)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class _ServerMixin:
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        super().__init__(address, PaintingRequestHandler)
+
+class TCPPaintingServer(_ServerMixin, http.server.ThreadingHTTPServer):
+    pass
+
+class UnixPaintingServer(_ServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+def create_server(service, socket_path=None, host="127.0.0.1", port=0, verbose=False):
+    """Create a HTTP server for ``service``, listening on a Unix socket if
+    ``socket_path`` is set or on ``host:port`` otherwise.
+
+    Call ``serve_forever`` on the returned server to start serving."""
+    if socket_path is not None:
+        return UnixPaintingServer(socket_path, service, verbose=verbose)
+    else:
+        return TCPPaintingServer((host, port), service, verbose=verbose)
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class PaintingClient:
+    """Client for the painting service.
+
+    The connection is kept open between requests. A client should only be
+    used by one thread at a time.
+    """
+    def __init__(self, socket_path=None, host="127.0.0.1", port=None, timeout=None):
+        if socket_path is not None:
+            self._connection = _UnixHTTPConnection(socket_path, timeout=timeout)
+        else:
+            self._connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, url, body=None):
+        self._connection.request(method, url, body=body)
+        response = self._connection.getresponse()
+        payload = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Request failed ({response.status}): {payload.decode().strip()}")
+        return response, payload
+
+    def paint(self, tile, z=0.0, seed=None):
+        tile = np.ascontiguousarray(tile)
+        query = {"shape" : ",".join(str(i) for i in tile.shape),
+                 "dtype" : tile.dtype.str,
+                 "z"     : repr(float(z))}
+        if seed is not None:
+            query["seed"] = ",".join(str(int(s)) for s in np.atleast_1d(seed))
+        response, payload = self._request("POST", "/paint?" + urllib.parse.urlencode(query),
+                                          body=memoryview(tile).cast("B"))
+        painted = np.frombuffer(payload, dtype=np.dtype(response.getheader("X-Dtype")))
+        return painted.reshape(_parse_ints(response.getheader("X-Shape")))
+
+    def get_metrics(self):
+        response, payload = self._request("GET", "/metrics")
+        return json.loads(payload)
+
+    def close(self):
+        self._connection.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a painter over HTTP.")
+    parser.add_argument("--model-path", required=True, help="Directory with model_state and model_meta.")
+    parser.add_argument("--compute-device", default="cpu")
+    parser.add_argument("--socket", help="Path of the Unix socket. If not set, localhost HTTP is used.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-latency", type=float, default=0.01, help="In seconds.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    import baryon_painter.painter
+    painter = baryon_painter.painter.CVAEPainter((os.path.join(args.model_path, "model_state"),
+                                                  os.path.join(args.model_path, "model_meta")),
+                                                 compute_device=args.compute_device)
+    service = PaintingService(painter, max_batch_size=args.max_batch_size, max_latency=args.max_latency)
+    server = create_server(service, socket_path=args.socket, host=args.host, port=args.port,
+                           verbose=args.verbose)
+    print(f"Serving on {args.socket or f'{args.host}:{args.port}'}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
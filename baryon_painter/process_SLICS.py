@@ -1,15 +1,22 @@
 import os
-import numpy as np
-import scipy.ndimage
-import scipy.integrate
+import concurrent.futures
 
-import pyccl as ccl
+import numpy as np
 
-import astropy.io.fits as fits
+from baryon_painter.utils import profiling
 
 pi = np.pi
 
-def create_y_map(painted_planes, z, resolution, map_size, cosmo, order=3, verbose=True):
+def create_y_map(painted_planes, z, resolution, map_size, cosmo, order=3, verbose=True, timer=None):
+    """Project the painted planes onto a y-map.
+
+    If ``timer``, a ``utils.profiling.StageTimer``, is provided, the time
+    spent on the pixel areas and on each plane is recorded in the 
+    ``y_map.pixel_area`` and ``y_map.zoom`` stages."""
+    import scipy.ndimage
+    import scipy.integrate
+    import pyccl as ccl
+
     def L_pix(cosmo, chi, theta):
         a = ccl.scale_factor_of_chi(cosmo, chi)
         return chi*a*theta
@@ -19,6 +26,9 @@ def create_y_map(painted_planes, z, resolution, map_size, cosmo, order=3, verbos
         L = scipy.integrate.quad(f, chi_lo, chi_hi)[0]/(chi_hi-chi_lo)
         return L
 
+    if timer is None:
+        timer = profiling.StageTimer()
+
     y_map = np.zeros((resolution, resolution))
     
     h = cosmo.cosmo.params.h
@@ -29,7 +39,8 @@ def create_y_map(painted_planes, z, resolution, map_size, cosmo, order=3, verbos
     d_A = np.append(d_A, d_A[-1] + 252.5/h)
 
     theta_pix = map_size/resolution*pi/180 # Pixel size in radians
-    A_pix_eff = np.array([A_pix_mean(cosmo, d_A[i], d_A[i+1], theta_pix) for i in range(len(z))])
+    with timer.stage("y_map.pixel_area"):
+        A_pix_eff = np.array([A_pix_mean(cosmo, d_A[i], d_A[i+1], theta_pix) for i in range(len(z))])
     
     # Low redshift seems to constribute too much
     # Effective distance/redshift might better be estimated by considering volume
@@ -53,15 +64,21 @@ def create_y_map(painted_planes, z, resolution, map_size, cosmo, order=3, verbos
     # L_pix = theta_pix*d_A_eff*a_eff # Physical pixel size in Mpc
     
     for i, d in enumerate(painted_planes):
+        timer.start_plane(f"{z[i]:.3f}")
         zoom_factor = resolution/d.shape[0]
-        d = d.copy()
-        d[np.isnan(d)] = 0
+        # Only copy the plane if there are NaNs to be removed. The zoom is 
+        # linear, so the plane can be scaled afterwards.
+        n_nan = np.isnan(d).sum()
+        if n_nan > 0:
+            d = np.nan_to_num(d, nan=0.0)
         
-        d *= V_c*(Xe+Xi)/Xe*y_fac/A_pix_eff[i]/zoom_factor**2
         if verbose: print(f"z : {z[i]:0.3f}, plane shape: {d.shape}, zoom_factor: {zoom_factor:0.3f}")
-        if verbose: print(f"{np.isnan(d).sum()}")
+        if verbose: print(f"{n_nan}")
         
-        y_map += scipy.ndimage.zoom(d, zoom=zoom_factor, order=order, mode="mirror")
+        with timer.stage("y_map.zoom"):
+            y_map += scipy.ndimage.zoom(d, zoom=zoom_factor, order=order, mode="mirror") \
+                        * (V_c*(Xe+Xi)/Xe*y_fac/A_pix_eff[i]/zoom_factor**2)
+        timer.end_plane()
         
     return y_map
 
@@ -82,22 +99,191 @@ def get_tile(m, shift, tile_relative_size, expansion_factor=1):
     
     return tile
 
+def _weight_profile(n_pixel, falloff_pixel, sigma):
+    p = np.ones(n_pixel)
+    i = np.arange(falloff_pixel)
+    d = falloff_pixel-i
+    s = falloff_pixel*sigma
+    f = np.exp(-0.5*d**2/s**2)
+    p[i] *= f
+    p[n_pixel-1-i] *= f
+    return p
+
 def make_weight_map(tile_shape, falloff=0.05, sigma=1):
-    w = np.ones(tile_shape)
-    
+    # The weight map is the outer product of the falloff profiles of the axes
     falloff_pixel = int(tile_shape[0]*falloff)
+    return np.outer(_weight_profile(tile_shape[0], falloff_pixel, sigma),
+                    _weight_profile(tile_shape[1], falloff_pixel, sigma))
     
-    for i in range(falloff_pixel):
-        d = falloff_pixel-i
-        s = falloff_pixel*sigma
-        f = np.exp(-0.5*d**2/s**2)
-        w[i] *= f
-        w[-i-1] *= f
-        w[:,i] *= f
-        w[:,-i-1] *= f
+
+class TileBlender:
+    """Weighted overlap-add of painted tiles onto a plane.
+
+    The tiles are weighted with ``make_weight_map``. Since the weight map is 
+    the outer product of 1D profiles and the tiling of ``generate_tiling`` is
+    the product of the same 1D origins along both axes, the sum of the weights
+    on the plane is separable as well. The normalised weights of each tile are 
+    therefore precomputed from 1D profiles and the tiles are added to the 
+    plane directly, without a weight plane and final division. 
+    
+    If tiles get masked (e.g., outliers with ``regularise``), the weights don't
+    sum to one anymore and are accumulated in a weight plane instead, by which
+    the plane is divided in ``get_plane``.
+
+    Pixels that are not covered by any tile are NaN.
+
+    Arguments
+    ---------
+    n_pixel_plane : int
+        Size of the plane.
+    n_pixel_tile : int
+        Size of the tiles.
+    tile_pixel_origins : list
+        Pixel origins of the tiles along each axis.
+    n_realisation : int, optional
+        Number of realisations of each tile. (default 1).
+    falloff, sigma : float, optional
+        Parameters of ``make_weight_map``. (default 0.05, 0.5).
+    masked : bool, optional
+        Tiles come with masks. (default False).
+    n_thread : int, optional
+        Number of threads. The plane is split into stripes of rows, to which 
+        the tiles are added in parallel. (default 1).
+    dtype : numpy.dtype, optional
+        Data type of the plane. (default numpy.float64).
+    """
+    def __init__(self, n_pixel_plane, n_pixel_tile, tile_pixel_origins, n_realisation=1,
+                 falloff=0.05, sigma=0.5, masked=False, n_thread=1, dtype=np.float64):
+        self.n_pixel_tile = n_pixel_tile
+        self.origins = [int(o) for o in tile_pixel_origins]
+        self.masked = masked
+        self.n_thread = n_thread
+        self.plane = np.zeros((n_realisation, n_pixel_plane, n_pixel_plane), dtype=dtype)
+
+        profile = _weight_profile(n_pixel_tile, int(n_pixel_tile*falloff), sigma)
+        weight_sum = np.zeros(n_pixel_plane)
+        for o in self.origins:
+            weight_sum[o:o+n_pixel_tile] += profile
+        self.covered = weight_sum > 0
         
-    return w
+        if masked:
+            self.weight_plane = np.zeros_like(self.plane)
+            self.profiles = [profile.astype(dtype)]*len(self.origins)
+        else:
+            self.weight_plane = None
+            # Same dtype as the plane, to keep the temporaries small
+            self.profiles = [(profile/weight_sum[o:o+n_pixel_tile]).astype(dtype) for o in self.origins]
+        
+    def _add_rows(self, row_start, row_end, tiles, tile_idx, masks):
+        n = self.n_pixel_tile
+        for i, (j, k) in enumerate(tile_idx):
+            x, y = self.origins[j], self.origins[k]
+            start, end = max(row_start, x), min(row_end, x+n)
+            if start >= end:
+                continue
+            p_x = self.profiles[j][start-x:end-x,None]
+            p_y = self.profiles[k]
+            if masks is None:
+                # Separable weights, without allocating the weight map
+                t = tiles[i][:,start-x:end-x]*p_x
+                t *= p_y
+                self.plane[:,start:end,y:y+n] += t
+            else:
+                w = np.where(masks[i][:,start-x:end-x], 0.0, p_x*p_y)
+                self.weight_plane[:,start:end,y:y+n] += w
+                self.plane[:,start:end,y:y+n] += w*tiles[i][:,start-x:end-x]
+
+    def add(self, tiles, tile_idx, masks=None):
+        """Adds a batch of tiles.
+
+        Arguments
+        ---------
+        tiles : list
+            Tiles, each of shape (n_realisation, n_pixel_tile, n_pixel_tile).
+        tile_idx : list
+            Indices (j, k) of the tiles in ``tile_pixel_origins``.
+        masks : list, optional
+            Boolean masks of the same shape as the tiles. Masked pixels get
+            zero weight. Required if ``masked`` is set. (default None).
+        """
+        if (masks is not None) != self.masked:
+            raise ValueError("Masks need to be provided if and only if masked=True.")
+        if self.n_thread > 1:
+            import concurrent.futures
+            n_row = self.plane.shape[1]
+            bounds = np.linspace(0, n_row, self.n_thread+1).astype(int)
+            with concurrent.futures.ThreadPoolExecutor(self.n_thread) as pool:
+                futures = [pool.submit(self._add_rows, bounds[i], bounds[i+1], tiles, tile_idx, masks) 
+                           for i in range(self.n_thread)]
+                for f in futures:
+                    f.result()
+        else:
+            self._add_rows(0, self.plane.shape[1], tiles, tile_idx, masks)
+
+    def get_plane(self):
+        """Returns the blended plane of shape (n_realisation, n_pixel_plane, n_pixel_plane)."""
+        if self.weight_plane is not None:
+            # Pixels without weight are NaN
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.plane /= self.weight_plane
+            self.weight_plane = None
+        else:
+            self.plane[:,~self.covered] = np.nan
+            self.plane[:,:,~self.covered] = np.nan
+        return self.plane
+
+def spill_to_memmap(a, path=None):
+    """Writes ``a`` to a file in ``path`` and returns it as a read-only 
+    memory map.
+
+    The file is unlinked once it is mapped, so that its disk space is freed
+    when the memory map is deleted."""
+    import tempfile
+
+    fd, filename = tempfile.mkstemp(suffix=".npy", dir=path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, a)
+        return np.load(filename, mmap_mode="r")
+    finally:
+        os.remove(filename)
+
+class RunningMoments:
+    """Running mean and variance of maps, using Welford's algorithm.
     
+    Realisations can be pushed one at a time or as stacks along the first 
+    axis, so that the mean and variance can be accumulated without keeping 
+    all realisations in memory.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self._M2 = None
+        
+    def push(self, x, stack=False):
+        x = np.asarray(x, dtype=np.float64)
+        if not stack:
+            x = x[None]
+        n = x.shape[0]
+        mean = x.mean(axis=0)
+        M2 = ((x - mean)**2).sum(axis=0)
+        if self.n == 0:
+            self.mean = mean
+            self._M2 = M2
+        else:
+            # Combine with the accumulated moments (Chan et al.)
+            delta = mean - self.mean
+            n_total = self.n + n
+            self.mean = self.mean + delta*n/n_total
+            self._M2 = self._M2 + M2 + delta**2*self.n*n/n_total
+        self.n += n
+        
+    @property
+    def var(self):
+        """Unbiased variance."""
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        return self._M2/(self.n-1)
 
 def generate_tiling(n_pixel_plane, n_pixel_tile, min_tile_overlap=0.5):
     tile_relative_size = n_pixel_tile/n_pixel_plane
@@ -134,18 +320,130 @@ def process_SLICS(painter,
                   regularise=False,
                   regularise_std=None,
                   return_problematic_tiles=False,
+                  n_realisation=1,
+                  return_moments=False,
+                  seed=None,
+                  n_pixel_delta=7745,
+                  n_pixel_massplane=4096*3,
+                  resample_plane=False,
+                  memory_budget=None,
+                  spill_path=None,
+                  timer=None,
+                  timing_report_file=None,
                  ):
+    """Paint on the SLICS lightcone planes.
+
+    With ``n_realisation`` > 1, ``n_realisation`` realisations are painted on
+    each tile in one pass and every painted plane has a leading realisation 
+    axis. If ``return_moments`` is set, dicts with lists of the mean and 
+    variance planes over the realisations are returned as well.
+
+    Painters with several ``label_fields`` paint all fields in the same 
+    forward pass. The painted planes then have a field axis after the 
+    realisation axis, in the order of ``painter.label_fields``.
+
+    If ``seed`` is set, the latent noise of each tile is derived from the key
+    (seed, LOS, plane, tile row, tile column), where the plane is identified
+    by its redshift in units of 0.001. The painted planes are then 
+    reproducible independent of the order, batching, or parallelisation of 
+    the painting, and single planes can be repainted on their own.
+
+    ``n_pixel_delta`` and ``n_pixel_massplane`` are the sizes of the delta and
+    mass plane files, which only need to be changed for mock inputs.
+
+    If ``memory_budget`` (in bytes) is set, the planes are accumulated in 
+    float32 instead of float64 and the delta and mass planes are released as
+    soon as all tiles have been cut from them. Painted planes are kept in 
+    memory as long as their total size stays within ``memory_budget``, and are
+    otherwise spilled to memory-mapped files in ``spill_path`` (default: the 
+    temporary directory). The files are unlinked once they are mapped, so 
+    their disk space is freed when the returned planes are deleted. The peak
+    RSS at the end of each plane is recorded in the ``timer`` report.
+
+    ``painter`` can also be a ``painter_pool.PainterPool``. The tiles of each
+    row are then painted by the workers of the pool while the previous row 
+    is blended, and the ``paint`` stage records the time spent waiting for 
+    the workers. Other painters paint each row of tiles with a single 
+    ``paint_batch`` call if they implement it and ``n_realisation`` is 1, 
+    and otherwise tile by tile with ``paint``.
+
+    ``painter`` can also be a list of painters, e.g., a CVAE and a CGAN to 
+    compare. The planes are then read, tiled, and resampled once and every
+    tile is sent to each painter. The painted planes, problematic tiles, and 
+    moments are returned as lists with one entry per painter.
+
+    By default, each tile is cut from the delta plane and zoomed to 
+    ``n_pixel_tile`` on its own, so that pixels in the overlaps of tiles are
+    interpolated several times, with different edge effects. With 
+    ``resample_plane``, the delta plane is instead zoomed once to the pixel 
+    scale of the painter and the tiles are views into the resampled plane,
+    which align exactly with the blending. This needs the memory for a float64
+    copy of the delta plane for the spline filter. Planes that are smaller than
+    a tile are always painted on a single tile zoomed from the mass plane.
+
+    The wall time, bytes read, and number of tiles of each stage (``read``, 
+    ``normalise``, which includes the access to the transposed planes, 
+    ``get_tile``, ``zoom``, ``paint`` with the ``paint.*`` stages of the 
+    painter, and ``blend``) are recorded per plane on ``timer``, a 
+    ``utils.profiling.StageTimer``. If ``timing_report_file`` is set, the 
+    report is written there as JSON at the end."""
+    import scipy.ndimage
+
     if len(z_SLICS) != len(z_slice):
         raise ValueError("Shapes of z_SLICS and z_slice need to match!")
     
-    n_pixel_delta = 7745
-    n_pixel_massplane = 4096*3
     massplane_size = 505 # Mpc/h
+    if timer is None:
+        timer = profiling.StageTimer()
     
-    painted_planes = []
+    dtype = np.float32 if memory_budget is not None else np.float64
+    n_byte_in_memory = 0
+
+    # Several painters share the reading, tiling, and resampling of the planes
+    painters = list(painter) if isinstance(painter, (list, tuple)) else [painter]
+    n_painter = len(painters)
+
+    painted_planes = [[] for _ in range(n_painter)]
+    problematic_tiles = [[] for _ in range(n_painter)]
+    moments = [{"mean" : [], "var" : []} for _ in range(n_painter)]
+
+    paint_kwargs = {"transform" : True, "inverse_transform" : True}
+    if n_realisation > 1:
+        paint_kwargs["n_sample"] = n_realisation
+    get_seed = lambda key: (seed, LOS, *key)
+    get_tile_kwargs = lambda key: paint_kwargs if seed is None else {**paint_kwargs, "seed" : get_seed(key)}
+
+    def paint_tiles(painter, tiles, z, keys):
+        # Painters that paint asynchronously, such as a PainterPool, get the 
+        # tiles of a row submitted while the previous row is blended. Other 
+        # painters paint the row in one batch if they support it and
+        # otherwise tile by tile.
+        submit = getattr(painter, "submit", None)
+        if submit is not None:
+            return [submit(input=tile, z=z, **get_tile_kwargs(key)) for tile, key in zip(tiles, keys)]
+        with timer.stage("paint", count=len(tiles)), timer.activate():
+            if n_realisation == 1 and hasattr(painter, "paint_batch"):
+                seeds = [get_seed(key) for key in keys] if seed is not None else None
+                return list(painter.paint_batch(np.stack(tiles), z=z, seeds=seeds, **paint_kwargs))
+            return [painter.paint(input=tile, z=z, **get_tile_kwargs(key)) for tile, key in zip(tiles, keys)]
+
+    def get_painted_tile(painted_tile):
+        if isinstance(painted_tile, concurrent.futures.Future):
+            with timer.stage("paint"):
+                painted_tile = painted_tile.result()
+        return painted_tile
+
+    # Painted tiles have shape ([n_realisation,] [n_field,] n_pixel, n_pixel).
+    # The realisations and fields are blended as channels of the tiles.
+    n_fields = [len(getattr(p, "label_fields", None) or [None]) for p in painters]
+    field_shapes = [(n_field,) if n_field > 1 else () for n_field in n_fields]
+    realisation_shape = (n_realisation,) if n_realisation > 1 else ()
+    to_channels = lambda painted_tile, n_field: painted_tile.reshape(n_realisation*n_field, *painted_tile.shape[-2:])
     
     for i in range(len(z_SLICS)):
         if verbose: print(f"Processing z={z_SLICS[i]:.3f}")
+        timer.start_plane(f"{z_SLICS[i]:.3f}")
+        plane_key = int(round(z_SLICS[i]*1000))
         if delta_size[i] < tile_size:
             if verbose: print("  Tile bigger than delta plane, using mass planes.")
             # Get tile from mass plane, then cut out delta map footprint
@@ -154,73 +452,156 @@ def process_SLICS(painter,
             massplane_file = os.path.join(massplane_path, f"{z_SLICS[i]:.3f}proj_half_finer_{projection(i)}.dat_LOS{LOS}")
             
             if verbose: print(f"  Loading {massplane_file}.")
-            plane = np.fromfile(massplane_file, dtype=np.float32)[1:].reshape(4096*3, -1).T
-            # plane -= plane.mean()
-            plane *= 1/(3072**3/2/12288**2)
+            with timer.stage("read", n_byte=os.path.getsize(massplane_file)):
+                plane = np.fromfile(massplane_file, dtype=np.float32)[1:].reshape(n_pixel_massplane, -1).T
+            with timer.stage("normalise"):
+                # plane -= plane.mean()
+                plane *= 1/(3072**3/2/12288**2)
             
             if verbose: print(f"  Extracting tile.")
-            tile = get_tile(plane, shift=shifts[i], 
-                            tile_relative_size=delta_size[i]/massplane_size, 
-                            expansion_factor=tile_size/delta_size[i])
+            with timer.stage("get_tile"):
+                tile = get_tile(plane, shift=shifts[i], 
+                                tile_relative_size=delta_size[i]/massplane_size, 
+                                expansion_factor=tile_size/delta_size[i])
+            del plane
             if SLICS_density:
                 tile -= tile.min()
-            tile = scipy.ndimage.zoom(tile, zoom=n_pixel_tile/tile.shape[0], mode="mirror")
+            with timer.stage("zoom"):
+                tile = scipy.ndimage.zoom(tile, zoom=n_pixel_tile/tile.shape[0], mode="mirror")
             
             if verbose: print(f"  Painting on tile.")
-            painted_tile = painter.paint(input=tile, 
-                                         z=z_slice[i],
-                                         transform=True, inverse_transform=True)
+            painted_tiles = [paint_tiles(p, [tile], z_slice[i], keys=[(plane_key, 0, 0)]) for p in painters]
             
-            painted_plane = get_tile(painted_tile, shift=((1-delta_size[i]/tile_size)/2, (1-delta_size[i]/tile_size)/2),
-                                     tile_relative_size=delta_size[i]/tile_size)
-            painted_planes.append(painted_plane)
+            plane_outputs = []
+            for n_field, painted_tile in zip(n_fields, painted_tiles):
+                painted_tile = get_painted_tile(painted_tile[0])
+                with timer.stage("blend"):
+                    plane_outputs.append(np.stack([get_tile(t, shift=((1-delta_size[i]/tile_size)/2, (1-delta_size[i]/tile_size)/2),
+                                                            tile_relative_size=delta_size[i]/tile_size) 
+                                                   for t in to_channels(painted_tile, n_field)]).astype(dtype, copy=False))
+            del painted_tiles
         else:
             if SLICS_density:
+                import astropy.io.fits as fits
                 delta_file = os.path.join(delta_path, f"{z_SLICS[i]:.3f}density_LOS{LOS}.fits")
-                with fits.open(delta_file) as hdu:
+                with timer.stage("read", n_byte=os.path.getsize(delta_file)), fits.open(delta_file) as hdu:
                     delta = hdu[0].data.T
-                delta *= 1/(3072**3/2/12288**2)/64
+                with timer.stage("normalise"):
+                    delta *= 1/(3072**3/2/12288**2)/64
             else:
                 # Get tiles from delta map
                 delta_file = os.path.join(delta_path, f"{z_SLICS[i]:.3f}delta.dat_bicubic_LOS{LOS}")
                 
-                delta = np.fromfile(delta_file, dtype=np.float32).reshape(7745, -1).T
-                delta += 96 # Mean of massplane
-                delta *= 1/(3072**3/2/12288**2)
+                with timer.stage("read", n_byte=os.path.getsize(delta_file)):
+                    delta = np.fromfile(delta_file, dtype=np.float32).reshape(n_pixel_delta, -1).T
+                with timer.stage("normalise"):
+                    delta += 96 # Mean of massplane
+                    delta *= 1/(3072**3/2/12288**2)
             
             n_pixel_plane = int(delta_size[i]/tile_size*n_pixel_tile)
             tile_origins, tile_slices = generate_tiling(n_pixel_plane=n_pixel_plane,
                                                         n_pixel_tile=n_pixel_tile,
                                                         min_tile_overlap=0.5)
+            if resample_plane:
+                with timer.stage("zoom"):
+                    delta = scipy.ndimage.zoom(delta, zoom=n_pixel_plane/delta.shape[0], mode="reflect")
+                if delta.shape != (n_pixel_plane, n_pixel_plane):
+                    raise RuntimeError(f"Resampled plane has shape {delta.shape} instead of {n_pixel_plane}^2.")
             
             if verbose: print(f"  Using {len(tile_origins)} tiles (on each side)")
                 
-            painted_plane = np.zeros((n_pixel_plane, n_pixel_plane))
-            weight_plane = np.zeros((n_pixel_plane, n_pixel_plane))
-            problematic_tiles = []
+            # Outliers only get removed if regularise_std is set
+            mask_outliers = regularise and regularise_std is not None
+            blenders = [TileBlender(n_pixel_plane, n_pixel_tile, 
+                                    tile_pixel_origins=[tile_slices[j][0][0].start for j in range(len(tile_origins))],
+                                    n_realisation=n_realisation*n_field, falloff=0.05, sigma=0.5, 
+                                    masked=mask_outliers, dtype=dtype)
+                        for n_field in n_fields]
+            def blend_row(j, tiles, painted_row, p):
+                painted_tiles = []
+                masks = [] if mask_outliers else None
+                for tile, painted_tile in zip(tiles, painted_row):
+                    painted_tile = get_painted_tile(painted_tile)
+                    channels = to_channels(painted_tile, n_fields[p])
+                    if regularise_std is not None:
+                        with timer.stage("blend", count=0):
+                            outliers = np.abs(channels-channels.mean(axis=(1,2), keepdims=True)) \
+                                            > channels.std(axis=(1,2), keepdims=True)*regularise_std
+                            if np.any(outliers):
+                                problematic_tiles[p].append((z_slice[i], tile, painted_tile))
+                            if mask_outliers:
+                                masks.append(outliers)
+                    painted_tiles.append(channels)
+
+                with timer.stage("blend", count=len(painted_tiles)):
+                    blenders[p].add(painted_tiles, [(j, k) for k in range(len(painted_tiles))], masks=masks)
+
+            # Tiles are cut once for all painters, and painted and blended one
+            # row at a time
+            previous_row = None
             for j, x_shift in enumerate(tile_origins):
+                tiles = []
                 for k, y_shift in enumerate(tile_origins):
-                    tile = get_tile(delta, shift=(x_shift, y_shift), 
-                                    tile_relative_size=tile_size/delta_size[i])
-                    tile = scipy.ndimage.zoom(tile, zoom=n_pixel_tile/tile.shape[0], mode="reflect")
-                    if verbose: print(f"    Painting on tile {j+1}-{k+1}")
-                    painted_tile = painter.paint(input=tile, 
-                                                 z=z_slice[i],
-                                                 transform=True, inverse_transform=True)
-
-                    w = make_weight_map(tile.shape, falloff=0.05, sigma=0.5)
-                    if regularise_std is not None:
-                        if np.any(np.abs(painted_tile-painted_tile.mean()) > painted_tile.std()*regularise_std):
-                            problematic_tiles.append((z, tile, painted_tile))
-                        if regularise:
-                            w[np.abs(painted_tile-painted_tile.mean()) > painted_tile.std()*regularise_std] = 0
-                    painted_plane[tile_slices[j][k]] += w*painted_tile
-                    weight_plane[tile_slices[j][k]] += w
+                    if resample_plane:
+                        with timer.stage("get_tile"):
+                            tile = delta[tile_slices[j][k]]
+                    else:
+                        with timer.stage("get_tile"):
+                            tile = get_tile(delta, shift=(x_shift, y_shift), 
+                                            tile_relative_size=tile_size/delta_size[i])
+                        with timer.stage("zoom"):
+                            tile = scipy.ndimage.zoom(tile, zoom=n_pixel_tile/tile.shape[0], mode="reflect")
+                    tiles.append(tile)
+                if verbose: print(f"    Painting on tiles {j+1}-1 to {j+1}-{len(tile_origins)}")
+                keys = [(plane_key, j, k) for k in range(len(tile_origins))]
+                row = (tiles, [paint_tiles(p, tiles, z_slice[i], keys) for p in painters])
+
+                if previous_row is not None:
+                    for p in range(n_painter):
+                        blend_row(j-1, previous_row[0], previous_row[1][p], p)
+                previous_row = row
+            # All tiles have been cut from the plane
+            del delta
+            for p in range(n_painter):
+                blend_row(len(tile_origins)-1, previous_row[0], previous_row[1][p], p)
+            del previous_row, row, tiles
                     
-            painted_planes.append(painted_plane/weight_plane)
-            
+            plane_outputs = []
+            for blender in blenders:
+                with timer.stage("blend", count=0):
+                    plane_outputs.append(blender.get_plane())
+            del blenders, blender
+
+        for p in range(n_painter):
+            painted_plane = plane_outputs[p]
+            plane_outputs[p] = None
+            if return_moments:
+                plane_moments = RunningMoments()
+                plane_moments.push(painted_plane.reshape(n_realisation, *field_shapes[p], *painted_plane.shape[-2:]), 
+                                   stack=True)
+                moments[p]["mean"].append(plane_moments.mean)
+                moments[p]["var"].append(plane_moments.var)
+            if memory_budget is not None:
+                if n_byte_in_memory + painted_plane.nbytes > memory_budget:
+                    with timer.stage("spill", n_byte=painted_plane.nbytes):
+                        painted_plane = spill_to_memmap(painted_plane, spill_path)
+                else:
+                    n_byte_in_memory += painted_plane.nbytes
+            painted_planes[p].append(painted_plane.reshape(*realisation_shape, *field_shapes[p], 
+                                                           *painted_plane.shape[-2:]))
+            del painted_plane
+        del plane_outputs
+        timer.end_plane()
+
+    if timing_report_file is not None:
+        timer.write_report(timing_report_file, LOS=LOS)
+
+    if not isinstance(painter, (list, tuple)):
+        painted_planes, problematic_tiles, moments = painted_planes[0], problematic_tiles[0], moments[0]
                     
+    output = (painted_planes,)
     if return_problematic_tiles:
-        return painted_planes, problematic_tiles
-    else:
-        return painted_planes
+        output += (problematic_tiles,)
+    if return_moments:
+        output += (moments,)
+    return output if len(output) > 1 else output[0]
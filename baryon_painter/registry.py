@@ -0,0 +1,118 @@
+import os
+import hashlib
+import threading
+import collections
+
+from baryon_painter.painter import CVAEPainter
+
+class PainterRegistry:
+    """Cache of loaded painters.
+
+    Painters are keyed by the paths of their files together with their
+    modification times (or content hashes), so that a checkpoint that gets
+    overwritten is loaded again. Repeated requests for the same checkpoint
+    return the same painter without deserialising the files again.
+
+    The painters are shared and therefore read-only: they are in eval mode,
+    their parameters don't require gradients, and they can't be trained. If
+    the memory of the cached models exceeds ``memory_budget``, the least
+    recently used painters are evicted.
+
+    Arguments
+    ---------
+    memory_budget : int, optional
+        Maximum memory of the model parameters and buffers in bytes. The most
+        recently used painter is always kept. (default 2 GB).
+    key : str, optional
+        Identify file versions by ``"mtime"`` (modification time and size) or
+        by ``"hash"`` (SHA1 of the content). (default "mtime").
+    """
+    def __init__(self, memory_budget=2*1024**3, key="mtime"):
+        if key not in ["mtime", "hash"]:
+            raise ValueError(f"key needs to be 'mtime' or 'hash', not {key}.")
+        self.memory_budget = memory_budget
+        self.key = key
+        self._painters = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self.n_hit = 0
+        self.n_miss = 0
+
+    def _file_key(self, filename):
+        filename = os.path.abspath(filename)
+        if self.key == "mtime":
+            stat = os.stat(filename)
+            return filename, stat.st_mtime_ns, stat.st_size
+        else:
+            sha1 = hashlib.sha1()
+            with open(filename, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha1.update(chunk)
+            return filename, sha1.hexdigest()
+
+    def get(self, filename, compute_device="cpu", painter_class=CVAEPainter):
+        """Returns a read-only painter for ``filename``.
+
+        Arguments
+        ---------
+        filename : tuple
+            Tuple of (state_filename, meta_filename), as for ``CVAEPainter``.
+        compute_device : str, optional
+            Device of the model. (default "cpu").
+        painter_class : type, optional
+            Class of the painter. (default CVAEPainter).
+        """
+        key = (painter_class, tuple(self._file_key(f) for f in filename), str(compute_device))
+        with self._lock:
+            if key in self._painters:
+                self.n_hit += 1
+                self._painters.move_to_end(key)
+                return self._painters[key]
+            self.n_miss += 1
+
+            painter = painter_class(tuple(filename), compute_device=compute_device)
+            make_read_only(painter)
+            # Older versions of the same files can't be requested anymore
+            for k in [k for k in self._painters if k[0] == key[0] and k[2] == key[2]
+                                                   and [f[0] for f in k[1]] == [f[0] for f in key[1]]]:
+                del self._painters[k]
+            self._painters[key] = painter
+            self._evict()
+            return painter
+
+    def _evict(self):
+        while len(self._painters) > 1 and self.memory_usage > self.memory_budget:
+            self._painters.popitem(last=False)
+
+    @property
+    def memory_usage(self):
+        """Memory of the parameters and buffers of the cached models in bytes."""
+        with self._lock:
+            return sum(get_model_memory(p.model) for p in self._painters.values())
+
+    def clear(self):
+        with self._lock:
+            self._painters.clear()
+
+    def __len__(self):
+        return len(self._painters)
+
+def get_model_memory(model):
+    """Returns the memory of the parameters and buffers of ``model`` in bytes."""
+    return  sum(p.numel()*p.element_size() for p in model.parameters()) \
+          + sum(b.numel()*b.element_size() for b in model.buffers())
+
+def make_read_only(painter):
+    """Put the model of ``painter`` in eval mode, freeze its parameters, and
+    mark the painter as read-only."""
+    painter.model.train(False)
+    for p in painter.model.parameters():
+        p.requires_grad_(False)
+    painter.read_only = True
+    return painter
+
+_default_registry = PainterRegistry()
+
+def get_painter(filename, compute_device="cpu", painter_class=CVAEPainter):
+    """Returns a shared, read-only painter from the default registry. See
+    ``PainterRegistry.get``."""
+    return _default_registry.get(filename, compute_device, painter_class)
@@ -0,0 +1,205 @@
+import os
+import copy
+import glob
+import queue
+import random
+import inspect
+import threading
+
+import numpy as np
+
+import torch
+
+def snapshot(obj):
+    """Returns a copy of a (nested) state dict with all tensors copied to the CPU."""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    elif isinstance(obj, dict):
+        return type(obj)((k, snapshot(v)) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    else:
+        return copy.deepcopy(obj)
+
+def atomic_dump(obj, filename, dump):
+    """Write ``obj`` to ``filename`` using ``dump(obj, file)``.
+
+    The data are written to a temporary file first, which then replaces
+    ``filename``, so that an interrupted write never leaves a truncated file
+    behind.
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+def load_checkpoint(filename, map_location="cpu"):
+    """Load a checkpoint written with ``torch.save`` that may contain 
+    non-tensor objects, such as RNG states."""
+    kwargs = {}
+    if "weights_only" in inspect.signature(torch.load).parameters:
+        kwargs["weights_only"] = False
+    return torch.load(filename, map_location=map_location, **kwargs)
+
+def find_latest_checkpoint(path, pattern="checkpoint_sample*_train"):
+    """Returns the last checkpoint in ``path`` matching ``pattern`` in 
+    lexicographic order, or ``None`` if there is none."""
+    filenames = sorted(glob.glob(os.path.join(path, pattern)))
+    return filenames[-1] if len(filenames) > 0 else None
+
+def get_rng_state():
+    """Returns the states of the Python, NumPy, and PyTorch RNGs."""
+    state = {"python" : random.getstate(),
+             "numpy"  : np.random.get_state(),
+             "torch"  : torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    """Restore RNG states returned by ``get_rng_state``."""
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"].cpu())
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([s.cpu() for s in state["cuda"]])
+
+class CheckpointWriter:
+    """Writes checkpoints in a background thread and applies a retention policy.
+
+    Arguments
+    ---------
+    keep_last : int, optional
+        Number of most recent checkpoints to keep. If ``None``, all
+        checkpoints are kept. (default None).
+    keep_every : int, optional
+        Additionally keep every ``keep_every``-th checkpoint. (default None).
+    asynchronous : bool, optional
+        Write checkpoints in a background thread. If False, ``submit`` blocks
+        until the checkpoint is written. (default True).
+    max_pending : int, optional
+        Maximum number of checkpoints waiting to be written before ``submit``
+        blocks. (default 2).
+    """
+    def __init__(self, keep_last=None, keep_every=None, asynchronous=True, max_pending=2):
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.asynchronous = asynchronous
+
+        # List of (checkpoint number, filenames) of retained checkpoints
+        self.checkpoints = []
+        self.n_checkpoint = 0
+
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        if self.asynchronous:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        else:
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, files, protect=False):
+        """Submit a checkpoint.
+
+        Arguments
+        ---------
+        files : list
+            List of ``(filename, obj, dump)`` tuples, where ``dump(obj, file)``
+            writes ``obj`` to an open file. The objects should already be
+            snapshots (see ``snapshot``) that don't change during training.
+        protect : bool, optional
+            Exclude the checkpoint from the retention policy. (default False).
+        """
+        self._check_error()
+        if protect:
+            remove = []
+        else:
+            self.checkpoints.append((self.n_checkpoint, [f[0] for f in files]))
+            self.n_checkpoint += 1
+            self.checkpoints, remove = self._apply_retention_policy(self.checkpoints)
+
+        if self.asynchronous:
+            self._queue.put((files, remove))
+        else:
+            self._write(files, remove)
+
+    def wait(self):
+        """Block until all submitted checkpoints are written."""
+        if self.asynchronous:
+            self._queue.join()
+        self._check_error()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._check_error()
+
+    def state_dict(self, next_filenames=None):
+        """Returns the list of retained checkpoints.
+
+        If ``next_filenames`` is provided, the state is returned as if a 
+        checkpoint with these files had been submitted. This allows the state
+        to be stored as part of that checkpoint.
+        """
+        checkpoints = list(self.checkpoints)
+        n_checkpoint = self.n_checkpoint
+        if next_filenames is not None:
+            checkpoints.append((n_checkpoint, list(next_filenames)))
+            n_checkpoint += 1
+            checkpoints, _ = self._apply_retention_policy(checkpoints)
+        return {"n_checkpoint" : n_checkpoint, 
+                "checkpoints"  : checkpoints}
+
+    def load_state_dict(self, state):
+        self.n_checkpoint = state["n_checkpoint"]
+        self.checkpoints = list(state["checkpoints"])
+
+    def _check_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise RuntimeError("Writing checkpoint failed.") from error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, files, remove):
+        for filename, obj, dump in files:
+            atomic_dump(obj, filename, dump)
+        for filename in remove:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def _apply_retention_policy(self, checkpoints):
+        """Returns the retained checkpoints and the files to be removed."""
+        if self.keep_last is None:
+            return checkpoints, []
+        retained = []
+        remove = []
+        for i, (n, filenames) in enumerate(checkpoints):
+            recent = i >= len(checkpoints) - self.keep_last
+            milestone = self.keep_every is not None and (n+1) % self.keep_every == 0
+            if recent or milestone:
+                retained.append((n, filenames))
+            else:
+                remove += filenames
+        return retained, remove
@@ -1,9 +1,5 @@
 import numpy as np
 
-from scipy.ndimage import gaussian_filter
-
-from cosmotools.utils import rebin_2d
-
 def transform_to_delta(x, field, z, stats):
     return x/stats[field][z]["mean"]-1
 
@@ -13,6 +9,8 @@ def inv_transform_to_delta(x, field, z, stats):
 
 def create_split_scale_transform(n_scale=3, step_size=4, include_original=True, truncate=3.0):    
     def split_scale_transform(x, field, z, stats):
+        from scipy.ndimage import gaussian_filter
+
         in_shape = np.array(x.shape)
         d_in = x.copy()
         if include_original:
@@ -12,6 +12,88 @@ def compile_transform(transform, stats={}, field=None, z=None):
     z_ = copy.deepcopy(z)
     return lambda x, field=f, z=z_: func(x, field, z, s)
 
+def apply_symmetries(x, symmetries):
+    """Applies one of the eight symmetries of the square to each sample.
+
+    Symmetry ``s`` rotates by ``s%4`` times 90 degrees and then flips along the
+    last axis if ``s`` >= 4. The samples are grouped by symmetry, so that each
+    symmetry is applied to all its samples at once.
+
+    Arguments
+    ---------
+    x : numpy.array
+        Batch of square samples of shape (N, ..., H, W).
+    symmetries : numpy.array
+        Array of shape (N,) with the symmetry of each sample.
+
+    Returns
+    -------
+    x : numpy.array
+        Transformed samples.
+    """
+    x = x.copy()
+    for s in np.unique(symmetries):
+        if s == 0:
+            continue
+        mask = symmetries == s
+        y = np.rot90(x[mask], k=s%4, axes=(-2,-1))
+        x[mask] = np.flip(y, axis=-1) if s >= 4 else y
+    return x
+
+class ShuffledSampler:
+    """Iterates over a random permutation of the sample indices.
+    
+    The permutation only depends on ``seed`` and ``epoch``, so that iteration 
+    can be continued at position ``start`` after training is resumed.
+
+    For distributed training, the permutation is split into ``world_size``
+    disjoint shards and only the shard of ``rank`` is iterated over. The 
+    permutation is padded with its first entries to a multiple of 
+    ``world_size``, so that all ranks process the same number of samples.
+
+    Arguments
+    ---------
+    n_sample : int
+        Number of samples in the data set.
+    seed : int
+        Seed of the permutations.
+    epoch : int, optional
+        Epoch, selects the permutation. (default 0).
+    start : int, optional
+        Position in the (padded) permutation at which to start. Needs to be a
+        multiple of ``world_size``. (default 0).
+    rank : int, optional
+        Rank of the process. (default 0).
+    world_size : int, optional
+        Number of processes. (default 1).
+    """
+    def __init__(self, n_sample, seed, epoch=0, start=0, rank=0, world_size=1):
+        if start % world_size != 0:
+            raise ValueError(f"start ({start}) needs to be a multiple of world_size ({world_size}).")
+        self.n_sample = n_sample
+        self.seed = seed
+        self.epoch = epoch
+        self.start = start
+        self.rank = rank
+        self.world_size = world_size
+
+    @property
+    def n_padded(self):
+        return -(-self.n_sample//self.world_size)*self.world_size
+
+    def get_permutation(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        permutation = rng.permutation(self.n_sample)
+        if self.n_padded > self.n_sample:
+            permutation = np.resize(permutation, self.n_padded)
+        return permutation
+
+    def __iter__(self):
+        return iter(self.get_permutation()[self.start+self.rank::self.world_size].tolist())
+
+    def __len__(self):
+        return (self.n_padded - self.start)//self.world_size
+
 class BAHAMASDataset:
     """Dataset that deals with loading the BAHAMAS stacks.
     
@@ -63,6 +145,15 @@ class BAHAMASDataset:
     mmap_mode : string, optional
         Memory map mode that is used to load the files. Gets passed to numpy.load.
         (default ``"r"``).
+    augment : bool, optional
+        Augment batches that are requested with an array of indicies. The 100
+        and 150 Mpc/h stacks are cropped at random periodic offsets from the 
+        tile grid and each sample gets one of the eight symmetries of the 
+        square. The augmentations are drawn from ``augmentation_seed``, the 
+        epoch set with ``set_epoch``, and the indicies of the batch. 
+        (default False).
+    augmentation_seed : int, optional
+        Seed of the augmentations. (default 0).
     verbose : bool, optional
         Verbosity of the output (default False).
     """
@@ -78,6 +169,8 @@ class BAHAMASDataset:
                  scale_to_SLICS=True,
                  subtract_minimum=False,
                  mmap_mode="r",
+                 augment=False,
+                 augmentation_seed=0,
                  verbose=False):
         
         self.fields = []
@@ -196,6 +289,10 @@ class BAHAMASDataset:
         self.transform = compile_transform(transform, self.stats)
         self.inverse_transform = compile_transform(inverse_transform, self.stats)
 
+        self.augment = augment
+        self.augmentation_seed = augmentation_seed
+        self.epoch = 0
+
         
 
     def create_transform(self, field, z):
@@ -297,7 +394,33 @@ class BAHAMASDataset:
             stats["var"] *= (1/(self.n_grid/8*5)*0.2793/(0.2793-0.0463))**2
         return stats
 
-    def get_stack(self, field, z, flat_idx):
+    def set_epoch(self, epoch):
+        """Sets the epoch, which selects the augmentations."""
+        self.epoch = epoch
+
+    def get_augmentations(self, idx):
+        """Draws the augmentations for a batch.
+        
+        Arguments
+        ---------
+        idx : numpy.array
+            Indicies of the samples in the batch.
+            
+        Returns
+        -------
+        offsets : numpy.array
+            Array of shape (N, 4) with the crop offsets in pixel of the 100 and
+            150 Mpc/h stacks, along the first and second axis.
+        symmetries : numpy.array
+            Array of shape (N,) with the symmetry of each sample, see 
+            ``apply_symmetries``.
+        """
+        rng = np.random.default_rng([self.augmentation_seed, self.epoch, *idx])
+        offsets = rng.integers(self.tile_size, size=(len(idx), 4))
+        symmetries = rng.integers(8, size=len(idx))
+        return offsets, symmetries
+
+    def get_stack(self, field, z, flat_idx, offset=None):
         """Returns a stack for a given field, redshift, and index.
         
         Arguments
@@ -308,6 +431,10 @@ class BAHAMASDataset:
             Redshift of the requested stack.
         flat_idx : int
             Index of the requested stack.
+        offset : tuple, optional
+            Offsets in pixel of the tiles of the 100 and 150 Mpc/h stacks 
+            from the tile grid, along the first and second axis. The stacks 
+            are periodic. (default None).
             
         Returns
         -------
@@ -319,13 +446,19 @@ class BAHAMASDataset:
         flat_idx = flat_idx%self.n_sample
         
 #         print(f"Getting stack for field {field}, z {z}, idx {flat_idx}")
-        idx = np.unravel_index(flat_idx, dims=(self.n_stack, self.n_tile, self.n_tile, 
-                                               self.n_stack, self.n_tile, self.n_tile))
+        idx = np.unravel_index(flat_idx, shape=(self.n_stack, self.n_tile, self.n_tile, 
+                                                self.n_stack, self.n_tile, self.n_tile))
         
         slice_idx_100 = idx[0] + self.stack_offset
         slice_idx_150 = idx[3] + self.stack_offset
-        tile_idx_100 = slice(idx[1]*self.tile_size, (idx[1]+1)*self.tile_size), slice(idx[2]*self.tile_size, (idx[2]+1)*self.tile_size)
-        tile_idx_150 = slice(idx[4]*self.tile_size, (idx[4]+1)*self.tile_size), slice(idx[5]*self.tile_size, (idx[5]+1)*self.tile_size)
+        if offset is None:
+            tile_idx_100 = slice(idx[1]*self.tile_size, (idx[1]+1)*self.tile_size), slice(idx[2]*self.tile_size, (idx[2]+1)*self.tile_size)
+            tile_idx_150 = slice(idx[4]*self.tile_size, (idx[4]+1)*self.tile_size), slice(idx[5]*self.tile_size, (idx[5]+1)*self.tile_size)
+        else:
+            # Pixels of the shifted tiles, wrapped around the periodic stacks
+            pixels = lambda i, o: (i*self.tile_size + o + np.arange(self.tile_size)) % self.n_grid
+            tile_idx_100 = np.ix_(pixels(idx[1], offset[0]), pixels(idx[2], offset[1]))
+            tile_idx_150 = np.ix_(pixels(idx[4], offset[2]), pixels(idx[5], offset[3]))
         d_100 = self.data[field][z]["100"][slice_idx_100][tile_idx_100]
         d_150 = self.data[field][z]["150"][slice_idx_150][tile_idx_150]
                 
@@ -338,7 +471,7 @@ class BAHAMASDataset:
         z = self.redshifts[redshift_idx]
         return z
     
-    def get_input_sample(self, idx, transform=True):
+    def get_input_sample(self, idx, transform=True, offset=None):
         """Get a sample for the input field.
 
         Arguments
@@ -348,6 +481,8 @@ class BAHAMASDataset:
         transform :bool, optional
             Transform the data. If True, returns the  inverse transform. 
             (default True). 
+        offset : tuple, optional
+            Crop offsets, see ``get_stack``. (default None).
         
         Returns
         -------
@@ -357,7 +492,7 @@ class BAHAMASDataset:
 
         z = self.sample_idx_to_redshift(idx)
 
-        d_input = self.get_stack(self.input_field, z, idx)
+        d_input = self.get_stack(self.input_field, z, idx, offset=offset)
         if self.scale_to_SLICS:
             d_input = 1/(self.n_grid/8*5)*0.2793/(0.2793-0.0463)*d_input
         if self.subtract_minimum:
@@ -366,7 +501,7 @@ class BAHAMASDataset:
             d_input = self.transform(d_input, self.input_field, z)
         return d_input
 
-    def get_label_sample(self, idx, transform=True):
+    def get_label_sample(self, idx, transform=True, offset=None):
         """Get a sample for the label fields.
 
         Arguments
@@ -376,6 +511,8 @@ class BAHAMASDataset:
         transform : bool, optional
             Transform the data. If True, returns the inverse transform. 
             (default True). 
+        offset : tuple, optional
+            Crop offsets, see ``get_stack``. (default None).
         
         Returns
         -------
@@ -387,7 +524,7 @@ class BAHAMASDataset:
         
         d_labels = []
         for label_field in self.label_fields:
-            d = self.get_stack(label_field, z, idx)
+            d = self.get_stack(label_field, z, idx, offset=offset)
             if transform:
                 d = self.transform(d, label_field, z)
             d_labels.append(d)
@@ -428,12 +565,9 @@ class BAHAMASDataset:
         else:
             z = [self.sample_idx_to_redshift(i) for i in idx]
             
-        samples = []
-        for i in idx:
-            s, _, _ = self[i]
-            samples.append(s)
+        samples, _, _ = self[idx]
         
-        return np.array(samples).swapaxes(0,1), idx, np.array(z)
+        return np.array(samples), idx, np.array(z)
         
     def __len__(self):
         """Return total number of samples.
@@ -444,21 +578,23 @@ class BAHAMASDataset:
         return self.n_sample*len(self.redshifts)
     
     def __getitem__(self, idx):
-        """Get a sample.
+        """Get a sample or a batch of samples.
 
         Arguments
         ---------
-        idx : int
-            Index of the sample.
+        idx : int or numpy.array
+            Index of the sample or indicies of a batch. Batches are augmented
+            if ``augment`` is set.
 
         Returns
         -------
         output : list
             List of sample fields, with order ``input_field, label_fields``.
-        idx : int
+            For a batch, each field is an array of shape (N, C, H, W).
+        idx : int or numpy.array
             Index of the requested sample. This can be used to access the
             inverse transforms.
-        z : float
+        z : float or numpy.array
             Redshift of the requested sample.
         """
         if not isinstance(idx, collections.abc.Iterable):
@@ -467,5 +603,19 @@ class BAHAMASDataset:
             
             return [d_input]+d_label, idx, self.sample_idx_to_redshift(idx)
         else:
-            raise NotImplementedError("Only int indicies are supported for now.")
+            idx = np.asarray(idx, dtype=np.int64)
+            if self.augment:
+                offsets, symmetries = self.get_augmentations(idx)
+            else:
+                offsets, symmetries = [None]*len(idx), None
+
+            samples = []
+            for i, offset in zip(idx, offsets):
+                samples.append([self.get_input_sample(i, offset=offset)] + self.get_label_sample(i, offset=offset))
+            # Gather the fields of the batch into arrays of shape (N, C, H, W)
+            fields = [np.stack([s[j] for s in samples]) for j in range(len(samples[0]))]
+            if symmetries is not None:
+                fields = [apply_symmetries(f, symmetries) for f in fields]
+
+            return fields, idx, np.array([self.sample_idx_to_redshift(i) for i in idx])
 
@@ -0,0 +1,99 @@
+import os
+import random
+
+import numpy as np
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing
+
+def is_distributed():
+    """Returns True if a process group has been initialised."""
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process():
+    return get_rank() == 0
+
+def init_distributed(backend="gloo", init_method="env://", rank=None, world_size=None):
+    """Initialise the default process group.
+
+    With the default ``init_method``, the rank, world size, and address of
+    rank 0 are read from the environment variables ``RANK``, ``WORLD_SIZE``,
+    ``MASTER_ADDR``, and ``MASTER_PORT``, as set by ``torchrun``. This allows
+    training to be spread over several nodes.
+    """
+    if rank is None:
+        rank = int(os.environ["RANK"])
+    if world_size is None:
+        world_size = int(os.environ["WORLD_SIZE"])
+    dist.init_process_group(backend=backend, init_method=init_method,
+                            rank=rank, world_size=world_size)
+
+def launch(fn, world_size, args=(), backend="gloo",
+           master_addr="127.0.0.1", master_port=29500, seed=None):
+    """Run ``fn(rank, world_size, *args)`` in ``world_size`` local processes.
+
+    Each process joins a process group over ``backend`` before ``fn`` is
+    called. The Python, NumPy, and PyTorch RNGs are seeded with
+    ``seed + rank``, or randomly if ``seed`` is None, so that the processes
+    draw different random numbers. ``fn`` and ``args`` need to be picklable.
+    """
+    torch.multiprocessing.spawn(_worker,
+                                args=(fn, world_size, args, backend, master_addr, master_port, seed),
+                                nprocs=world_size, join=True)
+
+def _worker(rank, fn, world_size, args, backend, master_addr, master_port, seed):
+    os.environ["MASTER_ADDR"] = master_addr
+    os.environ["MASTER_PORT"] = str(master_port)
+    # Each process gets its share of the cores
+    torch.set_num_threads(max(1, (os.cpu_count() or 1)//world_size))
+
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0] % 2**31)
+    random.seed(seed + rank)
+    np.random.seed(seed + rank)
+    torch.manual_seed(seed + rank)
+
+    init_distributed(backend=backend, rank=rank, world_size=world_size)
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+def broadcast_object(obj, src=0):
+    """Returns ``obj`` of rank ``src`` on all ranks."""
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+def all_gather_object(obj):
+    """Returns a list with ``obj`` of every rank."""
+    if not is_distributed():
+        return [obj]
+    objects = [None]*get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
+
+def all_reduce_mean(tensor):
+    """Returns the mean of ``tensor`` over all ranks."""
+    if not is_distributed():
+        return tensor
+    tensor = tensor.detach().clone()
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor/get_world_size()
+
+def broadcast_buffers(module, src=0):
+    """Overwrite the buffers (e.g., batch norm statistics) of ``module`` with
+    those of rank ``src``."""
+    if not is_distributed():
+        return
+    for buffer in module.buffers():
+        dist.broadcast(buffer.data, src=src)
@@ -0,0 +1,252 @@
+"""Synthetic data in the on-disk formats of the training and painting inputs.
+
+The mock data is only meant for testing and benchmarking: the fields are
+log-normal random fields without any physical structure.
+"""
+
+import os
+import pickle
+
+import numpy as np
+
+def write_mock_BAHAMAS_stacks(path, fields=["dm", "pressure"], redshifts=[0.0],
+                              n_stack=2, n_grid=2048, seed=0, dtype=np.float32):
+    """Writes log-normal mock stacks in the format of the BAHAMAS stacks.
+
+    For each field and redshift, the 100 and 150 Mpc/h stacks are written as
+    ``.npy`` files of shape (n_stack, n_grid, n_grid), one stack at a time so
+    that the memory use stays small. The file information is written to
+    ``files_info.pickle`` in the format expected by ``BAHAMASDataset``.
+
+    Arguments
+    ---------
+    path : str
+        Output directory.
+    fields : list, optional
+        Fields to write. The first field is the input field and the other
+        fields are correlated with it. (default ``["dm", "pressure"]``).
+    redshifts : list, optional
+        Redshifts to write. (default ``[0.0]``).
+    n_stack : int, optional
+        Number of stacks per file. (default 2).
+    n_grid : int, optional
+        Number of pixels on each side of the stacks. (default 2048).
+    seed : int, optional
+        Seed of the random numbers. (default 0).
+    dtype : numpy.dtype, optional
+        Data type of the stacks. (default numpy.float32).
+
+    Returns
+    -------
+    files_info : list
+        List of dicts describing the files, to be passed as ``files`` to
+        ``BAHAMASDataset`` together with ``root_path=path``.
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    files = {}
+    stats = {}
+    for z in redshifts:
+        for s in ["100", "150"]:
+            for field in fields:
+                filename = f"{field}_z{z:.3f}_{s}.npy"
+                files[(field, z, s)] = np.lib.format.open_memmap(os.path.join(path, filename), mode="w+",
+                                                                 dtype=dtype, shape=(n_stack, n_grid, n_grid))
+                stats[(field, z, s)] = (filename, [], [])
+            for i in range(n_stack):
+                # Labels are non-linear functions of the input field plus noise
+                d_input = rng.lognormal(mean=0.0, sigma=0.5+0.1*z, size=(n_grid, n_grid))
+                for j, field in enumerate(fields):
+                    if j == 0:
+                        d = d_input
+                    else:
+                        d = d_input**(1+j*0.5)*rng.lognormal(sigma=0.2, size=(n_grid, n_grid))
+                    files[(field, z, s)][i] = d
+                    stats[(field, z, s)][1].append(d.mean())
+                    stats[(field, z, s)][2].append(d.var())
+    for f in files.values():
+        f.flush()
+    del files
+
+    files_info = []
+    for z in redshifts:
+        for field in fields:
+            info = {"field" : field, "z" : z}
+            for s in ["100", "150"]:
+                filename, mean, var = stats[(field, z, s)]
+                info["file_"+s] = filename
+                info["mean_"+s] = np.mean(mean, dtype=dtype)
+                info["var_"+s] = np.mean(var, dtype=dtype)
+            files_info.append(info)
+
+    with open(os.path.join(path, "files_info.pickle"), "wb") as f:
+        pickle.dump(files_info, f)
+
+    return files_info
+
+def create_mock_architecture(tile_size=512, n_x_feature=1, width=1):
+    """Returns a CVAE architecture with the layout of the fiducial model.
+
+    Arguments
+    ---------
+    tile_size : int, optional
+        Size of the tiles in pixel. Needs to be a multiple of 32. (default 512).
+    n_x_feature : int, optional
+        Number of output features. (default 1).
+    width : float, optional
+        Factor for the number of channels, relative to the fiducial model.
+        (default 1).
+    """
+    from baryon_painter.models import cvae
+
+    if tile_size % 32 != 0:
+        raise ValueError(f"tile_size needs to be a multiple of 32, not {tile_size}.")
+    c = lambda n: max(1, int(n*width))
+    dim_z = (1, tile_size//32, tile_size//32)
+    return {"type" :        "Type-1",
+            "dim_x" :       (n_x_feature, tile_size, tile_size),
+            "dim_y" :       (1, tile_size, tile_size),
+            "dim_z" :       dim_z,
+            "n_x_features": n_x_feature,
+            "aux_label" :   True,
+            "q_x_in" :      cvae.conv_down(in_channel=n_x_feature, channels=[c(8),c(16),c(32)], scales=[2,4,4]),
+            "q_y_in" :      cvae.conv_down(in_channel=2, channels=[c(8),c(16),c(32)], scales=[2,4,4]),
+            "q_x_y_out" :     cvae.conv_block(2*c(32), 2*dim_z[0], kernel=5)
+                            + [("unflatten", (2, *dim_z)),],
+            "p_y_in" :      None,
+            "p_z_in" :      cvae.conv_up(1, channels=[1,1,1], scales=[2,4,4], bias=False, batchnorm=True),
+            "p_y_z_in" :      cvae.conv_block(3, c(16), kernel=5)
+                            + cvae.conv_down(in_channel=c(16), channels=[c(32), c(64), c(128)], scales=[2, 2, 2])
+                            + [("residual block", cvae.res_block(c(128))),
+                               ("residual block", cvae.res_block(c(128))),]
+                            + cvae.conv_up(c(128), channels=[c(64),c(32),c(16)], scales=[2,2,2], bias=False, batchnorm=True, activation="ReLU"),
+            "p_y_z_out" :   (  cvae.conv_block(c(16), c(8), kernel=7, bias=False, batchnorm=False, activation="PReLU")
+                             + cvae.conv_block(c(8), n_x_feature, kernel=5, bias=False, batchnorm=False, activation="PReLU")
+                             + cvae.conv_block(n_x_feature, n_x_feature, kernel=3, bias=False, batchnorm=False, activation="softplus"),
+                            ),
+            "min_x_var" :   1e-7,
+            "min_z_var" :   1e-7,
+            "L" :           1,
+           }
+
+# Redshifts of the first SLICS lens planes (approximate)
+SLICS_redshifts = [0.042, 0.130, 0.221, 0.317, 0.418, 0.525, 0.640, 0.764, 0.897, 
+                   1.041, 1.199, 1.372, 1.562, 1.772, 2.007, 2.269, 2.565, 2.899]
+
+def _write_lognormal(f, n_pixel, mean, sigma, rng, offset=0.0, smoothing=8, n_row_block=256):
+    # The Gaussian field is drawn on a coarse grid and interpolated bilinearly,
+    # so that the planes are smooth on the scale of a few pixels, like the 
+    # interpolated SLICS planes. The field is written in blocks of rows to keep
+    # the memory use small.
+    g = rng.normal(size=(n_pixel//smoothing+2, n_pixel//smoothing+2))
+    x = np.arange(n_pixel)/smoothing
+    idx = x.astype(int)
+    w = x - idx
+    for i in range(0, n_pixel, n_row_block):
+        rows = slice(i, min(i+n_row_block, n_pixel))
+        block = g[idx[rows]]*(1-w[rows,None]) + g[idx[rows]+1]*w[rows,None]
+        block = block[:,idx]*(1-w) + block[:,idx+1]*w
+        (mean*np.exp(sigma*block - sigma**2/2) - offset).astype(np.float32).tofile(f)
+
+def write_mock_SLICS(path, LOS=1097, z_SLICS=SLICS_redshifts, n_massplane=3,
+                     n_pixel_delta=7745, n_pixel_massplane=4096*3,
+                     sigma=1.0, seed=0):
+    """Writes log-normal mock SLICS lightcone planes.
+
+    The files are written with the names and binary layouts that
+    ``process_SLICS`` and ``scripts/create_lightcone.py`` expect:
+
+    - ``delta/{z:.3f}delta.dat_bicubic_LOS{LOS}``: raw float32 array of shape
+      (n_pixel_delta, n_pixel_delta), holding the transposed plane, with the
+      mean particle count per mass plane pixel subtracted.
+    - ``massplanes/{z:.3f}proj_half_finer_{proj}.dat_LOS{LOS}``: raw float32
+      array with one header value followed by the transposed
+      (n_pixel_massplane, n_pixel_massplane) plane of particle counts. The
+      projection cycles through ``xy``, ``xz``, ``yz`` with the plane index.
+    - ``random_shifts/random_shift_LOS{LOS}``: text file with the shifts of
+      the planes, in reverse order.
+
+    The planes are log-normal fields, smooth on the scale of a few pixels,
+    with about the mean particle count per pixel of the SLICS mass planes, so
+    that the normalisation in ``process_SLICS`` gives the same range of values
+    as for the real planes.
+
+    Arguments
+    ---------
+    path : str
+        Output directory.
+    LOS : int, optional
+        Line of sight. (default 1097).
+    z_SLICS : list, optional
+        Redshifts of the planes. (default ``SLICS_redshifts``).
+    n_massplane : int, optional
+        Number of planes, starting at the lowest redshift, for which mass 
+        planes are written. These are used for the planes that are smaller 
+        than a tile. (default 3).
+    n_pixel_delta : int, optional
+        Size of the delta planes. (default 7745).
+    n_pixel_massplane : int, optional
+        Size of the mass planes. (default 12288).
+    sigma : float, optional
+        Standard deviation of the logarithm of the planes. (default 1.0).
+    seed : int, optional
+        Seed of the random numbers. (default 0).
+    """
+    rng = np.random.default_rng(seed)
+    # Mean particle count per pixel of the 12288^2 mass planes
+    mean_count = 3072**3/2/12288**2
+    projections = ["xy", "xz", "yz"]
+
+    for d in ["delta", "massplanes", "random_shifts"]:
+        os.makedirs(os.path.join(path, d), exist_ok=True)
+
+    for i, z in enumerate(z_SLICS):
+        with open(os.path.join(path, "delta", f"{z:.3f}delta.dat_bicubic_LOS{LOS}"), "wb") as f:
+            _write_lognormal(f, n_pixel_delta, mean_count, sigma, rng, offset=mean_count)
+
+        if i < n_massplane:
+            with open(os.path.join(path, "massplanes", f"{z:.3f}proj_half_finer_{projections[i%3]}.dat_LOS{LOS}"), "wb") as f:
+                np.zeros(1, dtype=np.float32).tofile(f)
+                _write_lognormal(f, n_pixel_massplane, mean_count, sigma, rng)
+
+    shifts = rng.uniform(size=(len(z_SLICS), 2))
+    np.savetxt(os.path.join(path, "random_shifts", f"random_shift_LOS{LOS}"), shifts[::-1])
+
+def create_mock_painter(path, tile_size=512, width=1, compute_device="cpu", seed=0,
+                        label_fields=["pressure"], architecture=None):
+    """Returns a ``CVAEPainter`` with random weights.
+
+    The painter uses the range-compress transforms of the fiducial model, with
+    the statistics of mock stacks written to ``path``. The model state and 
+    metadata are saved to ``path`` as well, so that the painter is set up the 
+    same way as a trained one. With several ``label_fields``, the painter 
+    paints all of them with one feature each. ``architecture`` replaces the
+    default ``create_mock_architecture(tile_size, width=width, 
+    n_x_feature=len(label_fields))``.
+    """
+    import torch
+    import baryon_painter.painter
+    from baryon_painter.utils import datasets, data_transforms
+
+    fields = ["dm"] + label_fields
+    files_info = write_mock_BAHAMAS_stacks(path, fields=fields, n_stack=1, n_grid=tile_size, seed=seed)
+    transform, inv_transform = data_transforms.create_range_compress_transforms(
+                                                    k_values={f : 4.0 for f in fields},
+                                                    modes={f : "shift-log" for f in fields},
+                                                    eps=1e-4)
+    # The mock stacks already have the units of the SLICS planes
+    dataset = datasets.BAHAMASDataset(files=files_info, root_path=path, n_tile=1, scale_to_SLICS=False,
+                                      label_fields=label_fields,
+                                      transform=data_transforms.chain_transformations([transform,
+                                                                                       data_transforms.atleast_3d]),
+                                      inverse_transform=data_transforms.chain_transformations([data_transforms.squeeze,
+                                                                                               inv_transform]))
+    if architecture is None:
+        architecture = create_mock_architecture(tile_size, width=width, n_x_feature=len(label_fields))
+    torch.manual_seed(seed)
+    painter = baryon_painter.painter.CVAEPainter(training_data_set=dataset, 
+                                                 architecture=architecture,
+                                                 compute_device=compute_device)
+    filenames = (os.path.join(path, "model_state"), os.path.join(path, "model_meta"))
+    painter.save_state_to_file(filenames)
+    return baryon_painter.painter.CVAEPainter(filenames, compute_device=compute_device)
@@ -0,0 +1,23 @@
+import numpy as np
+
+import torch
+
+def get_seed(*key):
+    """Returns a 64 bit seed derived from a key of non-negative integers.
+
+    Different keys give statistically independent seeds, so that, e.g., the
+    key (seed, LOS, plane, tile) gives each tile its own noise stream.
+    """
+    key = [int(k) for k in key]
+    if any(k < 0 for k in key):
+        raise ValueError(f"Keys need to be non-negative: {key}.")
+    return int(np.random.SeedSequence(key).generate_state(1, dtype=np.uint64)[0] >> 1)
+
+def standard_normal(shape, key, dtype=torch.float32, device="cpu"):
+    """Returns standard normal noise determined by ``key``.
+
+    The noise is drawn on the CPU, so it doesn't depend on the device.
+    """
+    generator = torch.Generator()
+    generator.manual_seed(get_seed(*key))
+    return torch.randn(shape, generator=generator, dtype=dtype).to(device)
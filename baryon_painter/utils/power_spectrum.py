@@ -0,0 +1,242 @@
+import functools
+import collections
+
+import numpy as np
+
+pi = np.pi
+
+KBinning = collections.namedtuple("KBinning", ["bin_idx", "mode_weights", "n_mode", "k", "k_bin_edges"])
+
+@functools.lru_cache(maxsize=32)
+def get_k_binning(shape, L, k_min=None, k_max=None, n_k_bin=20, logspaced_k_bins=True):
+    """Returns the assignment of the Fourier modes of a real FFT to k bins.
+
+    The binning is cached for each combination of arguments, so that it only
+    gets computed once for maps of the same shape and size.
+
+    Arguments
+    ---------
+    shape : tuple
+        Shape (H, W) of the maps.
+    L : float
+        Physical size of the maps along the first axis. The pixels are
+        assumed to be square.
+    k_min : float, optional
+        Lower edge of the first bin. (default ``2*pi/L``).
+    k_max : float, optional
+        Upper edge of the last bin. (default Nyquist frequency
+        ``2*pi/L*H/2``).
+    n_k_bin : int, optional
+        Number of bins. (default 20).
+    logspaced_k_bins : bool, optional
+        Logarithmically spaced bins. Otherwise the bins are linearly spaced.
+        (default True).
+
+    Returns
+    -------
+    binning : KBinning
+        Named tuple with the bin index of each mode of the ``rfft2``
+        (``n_k_bin`` for modes outside of the bins), the multiplicity of each
+        mode in the full FFT, the number of modes and mean k in each bin, and
+        the bin edges.
+    """
+    H, W = shape
+    pixel_size = L/H
+    k_min = 2*pi/L if k_min is None else k_min
+    k_max = 2*pi/L*H/2 if k_max is None else k_max
+    if logspaced_k_bins:
+        k_bin_edges = np.logspace(np.log10(k_min), np.log10(k_max), n_k_bin+1, endpoint=True)
+    else:
+        k_bin_edges = np.linspace(k_min, k_max, n_k_bin+1, endpoint=True)
+
+    k_x = np.fft.fftfreq(H, d=pixel_size)*2*pi
+    k_y = np.fft.rfftfreq(W, d=pixel_size)*2*pi
+    k_mag = np.sqrt(k_x[:,None]**2 + k_y[None,:]**2).ravel()
+
+    # Modes other than k_y = 0 and the Nyquist frequency have a complex
+    # conjugate partner that is not part of the rfft
+    mode_weights = np.full((H, W//2+1), 2.0)
+    mode_weights[:,0] = 1.0
+    if W % 2 == 0:
+        mode_weights[:,-1] = 1.0
+    mode_weights = mode_weights.ravel()
+
+    # Same convention as numpy.histogram: the last bin includes its upper edge
+    bin_idx = np.searchsorted(k_bin_edges, k_mag, side="right") - 1
+    bin_idx[k_mag == k_bin_edges[-1]] = n_k_bin-1
+    bin_idx[(bin_idx < 0) | (bin_idx >= n_k_bin)] = n_k_bin
+
+    n_mode = np.bincount(bin_idx, weights=mode_weights, minlength=n_k_bin+1)[:n_k_bin]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        k = np.bincount(bin_idx, weights=mode_weights*k_mag, minlength=n_k_bin+1)[:n_k_bin]/n_mode
+
+    for a in [bin_idx, mode_weights, n_mode, k, k_bin_edges]:
+        a.flags.writeable = False
+    return KBinning(bin_idx, mode_weights, n_mode, k, k_bin_edges)
+
+def _bin(x, binning):
+    # Weighted sums over the modes in each bin, for each map in the batch
+    n_map = x.shape[0]
+    n_bin = len(binning.n_mode)
+    idx = (binning.bin_idx[None,:] + (n_bin+1)*np.arange(n_map)[:,None]).ravel()
+    s = np.bincount(idx, weights=(x*binning.mode_weights).ravel(), minlength=n_map*(n_bin+1))
+    return s.reshape(n_map, n_bin+1)[:,:n_bin]
+
+def binned_power_spectrum(A_k, B_k, binning, L, shape):
+    """Returns the binned (cross) power spectrum of the ``rfft2`` of maps.
+
+    Arguments
+    ---------
+    A_k, B_k : numpy.ndarray
+        Real FFTs of the maps, of shape (..., H, W//2+1).
+    binning : KBinning
+        Binning, from ``get_k_binning``.
+    L : float
+        Physical size of the maps along the first axis.
+    shape : tuple
+        Shape (H, W) of the maps.
+
+    Returns
+    -------
+    Pk : numpy.ndarray
+        Power spectrum of shape (..., n_k_bin).
+    Pk_var : numpy.ndarray
+        Variance of the mean power in each bin, estimated from the scatter of
+        the modes.
+    """
+    H, W = shape
+    batch_shape = A_k.shape[:-2]
+    P = (A_k*B_k.conj()).real.reshape(-1, A_k.shape[-2]*A_k.shape[-1])*(L*L*W/H/(H*W)**2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        Pk = _bin(P, binning)/binning.n_mode
+        Pk_var = (_bin(P**2, binning)/binning.n_mode - Pk**2)/binning.n_mode
+    return Pk.reshape(*batch_shape, -1), Pk_var.reshape(*batch_shape, -1)
+
+def power_spectrum(A, B=None, L=1.0, k_min=None, k_max=None, n_k_bin=20, logspaced_k_bins=True):
+    """Auto or cross power spectrum of a batch of maps.
+
+    The maps are transformed with a single batched FFT and the k binning is
+    cached (see ``get_k_binning``).
+
+    Arguments
+    ---------
+    A : numpy.ndarray
+        Maps of shape (..., H, W).
+    B : numpy.ndarray, optional
+        Maps of the same shape as ``A`` for the cross power spectrum. If not
+        provided, the auto power spectrum of ``A`` is computed. (default None).
+    L : float, optional
+        Physical size of the maps along the first axis. (default 1).
+    k_min, k_max, n_k_bin, logspaced_k_bins : optional
+        Binning, see ``get_k_binning``.
+
+    Returns
+    -------
+    Pk : numpy.ndarray
+        Power spectra of shape (..., n_k_bin).
+    k : numpy.ndarray
+        Mean k of the modes in each bin.
+    Pk_var : numpy.ndarray
+        Variance of the mean power in each bin.
+    n_mode : numpy.ndarray
+        Number of modes in each bin.
+    """
+    A = np.asarray(A)
+    shape = A.shape[-2:]
+    binning = get_k_binning(shape, float(L), k_min, k_max, n_k_bin, logspaced_k_bins)
+    A_k = np.fft.rfft2(A)
+    if B is None:
+        B_k = A_k
+    else:
+        if np.shape(B) != A.shape:
+            raise ValueError(f"Shapes of A and B don't match: {A.shape} vs {np.shape(B)}.")
+        B_k = np.fft.rfft2(B)
+    Pk, Pk_var = binned_power_spectrum(A_k, B_k, binning, L, shape)
+    return Pk, binning.k, Pk_var, binning.n_mode
+
+def transform_fields(output_true, output_pred, input,
+                     input_transform=None, output_transforms=None,
+                     n_feature_per_field=1):
+    """Applies the per-sample transforms to the true and predicted fields and
+    the input.
+
+    Returns
+    -------
+    A_true, A_pred : numpy.ndarray
+        Transformed true and predicted fields of shape (N, n_field, H, W).
+    B : numpy.ndarray
+        Transformed input of shape (N, H, W).
+    """
+    n_sample = output_true.shape[0]
+    n_field = output_true.shape[1]//n_feature_per_field
+    identity = lambda x: x
+
+    A_true, A_pred, B = [], [], []
+    for j in range(n_sample):
+        in_transform = input_transform[j] if input_transform is not None else identity
+        B.append(in_transform(input[j,:n_feature_per_field]).squeeze())
+        for i in range(n_field):
+            out_transform = output_transforms[j][i] if output_transforms is not None else identity
+            s = slice(i*n_feature_per_field, (i+1)*n_feature_per_field)
+            A_true.append(out_transform(output_true[j,s]).squeeze())
+            A_pred.append(out_transform(output_pred[j,s]).squeeze())
+
+    shape = np.shape(B[0])
+    A_true = np.array(A_true).reshape(n_sample, n_field, *shape)
+    A_pred = np.array(A_pred).reshape(n_sample, n_field, *shape)
+    return A_true, A_pred, np.array(B)
+
+def compute_spectra(output_true, output_pred, input, L,
+                    input_transform=None, output_transforms=None,
+                    n_k_bin=20, logspaced_k_bins=True,
+                    n_feature_per_field=1):
+    """Auto and cross power spectra of the true and predicted fields.
+
+    Each map is only transformed once: one batched FFT for each of the true,
+    predicted, and input fields.
+
+    Arguments
+    ---------
+    output_true, output_pred : numpy.ndarray
+        True and predicted fields of shape (N, C, H, W).
+    input : numpy.ndarray
+        Input fields of shape (N, C_in, H, W).
+    L : float
+        Physical size of the tiles.
+    input_transform : list, optional
+        Transform of the input for each sample. (default None).
+    output_transforms : list, optional
+        List with the transforms of each output field for each sample.
+        (default None).
+    n_k_bin : int, optional
+        Number of bins between ``2*pi/L`` and the Nyquist frequency.
+        (default 20).
+    logspaced_k_bins : bool, optional
+        Logarithmically spaced bins. (default True).
+    n_feature_per_field : int, optional
+        Number of features of each field. (default 1).
+
+    Returns
+    -------
+    spectra : dict
+        Dict with ``k`` and ``n_mode`` of the bins, and the spectra
+        ``auto_true``, ``auto_pred``, ``cross_true``, ``cross_pred`` of shape
+        (N, n_field, n_k_bin), where the cross spectra are between the output
+        and input fields.
+    """
+    A_true, A_pred, B = transform_fields(output_true, output_pred, input,
+                                         input_transform=input_transform,
+                                         output_transforms=output_transforms,
+                                         n_feature_per_field=n_feature_per_field)
+    shape = B.shape[-2:]
+    A_true_k = np.fft.rfft2(A_true)
+    A_pred_k = np.fft.rfft2(A_pred)
+    B_k = np.fft.rfft2(B)[:,None]
+
+    binning = get_k_binning(shape, float(L), n_k_bin=n_k_bin, logspaced_k_bins=logspaced_k_bins)
+    spectra = {"k" : binning.k, "n_mode" : binning.n_mode}
+    spectra["auto_true"], _ = binned_power_spectrum(A_true_k, A_true_k, binning, L, shape)
+    spectra["auto_pred"], _ = binned_power_spectrum(A_pred_k, A_pred_k, binning, L, shape)
+    spectra["cross_true"], _ = binned_power_spectrum(A_true_k, B_k, binning, L, shape)
+    spectra["cross_pred"], _ = binned_power_spectrum(A_pred_k, B_k, binning, L, shape)
+    return spectra
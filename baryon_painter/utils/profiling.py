@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import socket
+import resource
+import threading
+import contextlib
+import collections
+
+_active = threading.local()
+
+def get_peak_rss():
+    """Returns the peak resident set size of the process in bytes."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def get_rss():
+    """Returns the current resident set size of the process in bytes, or None
+    if it isn't available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1])*resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+def _new_stage():
+    return {"time" : 0.0, "count" : 0, "n_byte" : 0}
+
+class StageTimer:
+    """Records the wall time, number of calls, and bytes of named stages.
+
+    Stages are recorded in total and for the current plane, which is set with
+    ``start_plane``. Code that doesn't have access to the timer, such as the
+    painters, can record stages with the module-level ``stage`` function while
+    the timer is activated with ``activate``.
+
+    At the end of each plane, the current resident set size of the process is
+    recorded as ``rss`` of the plane. ``peak_rss`` of the plane is the largest
+    resident set size sampled at the start and end of the plane and at the 
+    end of each of its stages, so allocations that are freed within a stage 
+    are missed. Both are None where the resident set size isn't available.
+
+    Stages can be nested, in which case the time of the inner stages is
+    included in the outer stage. By convention, nested stages are named with
+    dots, e.g., ``paint.forward`` inside ``paint``.
+
+    Example
+    -------
+    ::
+
+        timer = StageTimer()
+        timer.start_plane("0.042")
+        with timer.stage("read", n_byte=os.path.getsize(filename)):
+            d = np.fromfile(filename, dtype=np.float32)
+        with timer.activate():
+            painter.paint(tile)
+        timer.end_plane()
+        timer.write_report("timings.json", LOS=1097)
+    """
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.planes = collections.OrderedDict()
+        self._plane = None
+        self._plane_start = None
+        self._start = time.perf_counter()
+
+    def start_plane(self, plane):
+        """Starts recording the stages of ``plane``. Recording the same plane
+        again adds to its stages."""
+        self.end_plane()
+        self._plane = str(plane)
+        self._plane_start = time.perf_counter()
+        self.planes.setdefault(self._plane, {"wall_time" : 0.0, "stages" : collections.OrderedDict(),
+                                             "rss" : None, "peak_rss" : None})
+        self._sample_rss()
+
+    def end_plane(self):
+        if self._plane is not None:
+            plane = self.planes[self._plane]
+            plane["wall_time"] += time.perf_counter() - self._plane_start
+            plane["rss"] = self._sample_rss()
+        self._plane = None
+
+    def _sample_rss(self):
+        """Updates the peak resident set size of the current plane and returns
+        the current one."""
+        rss = get_rss()
+        if rss is not None:
+            plane = self.planes[self._plane]
+            plane["peak_rss"] = max(rss, plane["peak_rss"] or 0)
+        return rss
+
+    def add(self, name, t, n_byte=0, count=1):
+        """Adds time ``t`` in seconds to stage ``name``."""
+        records = [self.stages]
+        if self._plane is not None:
+            records.append(self.planes[self._plane]["stages"])
+        for r in records:
+            s = r.setdefault(name, _new_stage())
+            s["time"] += t
+            s["count"] += count
+            s["n_byte"] += int(n_byte)
+        if self._plane is not None:
+            self._sample_rss()
+
+    @contextlib.contextmanager
+    def stage(self, name, n_byte=0, count=1):
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter()-t_start, n_byte=n_byte, count=count)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Records the stages of the module-level ``stage`` function on this
+        timer, in the current thread."""
+        previous = getattr(_active, "timer", None)
+        _active.timer = self
+        try:
+            yield self
+        finally:
+            _active.timer = previous
+
+    def get_report(self, **metadata):
+        """Returns the recorded stages as a dict. Keyword arguments are added
+        to the metadata of the report."""
+        self.end_plane()
+        return {"metadata"  : {"host"              : socket.gethostname(),
+                               "pid"               : os.getpid(),
+                               "slurm_job_id"      : os.environ.get("SLURM_ARRAY_JOB_ID", os.environ.get("SLURM_JOB_ID")),
+                               "slurm_task_id"     : os.environ.get("SLURM_ARRAY_TASK_ID"),
+                               **metadata},
+                "wall_time" : time.perf_counter() - self._start,
+                "stages"    : self.stages,
+                "planes"    : self.planes}
+
+    def write_report(self, filename, **metadata):
+        """Writes the report as JSON to ``filename``."""
+        with open(filename, "w") as f:
+            json.dump(self.get_report(**metadata), f, indent=2)
+
+def stage(name, n_byte=0, count=1):
+    """Records stage ``name`` on the active timer. Does nothing if no timer
+    is active."""
+    timer = getattr(_active, "timer", None)
+    if timer is None:
+        return contextlib.nullcontext()
+    return timer.stage(name, n_byte=n_byte, count=count)
+
+def aggregate_reports(reports):
+    """Sums the stages of several reports, e.g., of the tasks of a SLURM array.
+
+    Arguments
+    ---------
+    reports : list
+        List of reports or filenames of JSON reports.
+
+    Returns
+    -------
+    aggregate : dict
+        Number of reports, summed wall time, and the summed stages in total
+        and per plane. The peak RSS of each plane is the maximum over the 
+        reports.
+    """
+    aggregate = {"n_report" : 0, "wall_time" : 0.0,
+                 "stages" : collections.OrderedDict(), "planes" : collections.OrderedDict()}
+    def add_stages(stages, other):
+        for name, s in other.items():
+            a = stages.setdefault(name, _new_stage())
+            for k in a:
+                a[k] += s[k]
+
+    for report in reports:
+        if isinstance(report, str):
+            with open(report, "r") as f:
+                report = json.load(f)
+        aggregate["n_report"] += 1
+        aggregate["wall_time"] += report["wall_time"]
+        add_stages(aggregate["stages"], report["stages"])
+        for plane, p in report["planes"].items():
+            a = aggregate["planes"].setdefault(plane, {"wall_time" : 0.0, "stages" : collections.OrderedDict()})
+            a["wall_time"] += p["wall_time"]
+            if p.get("peak_rss") is not None:
+                a["peak_rss"] = max(a.get("peak_rss", 0), p["peak_rss"])
+            add_stages(a["stages"], p["stages"])
+    return aggregate
+
+class StepTimer:
+    """Records where the time of each training step goes.
+
+    The time since the last call of ``lap`` is added to the given phase, so
+    that calling ``lap`` after each part of a step splits the step into
+    phases without gaps. ``end_step`` finishes a step and writes it as a JSON
+    line to ``filename``, with the time of each phase in seconds, the number of
+    samples, and the peak memory.
+
+    On GPUs, kernels run asynchronously and their time shows up in the phase
+    that waits for them, unless ``synchronize`` is set, which synchronises
+    the device at each lap at the cost of some throughput.
+
+    Arguments
+    ---------
+    filename : str, optional
+        JSON lines file the steps get written to. (default None).
+    append : bool, optional
+        Append to an existing file. (default False).
+    device : torch.device, optional
+        Device of the model, used for the GPU memory and synchronisation.
+        (default None).
+    synchronize : bool, optional
+        Synchronise the device at each lap. (default False).
+    buffer_size : int, optional
+        Number of steps that are buffered before they get written.
+        (default 100).
+    """
+    def __init__(self, filename=None, append=False, device=None, synchronize=False, buffer_size=100):
+        import torch
+        self.device = torch.device(device) if device is not None else None
+        self.is_cuda = self.device is not None and self.device.type == "cuda"
+        self.synchronize = synchronize and self.is_cuda
+        self.filename = filename
+        self._file = open(filename, "a" if append else "w") if filename is not None else None
+        self._buffer = []
+        self.buffer_size = buffer_size
+        self._n_step = 0
+
+        self._phases = collections.OrderedDict()
+        self._window = collections.OrderedDict()
+        self._window_n_step = 0
+        self._window_n_sample = 0
+        self._t = time.perf_counter()
+
+    def lap(self, phase):
+        """Adds the time since the last lap to ``phase``."""
+        if self.synchronize:
+            import torch
+            torch.cuda.synchronize(self.device)
+        t = time.perf_counter()
+        self._phases[phase] = self._phases.get(phase, 0.0) + t - self._t
+        self._t = t
+
+    def get_peak_memory(self):
+        memory = {"peak_rss" : get_peak_rss()}
+        if self.is_cuda:
+            import torch
+            memory["peak_gpu_memory"] = torch.cuda.max_memory_allocated(self.device)
+        return memory
+
+    def end_step(self, n_sample, **info):
+        """Finishes a step with ``n_sample`` samples. Keyword arguments are
+        added to the record of the step."""
+        step_time = sum(self._phases.values())
+        record = {**info,
+                  "n_sample"      : n_sample,
+                  "step_time"     : step_time,
+                  "samples_per_s" : n_sample/step_time if step_time > 0 else 0.0,
+                  "phases"        : dict(self._phases),
+                  **self.get_peak_memory()}
+        if self._file is not None:
+            self._buffer.append(json.dumps(record))
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+        for phase, t in self._phases.items():
+            self._window[phase] = self._window.get(phase, 0.0) + t
+        self._window_n_step += 1
+        self._window_n_sample += n_sample
+        self._n_step += 1
+        self._phases = collections.OrderedDict()
+        return record
+
+    def get_summary(self, reset=True):
+        """Returns the mean time per step of each phase, the fraction of time
+        spent waiting for data, and the throughput since the last summary."""
+        total = sum(self._window.values())
+        n_step = max(self._window_n_step, 1)
+        summary = {"n_step"             : self._window_n_step,
+                   "step_time"          : total/n_step,
+                   "samples_per_s"      : self._window_n_sample/total if total > 0 else 0.0,
+                   "data_wait_fraction" : self._window.get("data_wait", 0.0)/total if total > 0 else 0.0,
+                   "phases"             : {p : t/n_step for p, t in self._window.items()},
+                   **self.get_peak_memory()}
+        if reset:
+            self._window = collections.OrderedDict()
+            self._window_n_step = 0
+            self._window_n_sample = 0
+        return summary
+
+    def get_pretty_str(self, reset=True):
+        s = self.get_summary(reset)
+        phases = ", ".join(f"{p}: {t*1e3:.1f}" for p, t in s["phases"].items())
+        out = f"Step time: {s['step_time']*1e3:.1f} ms ({phases} ms), {s['samples_per_s']:.1f} samples/s, "
+        out += f"data wait: {s['data_wait_fraction']*100:.0f}%, peak RSS: {s['peak_rss']/1024**2:.0f} MB"
+        if "peak_gpu_memory" in s:
+            out += f", peak GPU memory: {s['peak_gpu_memory']/1024**2:.0f} MB"
+        return out
+
+    def state_dict(self):
+        """Returns the number of steps of the timer. A step that has started 
+        but not ended yet is included, as it is recorded once it ends."""
+        self.flush()
+        return {"n_step" : self._n_step + (1 if len(self._phases) > 0 else 0)}
+
+    def load_state_dict(self, state):
+        """Restore the state of the timer.
+
+        Steps that were written to the timings file after the state was saved
+        are removed from the file."""
+        self._buffer = []
+        self._n_step = state["n_step"]
+        if self._file is not None:
+            self._file.flush()
+            offset = 0
+            with open(self.filename, "rb") as f:
+                for _ in range(self._n_step):
+                    line = f.readline()
+                    if len(line) == 0:
+                        break
+                    offset += len(line)
+            self._file.truncate(offset)
+
+    def flush(self):
+        if self._file is not None:
+            if len(self._buffer) > 0:
+                self._file.write("\n".join(self._buffer) + "\n")
+                self._buffer = []
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self.flush()
+            self._file.close()
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Fixed-width record: index of the sample in the dataset and number of the
+# batch it was processed in.
+SAMPLE_INDEX_DTYPE = np.dtype([("sample_idx", "<i8"), ("batch", "<i8")])
+
+class SampleIndexLog:
+    """Append-only binary log of the samples used in training.
+
+    Records are buffered and written in chunks of ``chunk_size`` records. The
+    file has no header and can be read with ``load_sample_index_log``.
+
+    Arguments
+    ---------
+    filename : str
+        Path of the log file.
+    chunk_size : int, optional
+        Number of records buffered before they get written to disk.
+        (default 65536).
+    append : bool, optional
+        Append to an existing log instead of truncating it. (default False).
+    """
+    def __init__(self, filename, chunk_size=65536, append=False):
+        self.filename = filename
+        self._file = open(filename, "ab" if append else "wb")
+        self._buffer = np.empty(chunk_size, dtype=SAMPLE_INDEX_DTYPE)
+        self._n_buffered = 0
+        self.n_written = self._file.tell()//SAMPLE_INDEX_DTYPE.itemsize
+
+    def __len__(self):
+        return self.n_written + self._n_buffered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, sample_idx, batch):
+        """Add the sample indices of a batch to the log."""
+        sample_idx = np.asarray(sample_idx, dtype=np.int64).reshape(-1)
+        while len(sample_idx) > 0:
+            n = min(len(sample_idx), len(self._buffer) - self._n_buffered)
+            s = slice(self._n_buffered, self._n_buffered + n)
+            self._buffer["sample_idx"][s] = sample_idx[:n]
+            self._buffer["batch"][s] = batch
+            self._n_buffered += n
+            sample_idx = sample_idx[n:]
+            if self._n_buffered == len(self._buffer):
+                self.flush()
+
+    def flush(self):
+        """Write buffered records to disk."""
+        if self._n_buffered > 0:
+            self._file.write(self._buffer[:self._n_buffered].tobytes())
+            self.n_written += self._n_buffered
+            self._n_buffered = 0
+        self._file.flush()
+
+    def truncate(self, n_record):
+        """Discard all records after the first ``n_record``."""
+        self.flush()
+        if n_record > self.n_written:
+            raise ValueError(f"Log only has {self.n_written} records.")
+        self._file.truncate(n_record*SAMPLE_INDEX_DTYPE.itemsize)
+        self.n_written = n_record
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+def load_sample_index_log(filename, mode="r"):
+    """Load a sample index log.
+
+    Returns
+    -------
+    log : numpy.memmap
+        Structured array with fields ``sample_idx`` and ``batch``.
+    """
+    with open(filename, "rb") as f:
+        f.seek(0, 2)
+        size = f.tell()
+    if size == 0:
+        return np.empty(0, dtype=SAMPLE_INDEX_DTYPE)
+    return np.memmap(filename, dtype=SAMPLE_INDEX_DTYPE, mode=mode,
+                     shape=(size//SAMPLE_INDEX_DTYPE.itemsize,))
@@ -0,0 +1,359 @@
+import os
+import collections
+
+import numpy as np
+
+import torch
+
+class TrainingStats:
+    """Records loss terms and their moving averages during training.
+
+    The history is stored in preallocated NumPy arrays that grow by doubling
+    (or wrap around as a ring buffer if ``history_size`` is set). Values pushed
+    as (device) tensors are kept as references and only transferred to the
+    host in bulk when the statistics are accessed or flushed, avoiding a
+    device synchronisation on every training step.
+
+    Arguments
+    ---------
+    loss_terms : list, optional
+        Labels of the recorded terms. (default ``[]``).
+    moving_average_window : int, optional
+        Number of batches over which the moving average is taken.
+        (default 100).
+    dump_to_file_frequency : int, optional
+        Number of batches after which the pending values are synchronised and
+        written to ``stats_filename``. (default 10).
+    stats_filename : str, optional
+        File the statistics get written to. (default None).
+    history_size : int, optional
+        If set, only the last ``history_size`` batches are kept in memory. All
+        batches are still written to ``stats_filename``. (default None).
+    initial_capacity : int, optional
+        Initial size of the history arrays. (default 1024).
+    append : bool, optional
+        Append to an existing ``stats_filename`` instead of overwriting it. Used
+        together with ``load_state_dict`` when resuming training. (default False).
+    reduce : callable, optional
+        Reduction of the pending tensor values across processes, e.g., 
+        ``distributed.all_reduce_mean``. It is called with a single tensor 
+        whenever pending values are synchronised, so all processes need to 
+        push the same values and synchronise at the same points. 
+        (default None).
+    """
+    def __init__(self, loss_terms=[], moving_average_window=100, dump_to_file_frequency=10, stats_filename=None,
+                 history_size=None, initial_capacity=1024, append=False, reduce=None):
+        self.mavg_window = moving_average_window
+        # Number of synchronised batches
+        self._n_synced = 0
+
+        self.dump_to_file_frequency = dump_to_file_frequency
+        self.reduce = reduce
+
+        self.labels = list(loss_terms)
+        self._label_idx = {l : i for i, l in enumerate(self.labels)}
+        n_term = len(self.labels)
+
+        if history_size is not None and history_size < moving_average_window:
+            raise ValueError("history_size needs to be at least as large as moving_average_window.")
+        self.history_size = history_size
+        capacity = history_size if history_size is not None else initial_capacity
+        self._n_sample = np.zeros(capacity, dtype=np.int64)
+        self._all = np.zeros((capacity, n_term))
+        self._mavg = np.zeros((capacity, n_term))
+        # Number of entries in the history arrays
+        self._n_stored = 0
+
+        # Ring buffer with the last mavg_window values, in chronological order
+        # starting at _window_pos.
+        self._window = np.zeros((moving_average_window, n_term))
+        self._window_pos = 0
+
+        # Pushed but not yet synchronised values
+        self._pending = []
+        # Types of the pushed values, used to write them to the stats file
+        self._dtypes = None
+
+        self.stats_filename = stats_filename
+        if self.stats_filename is not None and not (append and os.path.isfile(self.stats_filename)):
+            with open(self.stats_filename, "w") as f:
+                f.write("# Batch nr, sample nr, {}\n".format(", ".join(loss_terms)))
+
+    def __del__(self):
+        if self.stats_filename is not None:
+            self.flush_to_file()
+
+    def push_loss(self, n_sample, *args):
+        """Record the terms of a batch.
+
+        The values in ``args`` can be scalars or tensors, which get flattened.
+        Tensors are not synchronised until the statistics are accessed.
+        """
+        self._pending.append((n_sample, args))
+
+        if len(self._pending) >= self.dump_to_file_frequency:
+            self._sync()
+
+    def flush_to_file(self):
+        self._sync()
+
+    def _sync(self):
+        """Transfer pending values to the host and update the history."""
+        if len(self._pending) == 0:
+            return
+
+        pending = self._pending
+        self._pending = []
+
+        # Move all tensors to the host in one go
+        tensors = [a.detach().reshape(-1) for _, args in pending for a in args if torch.is_tensor(a)]
+        if len(tensors) > 0:
+            device_values = torch.cat([t.to(tensors[0].dtype) for t in tensors])
+            if self.reduce is not None:
+                device_values = self.reduce(device_values)
+            host_values = device_values.cpu().numpy()
+        offset = 0
+
+        if self._dtypes is None:
+            self._dtypes = [self._get_dtype(a) for a in pending[0][1]
+                                               for _ in range(a.numel() if torch.is_tensor(a) else 1)]
+
+        n_sample = np.empty(len(pending), dtype=np.int64)
+        values = np.empty((len(pending), len(self.labels)))
+        for i, (s, args) in enumerate(pending):
+            n_sample[i] = s
+            j = 0
+            for a in args:
+                if torch.is_tensor(a):
+                    n = a.numel()
+                    values[i, j:j+n] = host_values[offset:offset+n]
+                    offset += n
+                    j += n
+                else:
+                    values[i, j] = a
+                    j += 1
+            if j != len(self.labels):
+                raise ValueError(f"Expected {len(self.labels)} values but got {j}.")
+
+        mavg = self._update_moving_average(values)
+
+        first_batch = self.n_batches
+        self._append(n_sample, values, mavg)
+        self._n_synced += len(pending)
+
+        if self.stats_filename is not None:
+            with open(self.stats_filename, "a") as f:
+                for i in range(len(pending)):
+                    f.write(self._format_line(first_batch+i, n_sample[i], values[i]) + "\n")
+
+    def _update_moving_average(self, values):
+        """Compute moving averages for new values using the window ring buffer."""
+        w = self.mavg_window
+        m = min(self.n_batches, w)
+        window = np.roll(self._window, -self._window_pos, axis=0)[w-m:]
+
+        extended = np.concatenate((window, values), axis=0)
+        cumsum = np.zeros((extended.shape[0]+1, extended.shape[1]))
+        np.cumsum(extended, axis=0, out=cumsum[1:])
+
+        end = m + 1 + np.arange(values.shape[0])
+        n_window = np.minimum(self.n_batches + 1 + np.arange(values.shape[0]), w)
+        mavg = (cumsum[end] - cumsum[end-n_window])/n_window[:,None]
+
+        # Update ring buffer
+        new = values[-w:]
+        self._window[(self._window_pos + np.arange(len(new))) % w] = new
+        self._window_pos = (self._window_pos + len(new)) % w
+
+        return mavg
+
+    def _append(self, n_sample, values, mavg):
+        n = len(n_sample)
+        if self.history_size is None:
+            if self._n_stored + n > len(self._n_sample):
+                capacity = max(2*len(self._n_sample), self._n_stored + n)
+                self._n_sample = self._grow(self._n_sample, capacity)
+                self._all = self._grow(self._all, capacity)
+                self._mavg = self._grow(self._mavg, capacity)
+            s = slice(self._n_stored, self._n_stored + n)
+            self._n_sample[s] = n_sample
+            self._all[s] = values
+            self._mavg[s] = mavg
+            self._n_stored += n
+        else:
+            idx = (self.n_batches + np.arange(n)) % self.history_size
+            self._n_sample[idx] = n_sample
+            self._all[idx] = values
+            self._mavg[idx] = mavg
+            self._n_stored = min(self._n_stored + n, self.history_size)
+
+    def state_dict(self):
+        """Returns the state of the recorder, including the size of the stats file."""
+        self._sync()
+        n = len(self._all) if self.history_size is not None else self._n_stored
+        return {"labels"      : list(self.labels),
+                "n_synced"    : self._n_synced,
+                "n_stored"    : self._n_stored,
+                "n_sample"    : self._n_sample[:n].copy(),
+                "all"         : self._all[:n].copy(),
+                "mavg"        : self._mavg[:n].copy(),
+                "window"      : self._window.copy(),
+                "window_pos"  : self._window_pos,
+                "file_offset" : os.path.getsize(self.stats_filename) if self.stats_filename is not None else None,
+               }
+
+    def load_state_dict(self, state):
+        """Restore the state of the recorder.
+
+        Entries that were written to the stats file after the state was saved
+        are removed from the file."""
+        if state["labels"] != self.labels:
+            raise ValueError(f"Labels don't match: {state['labels']} vs {self.labels}.")
+        if state["window"].shape != self._window.shape:
+            raise ValueError("Moving average window doesn't match.")
+
+        self._pending = []
+        self._n_synced = state["n_synced"]
+        self._n_stored = state["n_stored"]
+        self._window = state["window"].copy()
+        self._window_pos = state["window_pos"]
+
+        n = len(state["n_sample"])
+        if self.history_size is not None:
+            if n != self.history_size:
+                raise ValueError("history_size doesn't match.")
+            capacity = n
+        else:
+            capacity = max(len(self._n_sample), n)
+        self._n_sample = self._grow(state["n_sample"], capacity)
+        self._all = self._grow(state["all"], capacity)
+        self._mavg = self._grow(state["mavg"], capacity)
+
+        if self.stats_filename is not None and state["file_offset"] is not None:
+            os.truncate(self.stats_filename, state["file_offset"])
+
+    @staticmethod
+    def _grow(a, capacity):
+        new = np.zeros((capacity, *a.shape[1:]), dtype=a.dtype)
+        new[:len(a)] = a
+        return new
+
+    def _history(self, a):
+        """Returns the stored entries of a history array in chronological order."""
+        if self.history_size is None or self.n_batches <= self.history_size:
+            return a[:self._n_stored]
+        pos = self.n_batches % self.history_size
+        return np.concatenate((a[pos:], a[:pos]))
+
+    @property
+    def n_batches(self):
+        return self._n_synced + len(self._pending)
+
+    @property
+    def n_processed_samples(self):
+        self._sync()
+        return self._history(self._n_sample)
+
+    @property
+    def loss_terms(self):
+        self._sync()
+        all_ = self._history(self._all)
+        mavg = self._history(self._mavg)
+        return collections.OrderedDict((l, {"all" : all_[:,i], "mavg" : mavg[:,i]}) for i, l in enumerate(self.labels))
+
+    def get_last(self, loss_term):
+        """Returns the last value of a loss term, or NaN if nothing has been
+        pushed yet."""
+        self._sync()
+        if self.n_batches == 0:
+            return np.nan
+        return self._all[(self.n_batches-1) % len(self._all), self._label_idx[loss_term]]
+
+    def get_mavg(self, loss_term):
+        """Returns the current moving average of a loss term, or NaN if 
+        nothing has been pushed yet."""
+        self._sync()
+        if self.n_batches == 0:
+            return np.nan
+        return self._mavg[(self.n_batches-1) % len(self._mavg), self._label_idx[loss_term]]
+
+    @staticmethod
+    def _get_dtype(a):
+        if torch.is_tensor(a):
+            try:
+                return torch.empty(0, dtype=a.dtype).numpy().dtype
+            except TypeError:
+                return np.dtype(np.float64)
+        return np.asarray(a).dtype
+
+    def _format_line(self, batch, n_sample, values):
+        # Values are written as the scalars they were pushed as, e.g., 
+        # integers without a decimal point
+        dtypes = self._dtypes or [np.dtype(np.float64)]*len(values)
+        s = f"{batch} {n_sample} "
+        for v, dtype in zip(values, dtypes):
+            s += str(dtype.type(v)) + " "
+        return s
+
+    def get_str(self, idx=-1):
+        self._sync()
+        batch = idx if idx >= 0 else self.n_batches + idx
+        if batch < self.n_batches - self._n_stored or batch >= self.n_batches:
+            raise IndexError(f"Batch {batch} is not in the history.")
+        i = batch % len(self._all) if self.history_size is not None else batch
+        return self._format_line(batch, self._n_sample[i], self._all[i])
+
+    def get_pretty_str(self, n_col=1):
+        self._sync()
+        s = ""
+        max_len_key = max([len(key) for key in self.labels])
+        items_per_row = 0
+        for key in self.labels:
+            s += "{key:<{width}s}: {value:8.3e}     ".format(key=key, width=max_len_key, value=self.get_mavg(key))
+            items_per_row += 1
+            if items_per_row >= n_col:
+                s += "\n"
+                items_per_row = 0
+        return s
+
+    def plot_loss(self, loss_term="ELBO", window_size=200, burn_in=100):
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(1, 2, figsize=(8, 3))
+        fig.subplots_adjust(wspace=0.3)
+
+        n_sample = self.n_processed_samples
+        n = len(n_sample)
+        terms = self.loss_terms
+        total_loss = terms[loss_term]["all"]
+        total_loss_mavg = terms[loss_term]["mavg"]
+
+        x_range = n_sample[max(0, n-window_size):]
+        ax[1].plot(x_range, total_loss[max(0, n-window_size):], alpha=0.5, label="{}".format(loss_term))
+        ax[1].plot(x_range, total_loss_mavg[max(0, n-window_size):], label="{} mavg".format(loss_term))
+        ax[1].legend()
+        ax[1].set_ylim(min(total_loss[max(0, n-window_size):]), max(total_loss[max(0, n-window_size):]))
+        ax[1].set_xlabel("Number of samples")
+        ax[1].set_ylabel(loss_term)
+
+        if n > burn_in:
+            n_sample = n_sample[burn_in:]
+            total_loss = total_loss[burn_in:]
+            total_loss_mavg = total_loss_mavg[burn_in:]
+        if len(total_loss) > 500:
+            step = len(total_loss)//500
+            n_sample = n_sample[::step]
+            total_loss = total_loss[::step]
+            total_loss_mavg = total_loss_mavg[::step]
+
+        ax[0].semilogy(n_sample,
+                       np.abs(total_loss),
+                       alpha=0.5, label="{}".format(loss_term))
+        ax[0].semilogy(n_sample,
+                       np.abs(total_loss_mavg),
+                       label="{} mavg".format(loss_term))
+        ax[0].legend()
+        ax[0].set_xlabel("Number of samples")
+        ax[0].set_ylabel(loss_term)
+
+        return fig, ax
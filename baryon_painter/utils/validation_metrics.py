@@ -0,0 +1,80 @@
+import numpy as np
+
+from baryon_painter.utils import power_spectrum
+
+def get_validation_metric_labels(label_fields, n_k_band=3):
+    """Returns the labels of the metrics of ``compute_validation_metrics``."""
+    labels = []
+    for f in label_fields:
+        labels += [f"{f}_auto_Pk_ratio_k{i}" for i in range(n_k_band)]
+        labels += [f"{f}_cross_Pk_ratio_k{i}" for i in range(n_k_band)]
+        labels += [f"{f}_PDF_KS"]
+    return labels
+
+def ks_distance(a, b):
+    """Kolmogorov-Smirnov distance between the empirical distributions of the
+    values in ``a`` and ``b``."""
+    a = np.sort(a, axis=None)
+    b = np.sort(b, axis=None)
+    x = np.concatenate([a, b])
+    F_a = np.searchsorted(a, x, side="right")/a.size
+    F_b = np.searchsorted(b, x, side="right")/b.size
+    return np.abs(F_a - F_b).max()
+
+def compute_validation_metrics(output_true, output_pred, input, L,
+                               input_transform=None, output_transforms=None,
+                               n_feature_per_field=1,
+                               n_k_band=3, n_pdf_pixel=2**16):
+    """Summary statistics of how well the predicted fields match the truth.
+
+    For each field, the metrics are the fractional deviations of the predicted
+    auto and cross (with the input) power spectra from the true ones in
+    ``n_k_band`` logarithmic k bands between ``2*pi/L`` and the Nyquist
+    frequency, and the Kolmogorov-Smirnov distance between the one-point PDFs
+    of the predicted and true pixels. The power in each band is summed over
+    the batch before taking the ratio. The metrics are computed after applying
+    the transforms, i.e., usually in the units of the simulations.
+
+    Arguments
+    ---------
+    output_true, output_pred : numpy.ndarray
+        True and predicted fields of shape (N, C, H, W).
+    input : numpy.ndarray
+        Input fields of shape (N, C_in, H, W).
+    L : float
+        Physical size of the tiles.
+    input_transform : list, optional
+        Transform of the input for each sample. (default None).
+    output_transforms : list, optional
+        List with the transforms of each output field for each sample.
+        (default None).
+    n_feature_per_field : int, optional
+        Number of features of each field. (default 1).
+    n_k_band : int, optional
+        Number of k bands. (default 3).
+    n_pdf_pixel : int, optional
+        Maximum number of pixels used for the PDF distance. Larger batches are
+        subsampled with a regular stride. (default 65536).
+
+    Returns
+    -------
+    metrics : numpy.ndarray
+        Metrics of all fields, in the order of ``get_validation_metric_labels``.
+    """
+    A_true, A_pred, B = power_spectrum.transform_fields(output_true, output_pred, input,
+                                                        input_transform=input_transform,
+                                                        output_transforms=output_transforms,
+                                                        n_feature_per_field=n_feature_per_field)
+    spectra = power_spectrum.compute_spectra(A_true, A_pred, B[:,None], L, n_k_bin=n_k_band)
+
+    n_field = A_true.shape[1]
+    stride = max(1, A_true[:,0].size//n_pdf_pixel)
+    metrics = []
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i in range(n_field):
+            for mode in ["auto", "cross"]:
+                Pk_true = spectra[mode+"_true"][:,i].sum(axis=0)
+                Pk_pred = spectra[mode+"_pred"][:,i].sum(axis=0)
+                metrics += list(Pk_pred/Pk_true - 1)
+            metrics.append(ks_distance(A_true[:,i].ravel()[::stride], A_pred[:,i].ravel()[::stride]))
+    return np.array(metrics)
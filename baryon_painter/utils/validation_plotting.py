@@ -2,8 +2,7 @@ import numpy as np
 
 import matplotlib.pyplot as plt
 
-import cosmotools.power_spectrum_tools
-import cosmotools.plotting
+from baryon_painter.utils import power_spectrum
 
 pi = np.pi
 
@@ -80,7 +79,11 @@ def plot_power_spectra(output_true, output_pred, input, L,
                        output_transforms=None,
                        n_k_bin=20, logspaced_k_bins=True,
                        plot_mean_deviation=True,
-                       n_feature_per_field=1):
+                       n_feature_per_field=1,
+                       spectra=None):
+    if mode.lower() not in ["auto", "cross"]:
+        raise ValueError("Invalid mode: {}.".format(mode))
+
     n_row = 2
     n_col = output_true.shape[1]//n_feature_per_field
         
@@ -90,42 +93,23 @@ def plot_power_spectra(output_true, output_pred, input, L,
         
     fig.subplots_adjust(left=0.2, bottom=0.15, hspace=0, wspace=0.3)
     
-    k_min = 2*pi/L
-    k_max = 2*pi/L*output_true.shape[-1]/2
-    
-    Pk_deviation = np.zeros((output_true.shape[0], n_col, n_k_bin))
+    # The spectra for all modes can be computed once and passed in
+    if spectra is None:
+        spectra = power_spectrum.compute_spectra(output_true, output_pred, input, L,
+                                                 input_transform=input_transform,
+                                                 output_transforms=output_transforms,
+                                                 n_k_bin=n_k_bin, logspaced_k_bins=logspaced_k_bins,
+                                                 n_feature_per_field=n_feature_per_field)
+    k = spectra["k"]
+    Pk_true = spectra[mode.lower()+"_true"]
+    Pk_pred = spectra[mode.lower()+"_pred"]
+    Pk_deviation = Pk_pred/Pk_true-1
         
     for i in range(n_col):
-        for j in range(output_true.shape[0]):
-            if output_transforms is None:
-                out_transform = lambda x: x
-            else:
-                out_transform = output_transforms[j][i]
-            if input_transform is None:
-                in_transform = lambda x: x
-            else:
-                in_transform = input_transform[j]
-
-            A_true = out_transform(output_true[j,i*n_feature_per_field:(i+1)*n_feature_per_field]).squeeze()
-            A_pred = out_transform(output_pred[j,i*n_feature_per_field:(i+1)*n_feature_per_field]).squeeze()
-            if mode.lower() == "auto":
-                B_true = A_true
-                B_pred = A_pred
-            elif mode.lower() == "cross":
-                B_true = in_transform(input[j,:n_feature_per_field]).squeeze()
-                B_pred = in_transform(input[j,:n_feature_per_field]).squeeze()
-            else:
-                raise ValueError("Invalid mode: {}.".format(mode))
-                
-            Pk_true, k, Pk_var_true, n_mode = cosmotools.power_spectrum_tools.pseudo_Pofk(A_true, B_true, L, k_min=k_min, k_max=k_max, n_k_bin=n_k_bin, logspaced_k_bins=logspaced_k_bins)
-            Pk_pred, k, Pk_var_pred, n_mode = cosmotools.power_spectrum_tools.pseudo_Pofk(A_pred, B_pred, L, k_min=k_min, k_max=k_max, n_k_bin=n_k_bin, logspaced_k_bins=logspaced_k_bins)
-            
-            Pk_deviation[j,i] = Pk_pred/Pk_true-1
-            
-            ax[0,i].loglog(k, k**2 * Pk_true, alpha=0.2, c="C0", label="")
-            ax[0,i].loglog(k, k**2 * Pk_pred, alpha=0.2, c="C1", label="")
-            
-            ax[1,i].semilogx(k, Pk_pred/Pk_true-1, alpha=0.2, c="C0", label="")
+        ax[0,i].loglog(k, (k**2 * Pk_true[:,i]).T, alpha=0.2, c="C0", label="")
+        ax[0,i].loglog(k, (k**2 * Pk_pred[:,i]).T, alpha=0.2, c="C1", label="")
+        
+        ax[1,i].semilogx(k, Pk_deviation[:,i].T, alpha=0.2, c="C0", label="")
             
         if plot_mean_deviation:
             ax[1,i].semilogx(k, Pk_deviation.mean(axis=0)[i], alpha=1.0, linewidth=2, c="C0", label="")
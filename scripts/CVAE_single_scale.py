@@ -9,7 +9,7 @@ import argparse
 import matplotlib
 matplotlib.use('Agg')
     
-from baryon_painter.utils import datasets, data_transforms
+from baryon_painter.utils import datasets, data_transforms, distributed
 import baryon_painter.painter
 from baryon_painter.models import cvae
 
@@ -22,6 +22,11 @@ if __name__ == "__main__":
     output_path = "../output/"
     compute_device = "cuda:0"
 
+    if "WORLD_SIZE" in os.environ:
+        # Launched with torchrun: data-parallel training on the CPUs of all nodes
+        distributed.init_distributed(backend="gloo")
+        compute_device = "cpu"
+
     n_training_stack = 11
     n_validation_stack = 3
     
@@ -168,11 +173,13 @@ if __name__ == "__main__":
     
     run_name = "single_scale_max_z2_res4_late_prelu_log_shift_softmax_lr1e-3_slow_decay"
     output_path = os.path.join(output_path, run_name)
-    os.makedirs(output_path)
-    with open(os.path.join(output_path, "architecture.txt"), "w") as f:
-        f.write(repr(painter.model.architecture))
-    with open(os.path.join(output_path, "architecture_built.txt"), "w") as f:
-        f.write(repr(painter.model))
+    # Allow the job to be requeued and resume from the latest checkpoint
+    os.makedirs(output_path, exist_ok=True)
+    if distributed.is_main_process():
+        with open(os.path.join(output_path, "architecture.txt"), "w") as f:
+            f.write(repr(painter.model.architecture))
+        with open(os.path.join(output_path, "architecture_built.txt"), "w") as f:
+            f.write(repr(painter.model))
         
     painter.train(n_epoch=1, n_pepoch=109, learning_rate=1e-3, batch_size=4,
                   adaptive_learning_rate=adaptive_lr, 
@@ -189,5 +196,6 @@ if __name__ == "__main__":
                   plot_power_spectra=["auto", "cross"],
                   plot_histogram=["log"],
                   output_path=output_path,
+                  resume_from="latest",
                   verbose=True)
 
@@ -1,17 +1,22 @@
 import os
 import glob
 import argparse
+import functools
 
 import numpy as np
 import pyccl as ccl
 
 import baryon_painter.process_SLICS
+import baryon_painter.painter_pool
+from baryon_painter.utils import profiling
 
 pi = np.pi
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--model-type", default="CVAE")
+    parser.add_argument("--model-type", default="CVAE",
+                        help="CVAE, CGAN, or a comma-separated list, e.g., CVAE,CGAN, to paint with several models "
+                             "in one pass. With several models, the output files get the model type as suffix.")
     parser.add_argument("--CVAE-path")
 
     parser.add_argument("--CGAN-module-path")
@@ -23,37 +28,81 @@ if __name__ == "__main__":
 
     parser.add_argument("--n-plane", default=15)
     parser.add_argument("--tile-overlap", default=0.2)
+    parser.add_argument("--n-realisation", default=1, 
+                        help="Number of realisations painted in one pass. With more than one, "
+                             "the y-maps of all realisations are saved, together with their mean and variance.")
+
+    parser.add_argument("--seed", default=None, 
+                        help="Seed of the latent noise. Makes the painted planes reproducible.")
+
+    parser.add_argument("--n-workers", 
+                        help="Number of painter worker processes. If not set, the tiles are painted in this process.")
+    parser.add_argument("--threads-per-worker", default=1,
+                        help="Number of intra-op threads of each painter worker.")
+    parser.add_argument("--pin-cores", action="store_true",
+                        help="Pin each painter worker to its own cores.")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Measure the throughput of the possible worker layouts on this node and use the fastest.")
+    parser.add_argument("--memory-budget", 
+                        help="Memory budget for the painted planes in GB. Accumulates the planes in float32 and "
+                             "spills planes that exceed the budget to memory-mapped files.")
+    parser.add_argument("--spill-path", 
+                        help="Directory for the planes that exceed the memory budget. Defaults to the temporary directory.")
+    parser.add_argument("--resample-plane", action="store_true",
+                        help="Zoom each delta plane once to the pixel scale of the painter and cut the tiles from it, "
+                             "instead of zooming every tile.")
 
     parser.add_argument("--output-resolution", default=7745//5)
+    parser.add_argument("--y-map-field", default="pressure",
+                        help="Field used for the y-maps if the painter paints several fields.")
 
     parser.add_argument("--drop-planes")
     parser.add_argument("--output-file", required=True)
     parser.add_argument("--output-file-planes")
+    parser.add_argument("--timing-report", 
+                        help="JSON file for the time spent in each stage, for each plane.")
 
     args = parser.parse_args()
 
-    if args.model_type == "CVAE":
-        print("Using CVAE.")
-        import baryon_painter.painter
-        cvae_base_path = args.CVAE_path
-        painter = baryon_painter.painter.CVAEPainter((os.path.join(cvae_base_path, "model_state"),
-                                                      os.path.join(cvae_base_path, "model_meta")))
-    elif args.model_type == "CGAN":
-        print("Using GAN")
-        gan_module_path = args.CGAN_module_path
-
-        import sys
-        sys.path.append(gan_module_path)
-        from src.tools.template import GAN_Painter
-
-        parts_folder = args.CGAN_parts_path
-        checkpoint = args.CGAN_checkpoint
-
-        painter = GAN_Painter(parts_folder, 
-                              checkpoint_file=checkpoint,
-                              device="cpu")
-    else:
-        parser.error("Only CVAE and CGAN are supported for --model-type.")
+    def get_painter(model_type):
+        if model_type == "CVAE":
+            print("Using CVAE.")
+            import baryon_painter.painter
+            cvae_base_path = args.CVAE_path
+            painter_factory = functools.partial(baryon_painter.painter.CVAEPainter,
+                                                (os.path.join(cvae_base_path, "model_state"),
+                                                 os.path.join(cvae_base_path, "model_meta")))
+        elif model_type == "CGAN":
+            print("Using GAN")
+            gan_module_path = args.CGAN_module_path
+
+            import sys
+            sys.path.append(gan_module_path)
+            from src.tools.template import GAN_Painter
+
+            parts_folder = args.CGAN_parts_path
+            checkpoint = args.CGAN_checkpoint
+
+            painter_factory = functools.partial(GAN_Painter, parts_folder, 
+                                                checkpoint_file=checkpoint,
+                                                device="cpu")
+        else:
+            parser.error("Only CVAE and CGAN are supported for --model-type.")
+
+        if args.autotune:
+            layout, _ = baryon_painter.painter_pool.autotune(painter_factory, pin_cores=args.pin_cores)
+            print(f"Using {layout['n_worker']} painter workers with {layout['n_thread_per_worker']} threads each.")
+            return baryon_painter.painter_pool.PainterPool(painter_factory, **layout)
+        elif args.n_workers is not None:
+            return baryon_painter.painter_pool.PainterPool(painter_factory, n_worker=int(args.n_workers),
+                                                           n_thread_per_worker=int(args.threads_per_worker),
+                                                           pin_cores=args.pin_cores)
+        else:
+            return painter_factory()
+
+    # Several models share the reading and tiling of the planes
+    model_types = args.model_type.split(",")
+    painters = [get_painter(model_type) for model_type in model_types]
 
 
     SLICS_base_path = args.SLICS_base_path
@@ -103,8 +152,13 @@ if __name__ == "__main__":
     print(f"Painting {n_z} out of {len(z_SLICS)} planes.")
     print(f"Using an overlap of {tile_overlap}.")
 
+    n_realisation = int(args.n_realisation)
+    if n_realisation > 1:
+        print(f"Painting {n_realisation} realisations.")
+
+    timer = profiling.StageTimer()
     painted_planes = baryon_painter.process_SLICS.process_SLICS(
-                                   painter, 
+                                   painters, 
                                    tile_size=100.0, n_pixel_tile=512,
                                    LOS=LOS, 
                                    z_SLICS=z_SLICS[:n_z], delta_size=d_A_SLICS[:n_z]*10/180*pi, 
@@ -114,23 +168,62 @@ if __name__ == "__main__":
                                    z_slice=z_slice[:n_z],
                                    min_tiling_overlap=tile_overlap,
                                    regularise=False,
-                                   regularise_std=None
+                                   regularise_std=None,
+                                   n_realisation=n_realisation,
+                                   seed=int(args.seed) if args.seed is not None else None,
+                                   resample_plane=args.resample_plane,
+                                   memory_budget=int(float(args.memory_budget)*1024**3) if args.memory_budget is not None else None,
+                                   spill_path=args.spill_path,
+                                   timer=timer,
                                 )
+    for painter in painters:
+        if isinstance(painter, baryon_painter.painter_pool.PainterPool):
+            painter.close()
 
     output_resolution = int(args.output_resolution)
-    y_map = baryon_painter.process_SLICS.create_y_map(painted_planes, z_SLICS[:n_z], 
-                              resolution=output_resolution, map_size=10.0, cosmo=cosmo_SLICS, order=5)
 
-    np.save(output_file, y_map)
-    if args.drop_planes is not None:
-        y_map = baryon_painter.process_SLICS.create_y_map(painted_planes[n_drop:], z_SLICS[n_drop:n_z], 
-                              resolution=output_resolution, map_size=10.0, cosmo=cosmo_SLICS, order=5)
-        np.save(output_file_drop, y_map)
-        
-    if args.output_file_planes is not None:
-        import pickle
-        with open(args.output_file_planes, "wb") as f:
-            pickle.dump(painted_planes, f)
+    def create_y_maps(planes, z, filename):
+        if n_realisation == 1:
+            y_map = baryon_painter.process_SLICS.create_y_map(planes, z, 
+                                      resolution=output_resolution, map_size=10.0, cosmo=cosmo_SLICS, order=5,
+                                      timer=timer)
+            np.save(filename, y_map)
+        else:
+            y_maps = []
+            moments = baryon_painter.process_SLICS.RunningMoments()
+            for r in range(n_realisation):
+                y_map = baryon_painter.process_SLICS.create_y_map([p[r] for p in planes], z, 
+                                          resolution=output_resolution, map_size=10.0, cosmo=cosmo_SLICS, order=5,
+                                          timer=timer)
+                moments.push(y_map)
+                y_maps.append(y_map)
+            np.save(filename, np.stack(y_maps))
+            np.save(filename + "_mean", moments.mean)
+            np.save(filename + "_var", moments.var)
+
+    for model_type, painter, planes in zip(model_types, painters, painted_planes):
+        suffix = f"_{model_type}" if len(model_types) > 1 else ""
+
+        # Painters with several label fields paint all of them in one pass
+        label_fields = getattr(painter, "label_fields", None) or []
+        if len(label_fields) > 1:
+            print(f"Painted fields {label_fields}, using {args.y_map_field} for the y-maps.")
+            field_idx = label_fields.index(args.y_map_field)
+            y_planes = [p[..., field_idx, :, :] for p in planes]
+        else:
+            y_planes = planes
+
+        create_y_maps(y_planes, z_SLICS[:n_z], output_file + suffix)
+        if args.drop_planes is not None:
+            create_y_maps(y_planes[n_drop:], z_SLICS[n_drop:n_z], output_file_drop + suffix)
+            
+        if args.output_file_planes is not None:
+            import pickle
+            with open(args.output_file_planes + suffix, "wb") as f:
+                pickle.dump(planes, f)
+
+    if args.timing_report is not None:
+        timer.write_report(args.timing_report, LOS=LOS, model_type=args.model_type, n_plane=n_z)
 
     
     
@@ -0,0 +1,56 @@
+"""Small data sets, architectures, training runs, and painters shared by the
+tests."""
+
+import numpy as np
+
+from baryon_painter.utils import mock_data
+from baryon_painter.utils.datasets import BAHAMASDataset
+from baryon_painter.models import cvae
+
+def create_dataset(n_grid=32, n_stack=2):
+    rng = np.random.default_rng(42)
+    data = {}
+    for field in ["dm", "pressure"]:
+        data[field] = {0.0 : {}}
+        for s in ["100", "150"]:
+            data[field][0.0][s] = rng.lognormal(size=(n_stack, n_grid, n_grid)).astype(np.float32)
+            data[field][0.0]["mean_"+s] = data[field][0.0][s].mean()
+            data[field][0.0]["var_"+s] = data[field][0.0][s].var()
+    return BAHAMASDataset(data=data, n_tile=2,
+                          transform=lambda x, field, z, stats: np.log(x[None]/stats[field][z]["mean"]+1e-3),
+                          scale_to_SLICS=False)
+
+def create_architecture(tile_size=16):
+    dim_z = (1, tile_size//4, tile_size//4)
+    return {"type" :        "Type-1",
+            "dim_x" :       (1, tile_size, tile_size),
+            "dim_y" :       (1, tile_size, tile_size),
+            "dim_z" :       dim_z,
+            "n_x_features": 1,
+            "aux_label" :   True,
+            "q_x_in" :      cvae.conv_down(in_channel=1, channels=[4], scales=[4]),
+            "q_y_in" :      cvae.conv_down(in_channel=2, channels=[4], scales=[4]),
+            "q_x_y_out" :   cvae.conv_block(8, 2*dim_z[0], kernel=3) + [("unflatten", (2, *dim_z)),],
+            "p_y_in" :      None,
+            "p_z_in" :      cvae.conv_up(1, channels=[1], scales=[4]),
+            "p_y_z_in" :    cvae.conv_block(3, 4, kernel=3),
+            "p_y_z_out" :   (cvae.conv_block(4, 1, kernel=3, batchnorm=False, activation=None),),
+           }
+
+def train(painter, output_path, resume_from=None):
+    return painter.train(n_epoch=2, batch_size=3, learning_rate=1e-3,
+                         adaptive_batch_size=lambda pepoch: 2 if pepoch < 2 else 5,
+                         adaptive_learning_rate=lambda pepoch: 0.5**pepoch,
+                         pepoch_size=20,
+                         validation_pepochs=[],
+                         validation_loss_frequency=30, validation_loss_batch_size=2,
+                         checkpoint_frequency=25, statistics_report_frequency=0,
+                         loss_plot_frequency=0, show_plots=False,
+                         plot_power_spectra=None, plot_histogram=None,
+                         output_path=output_path, verbose=False,
+                         shuffle_seed=1234, resume_from=resume_from)
+
+def create_painter(path):
+    # Painter with random weights and the small architecture, set up like a 
+    # trained one
+    return mock_data.create_mock_painter(str(path), tile_size=16, architecture=create_architecture())
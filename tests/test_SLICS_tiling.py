@@ -1,6 +1,6 @@
 import numpy as np
 
-from baryon_painter.process_SLICS import get_tile, generate_tiling, make_weight_map
+from baryon_painter.process_SLICS import get_tile, generate_tiling, make_weight_map, RunningMoments, TileBlender
 pi = np.pi
 
 def check_get_tile():
@@ -91,5 +91,58 @@ def test_generate_tiling(plot=False):
         fig, ax = plt.subplots(1, 1)
         ax.imshow(w)
 
+def test_running_moments():
+    rng = np.random.default_rng(3)
+    x = rng.normal(size=(7, 5, 5))
+    
+    moments = RunningMoments()
+    moments.push(x[0])
+    moments.push(x[1:4], stack=True)
+    for m in x[4:]:
+        moments.push(m)
+        
+    assert moments.n == 7
+    assert np.allclose(moments.mean, x.mean(axis=0))
+    assert np.allclose(moments.var, x.var(axis=0, ddof=1))
+
+def test_tile_blender():
+    rng = np.random.default_rng(4)
+    n_pixel_plane, n_pixel_tile, n_realisation = 300, 64, 2
+    origins, tile_slices = generate_tiling(n_pixel_plane, n_pixel_tile, min_tile_overlap=0.5)
+    n = len(origins)
+    tiles = rng.lognormal(size=(n, n, n_realisation, n_pixel_tile, n_pixel_tile))
+    masks = rng.uniform(size=tiles.shape) < 0.1
+
+    # Weight map of the tile-by-tile blending
+    w_ref = np.ones((n_pixel_tile, n_pixel_tile))
+    falloff_pixel = int(n_pixel_tile*0.05)
+    for i in range(falloff_pixel):
+        f = np.exp(-0.5*(falloff_pixel-i)**2/(falloff_pixel*0.5)**2)
+        w_ref[i] *= f
+        w_ref[-i-1] *= f
+        w_ref[:,i] *= f
+        w_ref[:,-i-1] *= f
+    assert np.array_equal(make_weight_map((n_pixel_tile, n_pixel_tile), falloff=0.05, sigma=0.5), w_ref)
+
+    for masked in [False, True]:
+        plane_ref = np.zeros((n_realisation, n_pixel_plane, n_pixel_plane))
+        weight_ref = np.zeros((n_realisation, n_pixel_plane, n_pixel_plane))
+        for j in range(n):
+            for k in range(n):
+                w = np.where(masks[j,k], 0.0, w_ref) if masked else w_ref
+                plane_ref[(slice(None), *tile_slices[j][k])] += w*tiles[j,k]
+                weight_ref[(slice(None), *tile_slices[j][k])] += w
+        with np.errstate(invalid="ignore"):
+            plane_ref /= weight_ref
+        
+        for n_thread in [1, 3]:
+            blender = TileBlender(n_pixel_plane, n_pixel_tile, [tile_slices[j][0][0].start for j in range(n)],
+                                  n_realisation=n_realisation, masked=masked, n_thread=n_thread)
+            for j in range(n):
+                blender.add(tiles[j], [(j, k) for k in range(n)], masks=masks[j] if masked else None)
+            plane = blender.get_plane()
+            np.testing.assert_allclose(plane, plane_ref, rtol=1e-12)
+            assert np.array_equal(np.isnan(plane), np.isnan(plane_ref))
+
 if __name__ == "__main__":
-    check_get_tile()
\ No newline at end of file
+    check_get_tile()
@@ -0,0 +1,31 @@
+import json
+
+import numpy as np
+
+from baryon_painter.utils.datasets import BAHAMASDataset
+from baryon_painter.utils.mock_data import write_mock_BAHAMAS_stacks
+from baryon_painter.benchmarks import run_benchmarks
+
+def test_mock_BAHAMAS_stacks(tmp_path):
+    files_info = write_mock_BAHAMAS_stacks(str(tmp_path), redshifts=[0.0, 0.5], n_stack=2, n_grid=32)
+    dataset = BAHAMASDataset(files=files_info, root_path=str(tmp_path), n_tile=2)
+
+    assert dataset.fields == ["dm", "pressure"]
+    assert dataset.redshifts == [0.0, 0.5]
+    assert dataset.tile_size == 16
+    stack = np.load(tmp_path / files_info[0]["file_100"])
+    assert stack.shape == (2, 32, 32)
+    assert np.isclose(stack.mean(), files_info[0]["mean_100"], rtol=1e-5)
+
+    d, _, _ = dataset[len(dataset)-1]
+    assert d[0].shape == (16, 16)
+
+def test_benchmarks(tmp_path):
+    results = run_benchmarks(str(tmp_path), n_grid=64, n_tile=1, batch_size=2, width=0.25, 
+                             repeat=1, verbose=False)
+    results = json.loads(json.dumps(results))
+
+    for name in ["dataset.getitem", "dataset.get_batch", "transform.range_compress.log",
+                 "transform.split_scale", "cvae.train_step", "painter.paint"]:
+        assert results["benchmarks"][name]["min"] > 0
+    assert results["parameters"]["tile_size"] == 64
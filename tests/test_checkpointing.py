@@ -0,0 +1,28 @@
+import os
+import pickle
+
+import torch
+
+from baryon_painter.utils.checkpointing import CheckpointWriter, snapshot
+
+def test_snapshot():
+    """Tests that snapshots don't change when the original state is updated."""
+    model = torch.nn.Linear(3, 2)
+    state = {"model" : model.state_dict(), "step" : [1, 2]}
+    s = snapshot(state)
+    with torch.no_grad():
+        model.weight += 1
+    assert not torch.allclose(s["model"]["weight"], model.weight)
+    assert s["step"] == [1, 2]
+
+def test_retention_policy(tmp_path):
+    """Tests that only the last N plus every M-th checkpoint are kept."""
+    with CheckpointWriter(keep_last=2, keep_every=3) as writer:
+        for i in range(10):
+            writer.submit([(str(tmp_path / f"checkpoint_{i}"), {"i" : i}, pickle.dump)])
+        writer.submit([(str(tmp_path / "final"), {"i" : -1}, pickle.dump)], protect=True)
+
+    files = sorted(os.listdir(tmp_path))
+    assert files == ["checkpoint_2", "checkpoint_5", "checkpoint_8", "checkpoint_9", "final"]
+    with open(tmp_path / "checkpoint_9", "rb") as f:
+        assert pickle.load(f) == {"i" : 9}
@@ -0,0 +1,117 @@
+import math
+
+import pytest
+import torch
+
+from baryon_painter.models import cvae
+
+from helpers import create_architecture
+
+def test_multi_sample_ELBO():
+    """Compare the likelihood terms to an implementation with repeated copies."""
+    torch.manual_seed(2)
+    L = 3
+    architecture = create_architecture()
+    architecture["L"] = L
+    architecture["p_y_z_out"] = (cvae.conv_block(4, 1, kernel=3, batchnorm=False, activation=None),
+                                 cvae.conv_block(4, 1, kernel=3, batchnorm=False, activation=None))
+
+    x = torch.randn(5, 1, 16, 16)
+    y = torch.randn(5, 1, 16, 16)
+    aux_label = torch.rand(5)
+    M = x.size(0)
+
+    for fast_path, alpha_var in [(False, 0.0), (False, 0.3), (False, 1.0), (True, 0.3)]:
+        architecture["aux_label_fast_path"] = fast_path
+        torch.manual_seed(2)
+        model = cvae.CVAE(architecture)
+        model.train(False)
+        # The fast path sums the aux label response in a different order than
+        # the convolution over the merged feature maps, so it only agrees up
+        # to float32 rounding
+        tol = {"atol" : 1e-6, "rtol" : 1e-5} if fast_path else {}
+
+        model.alpha_var = alpha_var
+        torch.manual_seed(3)
+        ELBO = model(x, y, aux_label)
+
+        # Same z as in the forward pass
+        torch.manual_seed(3)
+        z = model.Q(x, y, aux_label)
+        h_y = model.p_y_in(cvae.merge_aux_label(y, aux_label))
+        h = model.p_y_z_in(torch.cat([model.p_z_in(z), h_y.repeat(L, 1, 1, 1)], dim=1))
+        x_mu = model.p_mu_out(h)
+        log_x_var = model.p_var_out(h)
+        x_rep = x.repeat(L, 1, 1, 1)
+        fixed = -0.5*math.log(2*math.pi) + (-0.5*(x_rep - x_mu)**2).sum(dim=[3,2,0])/(M*L)
+        free = -0.5*math.log(2*math.pi) + (-0.5*log_x_var - 0.5*(x_rep - x_mu)**2/torch.exp(log_x_var)).sum(dim=[3,2,0])/(M*L)
+
+        # Terms with zero weight are only computed when accessed
+        if alpha_var == 0.0:
+            assert model._log_likelihood_free_var is None
+        if alpha_var == 1.0:
+            assert model._log_likelihood_fixed_var is None
+
+        assert torch.allclose(model.x_mu, x_mu, **tol)
+        assert torch.allclose(model.x_var, torch.exp(log_x_var), **tol)
+        assert torch.allclose(model.log_likelihood, (1-alpha_var)*fixed + alpha_var*free, **tol)
+        stats = model.get_stats(as_tensor=True)
+        assert torch.allclose(stats[2:], torch.cat([(1-alpha_var)*fixed + alpha_var*free, fixed, free]), **tol)
+
+def test_merge_aux_label():
+    y = torch.randn(6, 1, 4, 4)
+    aux_label = torch.rand(3)
+    with pytest.raises(ValueError):
+        cvae.merge_aux_label(y, aux_label)
+
+    merged = cvae.merge_aux_label(y, aux_label, repeat=2)
+    assert merged.shape == (6, 2, 4, 4)
+    assert torch.equal(merged[:,0], y[:,0])
+    assert torch.equal(merged[:,1,0,0], aux_label.repeat(2))
+
+def test_aux_label_fast_path():
+    """Compare the fast path to merging the aux labels as feature maps."""
+    dim_z = (1, 4, 4)
+    architecture = create_architecture()
+    architecture["L"] = 2
+    architecture["prior_z_y"] =   cvae.conv_down(in_channel=2, channels=[4], scales=[2]) \
+                                + cvae.conv_down(in_channel=4, channels=[2], scales=[2], batchnorm=False, activation=None) \
+                                + [("unflatten", (2, *dim_z)),]
+    architecture["p_y_z_in"] = cvae.conv_block(3, 4, kernel=5, bias=True)
+
+    x = torch.randn(3, 1, 16, 16)
+    y = torch.randn(3, 1, 16, 16)
+    aux_label = torch.rand(3)
+
+    ELBO = {}
+    grads = {}
+    for fast_path in [True, False]:
+        torch.manual_seed(4)
+        architecture["aux_label_fast_path"] = fast_path
+        model = cvae.CVAE(architecture)
+        ELBO[fast_path] = model(x, y, aux_label)
+        ELBO[fast_path].backward()
+        grads[fast_path] = [p.grad for p in model.parameters()]
+
+    assert torch.allclose(ELBO[True], ELBO[False], rtol=1e-5)
+    for g_fast, g_slow in zip(grads[True], grads[False]):
+        assert torch.allclose(g_fast, g_slow, rtol=1e-4, atol=1e-5)
+
+def test_sample_P_multiple_realisations():
+    model = cvae.CVAE(create_architecture())
+    model.train(False)
+
+    y = torch.randn(2, 1, 16, 16)
+    aux_label = torch.rand(2)
+    n_sample = 4
+    z = torch.randn(n_sample*2, *model.dim_z)
+
+    x = model.sample_P(y, aux_label=aux_label, z=z, n_sample=n_sample)
+    assert x.shape == (n_sample, 2, 1, 16, 16)
+    # Same as painting each realisation separately
+    for i in range(n_sample):
+        assert torch.allclose(x[i], model.sample_P(y, aux_label=aux_label, z=z[i*2:(i+1)*2]), atol=1e-6)
+
+    x = model.sample_P(y, aux_label=aux_label, n_sample=n_sample)
+    assert x.shape == (n_sample, 2, 1, 16, 16)
+    assert not torch.allclose(x[0], x[1])
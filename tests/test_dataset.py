@@ -87,3 +87,48 @@ def test_transforms():
     # assert np.allclose(inv_transform[0](d[0]), dataset.get_input_sample(sample_idx, transform=False), equal_nan=True)
     # for i, field in enumerate(dataset.label_fields):
     #     assert np.allclose(inv_transform[i+1](d[i+1]), dataset.get_label_sample(sample_idx, transform=False)[i], equal_nan=True)
+
+def test_batch_augmentation():
+    from baryon_painter.utils.datasets import apply_symmetries
+    from helpers import create_dataset
+
+    # The eight symmetries of an asymmetric tile are distinct
+    x = np.arange(16.0).reshape(1, 1, 4, 4)
+    tiles = np.concatenate([apply_symmetries(x, np.array([s])) for s in range(8)])
+    assert len(np.unique(tiles.reshape(8, -1), axis=0)) == 8
+    np.testing.assert_array_equal(tiles[1, 0], np.rot90(x[0, 0]))
+    np.testing.assert_array_equal(tiles[5, 0], np.rot90(x[0, 0])[:, ::-1])
+    # Batches are transformed per sample
+    batch = np.random.default_rng(0).normal(size=(6, 2, 4, 4))
+    symmetries = np.array([0, 3, 5, 3, 7, 1])
+    np.testing.assert_array_equal(apply_symmetries(batch, symmetries),
+                                  np.concatenate([apply_symmetries(b[None], s[None]) for b, s in zip(batch, symmetries)]))
+
+    dataset = create_dataset()
+    idx = np.array([0, 5, 7, 12])
+    # Without augmentation, batches are the stacked samples
+    fields, idx_batch, z = dataset[idx]
+    assert len(fields) == 2 and fields[0].shape == (4, 1, 16, 16)
+    for j, i in enumerate(idx):
+        d, _, _ = dataset[int(i)]
+        np.testing.assert_array_equal(fields[0][j], d[0])
+        np.testing.assert_array_equal(fields[1][j], d[1])
+
+    dataset.augment = True
+    augmented, _, _ = dataset[idx]
+    np.testing.assert_array_equal(augmented[0], dataset[idx][0][0])
+    offsets, symmetries = dataset.get_augmentations(idx)
+    assert offsets.shape == (4, 4) and np.all(offsets < dataset.tile_size)
+    for j, i in enumerate(idx):
+        # Crops at an offset wrap around the periodic stacks
+        s_100, tile_100_x, tile_100_y, s_150, tile_150_x, tile_150_y = np.unravel_index(i, (2, 2, 2, 2, 2, 2))
+        roll = lambda d, t_x, t_y, o_x, o_y: np.roll(d, (-t_x*16-o_x, -t_y*16-o_y), axis=(0, 1))[:16, :16]
+        stack = dataset.data["pressure"][0.0]
+        d = roll(stack["100"][s_100], tile_100_x, tile_100_y, *offsets[j, :2]) \
+            + roll(stack["150"][s_150], tile_150_x, tile_150_y, *offsets[j, 2:])
+        np.testing.assert_allclose(augmented[1][j], apply_symmetries(dataset.transform(d, "pressure", 0.0)[None],
+                                                                     symmetries[j:j+1])[0], rtol=1e-6)
+
+    # Augmentations change with the epoch
+    dataset.set_epoch(1)
+    assert not np.array_equal(dataset[idx][0][0], augmented[0])
@@ -0,0 +1,73 @@
+import os
+import socket
+
+import numpy as np
+
+import torch
+
+from baryon_painter.utils import datasets, distributed
+from baryon_painter.utils.sample_index_log import load_sample_index_log
+from baryon_painter.painter import CVAEPainter
+
+from helpers import create_dataset, create_architecture
+
+def test_sharded_sampler():
+    n_sample = 11
+    world_size = 3
+    for start in [0, 6]:
+        shards = [list(datasets.ShuffledSampler(n_sample, seed=1, start=start, rank=r, world_size=world_size))
+                  for r in range(world_size)]
+        # All ranks process the same number of samples
+        assert all(len(shard) == len(shards[0]) for shard in shards)
+        assert len(shards[0]) == len(datasets.ShuffledSampler(n_sample, seed=1, start=start, rank=0, world_size=world_size))
+
+        # The shards interleave to the (padded) single-process permutation
+        permutation = list(datasets.ShuffledSampler(n_sample, seed=1, start=0))
+        interleaved = [i for samples in zip(*shards) for i in samples]
+        assert interleaved == (permutation + permutation)[start:12]
+
+    shards = [set(datasets.ShuffledSampler(12, seed=1, rank=r, world_size=world_size)) for r in range(world_size)]
+    assert set.union(*shards) == set(range(12))
+    assert sum(len(s) for s in shards) == 12
+
+def train_worker(rank, world_size, output_path):
+    dataset = create_dataset()
+    painter = CVAEPainter(training_data_set=dataset, test_data_set=dataset,
+                          architecture=create_architecture())
+    painter.train(n_epoch=1, batch_size=2, learning_rate=1e-3,
+                  pepoch_size=8,
+                  validation_pepochs=[],
+                  validation_loss_frequency=8, validation_loss_batch_size=2,
+                  checkpoint_frequency=4, statistics_report_frequency=0,
+                  loss_plot_frequency=0, show_plots=False,
+                  plot_power_spectra=None, plot_histogram=None,
+                  output_path=output_path, verbose=False)
+    torch.save(painter.model.state_dict(), os.path.join(output_path, f"model_rank{rank}"))
+
+def test_distributed_training(tmp_path):
+    output_path = str(tmp_path)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    distributed.launch(train_worker, world_size=2, args=(output_path,), master_port=port, seed=1)
+
+    # Gradients are averaged, so all ranks end up with the same model
+    state_0 = torch.load(os.path.join(output_path, "model_rank0"))
+    state_1 = torch.load(os.path.join(output_path, "model_rank1"))
+    for k in state_0:
+        assert torch.equal(state_0[k], state_1[k])
+
+    # Each rank processed a disjoint half of the samples
+    n_sample = len(create_dataset())
+    idx_0 = load_sample_index_log(os.path.join(output_path, "training_sample_indicies_rank0.bin"))
+    idx_1 = load_sample_index_log(os.path.join(output_path, "training_sample_indicies_rank1.bin"))
+    assert len(idx_0) == len(idx_1) == n_sample//2
+    assert set(idx_0["sample_idx"]).isdisjoint(idx_1["sample_idx"])
+
+    # Only rank 0 writes statistics and checkpoints, counting the samples of all ranks
+    stats = np.loadtxt(os.path.join(output_path, "training_stats.txt"))
+    assert stats[-1,1] == n_sample
+    assert os.path.isfile(os.path.join(output_path, "model_state"))
+    assert len([f for f in os.listdir(output_path) if f.endswith("_train") and "_final" not in f]) == n_sample//4
+    assert len([f for f in os.listdir(output_path) if f.endswith("_final_train")]) == 1
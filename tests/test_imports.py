@@ -0,0 +1,38 @@
+import sys
+import json
+import subprocess
+
+painting_modules = ["baryon_painter.painter",
+                    "baryon_painter.process_SLICS",
+                    "baryon_painter.utils.datasets",
+                    "baryon_painter.utils.data_transforms"]
+heavy_modules = ["matplotlib", "cosmotools", "pyccl", "astropy", "scipy"]
+
+def import_in_subprocess(modules):
+    # Import in a fresh interpreter, so that the modules loaded by other tests
+    # don't count
+    code = f"""
+import sys, time, json, importlib
+t0 = time.perf_counter()
+import torch
+t1 = time.perf_counter()
+for m in {modules!r}:
+    importlib.import_module(m)
+t2 = time.perf_counter()
+print(json.dumps({{"torch" : t1-t0, "painting" : t2-t1, "modules" : list(sys.modules.keys())}}))
+"""
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def test_no_heavy_imports():
+    result = import_in_subprocess(painting_modules)
+    loaded = [m for m in heavy_modules if m in result["modules"]]
+    assert loaded == [], f"Painting path imports {loaded}."
+
+def test_import_time_budget():
+    result = import_in_subprocess(painting_modules)
+    # The painting path should only add a small overhead to importing torch
+    budget = max(0.5, 0.5*result["torch"])
+    assert result["painting"] < budget, \
+        f"Importing the painting path took {result['painting']:.2f} s, budget is {budget:.2f} s."
@@ -0,0 +1,175 @@
+import os
+
+import json
+
+import numpy as np
+
+import baryon_painter.process_SLICS
+from baryon_painter.utils import mock_data, profiling
+
+def test_mock_SLICS(tmp_path):
+    z_SLICS = mock_data.SLICS_redshifts[:3]
+    mock_data.write_mock_SLICS(str(tmp_path / "SLICS"), LOS=74, z_SLICS=z_SLICS, n_massplane=1,
+                               n_pixel_delta=96, n_pixel_massplane=128)
+
+    delta = np.fromfile(tmp_path / "SLICS" / "delta" / f"{z_SLICS[1]:.3f}delta.dat_bicubic_LOS74", dtype=np.float32)
+    assert delta.size == 96**2
+    assert np.all(delta > -96)
+    massplane = np.fromfile(tmp_path / "SLICS" / "massplanes" / f"{z_SLICS[0]:.3f}proj_half_finer_xy.dat_LOS74", 
+                            dtype=np.float32)
+    assert massplane.size == 128**2 + 1
+    assert np.all(massplane[1:] > 0)
+    shifts = np.loadtxt(tmp_path / "SLICS" / "random_shifts" / "random_shift_LOS74")
+    assert shifts.shape == (3, 2)
+
+    painter = mock_data.create_mock_painter(str(tmp_path / "model"), tile_size=32, width=0.25)
+    painted_planes = baryon_painter.process_SLICS.process_SLICS(
+                                   painter, tile_size=100.0, n_pixel_tile=32,
+                                   LOS=74, z_SLICS=z_SLICS, delta_size=[50.0, 150.0, 250.0],
+                                   delta_path=str(tmp_path / "SLICS" / "delta"),
+                                   massplane_path=str(tmp_path / "SLICS" / "massplanes"),
+                                   shifts_path=str(tmp_path / "SLICS" / "random_shifts"),
+                                   z_slice=[0.0, 0.1, 0.2],
+                                   n_pixel_delta=96, n_pixel_massplane=128,
+                                   timing_report_file=str(tmp_path / "timings.json"),
+                                   verbose=False)
+
+    assert [p.shape[0] for p in painted_planes] == [16, 48, 80]
+    assert all(np.all(np.isfinite(p)) for p in painted_planes)
+
+    with open(tmp_path / "timings.json", "r") as f:
+        report = json.load(f)
+    assert report["metadata"]["LOS"] == 74
+    assert list(report["planes"].keys()) == [f"{z:.3f}" for z in z_SLICS]
+    # One tile for the mass plane, 3x3 and 4x4 for the delta planes
+    assert [p["stages"]["paint"]["count"] for p in report["planes"].values()] == [1, 9, 16]
+    assert report["stages"]["read"]["n_byte"] == 128**2*4 + 4 + 2*96**2*4
+    for stage in ["normalise", "get_tile", "zoom", "paint.transform", "paint.forward", 
+                  "paint.inverse_transform", "blend"]:
+        assert report["stages"][stage]["time"] > 0
+
+def test_load_test(tmp_path):
+    from baryon_painter.lightcone_load_test import run_load_test
+
+    mock_data.write_mock_SLICS(str(tmp_path / "SLICS"), z_SLICS=mock_data.SLICS_redshifts[:3],
+                               n_pixel_delta=96, n_pixel_massplane=128)
+    painter = mock_data.create_mock_painter(str(tmp_path / "model"), tile_size=32, width=0.25)
+    report = run_load_test(str(tmp_path / "SLICS"), painter, n_plane=3, 
+                           n_pixel_delta=96, n_pixel_massplane=128, output_resolution=64, verbose=False)
+
+    assert len(report["planes"]) == 3
+    assert report["peak_rss"] > 0
+    assert all(p["tiles_per_s"] > 0 and p["peak_rss"] > 0 for p in report["planes"])
+
+class IdentityPainter:
+    def paint(self, input, **kwargs):
+        return input.copy()
+
+def test_resample_plane(tmp_path):
+    import scipy.ndimage
+
+    z_SLICS = mock_data.SLICS_redshifts[1:3]
+    mock_data.write_mock_SLICS(str(tmp_path / "SLICS"), LOS=74, z_SLICS=z_SLICS, n_massplane=0,
+                               n_pixel_delta=96, n_pixel_massplane=128)
+    timer = profiling.StageTimer()
+    painted_planes = baryon_painter.process_SLICS.process_SLICS(
+                                   IdentityPainter(), tile_size=100.0, n_pixel_tile=32,
+                                   LOS=74, z_SLICS=z_SLICS, delta_size=[150.0, 250.0],
+                                   delta_path=str(tmp_path / "SLICS" / "delta"),
+                                   massplane_path=str(tmp_path / "SLICS" / "massplanes"),
+                                   shifts_path=str(tmp_path / "SLICS" / "random_shifts"),
+                                   z_slice=[0.1, 0.2],
+                                   n_pixel_delta=96, n_pixel_massplane=128,
+                                   resample_plane=True, timer=timer,
+                                   verbose=False)
+
+    # Overlapping tiles have the same pixels, so blending returns the 
+    # resampled plane
+    for z, plane in zip(z_SLICS, painted_planes):
+        delta = np.fromfile(tmp_path / "SLICS" / "delta" / f"{z:.3f}delta.dat_bicubic_LOS74", 
+                            dtype=np.float32).reshape(96, -1).T
+        delta = (delta + 96)/(3072**3/2/12288**2)
+        delta = scipy.ndimage.zoom(delta, zoom=plane.shape[0]/96, mode="reflect")
+        np.testing.assert_allclose(plane, delta, rtol=1e-5)
+        assert timer.planes[f"{z:.3f}"]["stages"]["zoom"]["count"] == 1
+
+def test_memory_budget(tmp_path):
+    z_SLICS = mock_data.SLICS_redshifts[:3]
+    mock_data.write_mock_SLICS(str(tmp_path / "SLICS"), LOS=74, z_SLICS=z_SLICS, n_massplane=1,
+                               n_pixel_delta=96, n_pixel_massplane=128)
+    kwargs = dict(tile_size=100.0, n_pixel_tile=32,
+                  LOS=74, z_SLICS=z_SLICS, delta_size=[50.0, 150.0, 250.0],
+                  delta_path=str(tmp_path / "SLICS" / "delta"),
+                  massplane_path=str(tmp_path / "SLICS" / "massplanes"),
+                  shifts_path=str(tmp_path / "SLICS" / "random_shifts"),
+                  z_slice=[0.0, 0.1, 0.2],
+                  n_pixel_delta=96, n_pixel_massplane=128,
+                  verbose=False)
+    planes = baryon_painter.process_SLICS.process_SLICS(IdentityPainter(), **kwargs)
+
+    (tmp_path / "spill").mkdir()
+    timer = profiling.StageTimer()
+    # The first two planes fit into the budget
+    planes_budget = baryon_painter.process_SLICS.process_SLICS(IdentityPainter(), memory_budget=(16**2+48**2)*4,
+                                                               spill_path=str(tmp_path / "spill"), timer=timer,
+                                                               **kwargs)
+    assert [isinstance(p, np.memmap) for p in planes_budget] == [False, False, True]
+    assert all(p.dtype == np.float32 for p in planes_budget)
+    # Spilled files are unlinked
+    assert os.listdir(tmp_path / "spill") == []
+    for p, p_budget in zip(planes, planes_budget):
+        np.testing.assert_allclose(p_budget, p, rtol=1e-5)
+    assert timer.stages["spill"]["n_byte"] == 80**2*4
+    assert all(p["peak_rss"] > 0 for p in timer.planes.values())
+
+def test_multi_field_planes(tmp_path):
+    z_SLICS = mock_data.SLICS_redshifts[:2]
+    mock_data.write_mock_SLICS(str(tmp_path / "SLICS"), LOS=74, z_SLICS=z_SLICS, n_massplane=1,
+                               n_pixel_delta=96, n_pixel_massplane=128)
+    painter = mock_data.create_mock_painter(str(tmp_path / "model"), tile_size=32, width=0.25,
+                                            label_fields=["pressure", "gas"])
+    painted_planes, moments = baryon_painter.process_SLICS.process_SLICS(
+                                   painter, tile_size=100.0, n_pixel_tile=32,
+                                   LOS=74, z_SLICS=z_SLICS, delta_size=[50.0, 150.0],
+                                   delta_path=str(tmp_path / "SLICS" / "delta"),
+                                   massplane_path=str(tmp_path / "SLICS" / "massplanes"),
+                                   shifts_path=str(tmp_path / "SLICS" / "random_shifts"),
+                                   z_slice=[0.0, 0.1], n_realisation=3, return_moments=True, seed=1,
+                                   n_pixel_delta=96, n_pixel_massplane=128, verbose=False)
+
+    assert [p.shape for p in painted_planes] == [(3, 2, 16, 16), (3, 2, 48, 48)]
+    assert all(np.all(np.isfinite(p)) for p in painted_planes)
+    assert [m.shape for m in moments["mean"]] == [(2, 16, 16), (2, 48, 48)]
+    np.testing.assert_allclose(moments["mean"][1], painted_planes[1].mean(axis=0), rtol=1e-6)
+    # The fields get different transforms and painted values
+    assert not np.allclose(painted_planes[1][:,0], painted_planes[1][:,1])
+
+def test_several_painters(tmp_path):
+    z_SLICS = mock_data.SLICS_redshifts[:3]
+    mock_data.write_mock_SLICS(str(tmp_path / "SLICS"), LOS=74, z_SLICS=z_SLICS, n_massplane=1,
+                               n_pixel_delta=96, n_pixel_massplane=128)
+    painter = mock_data.create_mock_painter(str(tmp_path / "model"), tile_size=32, width=0.25)
+    kwargs = dict(tile_size=100.0, n_pixel_tile=32,
+                  LOS=74, z_SLICS=z_SLICS, delta_size=[50.0, 150.0, 250.0],
+                  delta_path=str(tmp_path / "SLICS" / "delta"),
+                  massplane_path=str(tmp_path / "SLICS" / "massplanes"),
+                  shifts_path=str(tmp_path / "SLICS" / "random_shifts"),
+                  z_slice=[0.0, 0.1, 0.2], seed=1, return_moments=True,
+                  n_pixel_delta=96, n_pixel_massplane=128,
+                  verbose=False)
+
+    timer = profiling.StageTimer()
+    # The CVAE paints rows in batches, the identity painter tile by tile
+    planes, moments = baryon_painter.process_SLICS.process_SLICS([painter, IdentityPainter()], timer=timer, **kwargs)
+    assert len(planes) == 2 and len(moments) == 2
+
+    planes_single, _ = baryon_painter.process_SLICS.process_SLICS(painter, **kwargs)
+    planes_identity, _ = baryon_painter.process_SLICS.process_SLICS(IdentityPainter(), **kwargs)
+    for p, p_single in zip(planes[0], planes_single):
+        np.testing.assert_allclose(p, p_single, rtol=1e-5)
+    for p, p_identity in zip(planes[1], planes_identity):
+        np.testing.assert_allclose(p, p_identity)
+
+    # Tiles are only cut and resampled once for both painters
+    assert [p["stages"]["get_tile"]["count"] for p in timer.planes.values()] == [1, 9, 16]
+    assert [p["stages"]["paint"]["count"] for p in timer.planes.values()] == [2, 18, 32]
@@ -0,0 +1,65 @@
+import os
+import functools
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import baryon_painter.process_SLICS
+from baryon_painter.painter import CVAEPainter
+from baryon_painter.painter_pool import PainterPool, autotune, get_layouts
+from baryon_painter.utils import mock_data
+
+def _exit_first_worker(lock_filename, painter_factory):
+    try:
+        open(lock_filename, "x").close()
+    except FileExistsError:
+        return painter_factory()
+    os._exit(3)
+
+def test_painter_pool(tmp_path):
+    mock_data.create_mock_painter(str(tmp_path / "model"), tile_size=32, width=0.25)
+    painter_factory = functools.partial(CVAEPainter, (str(tmp_path / "model" / "model_state"),
+                                                      str(tmp_path / "model" / "model_meta")))
+    painter = painter_factory()
+
+    rng = np.random.default_rng(0)
+    tiles = rng.lognormal(size=(5, 32, 32)).astype(np.float32)
+    seeds = [(1, i) for i in range(5)]
+    with PainterPool(painter_factory, n_worker=2, n_thread_per_worker=1) as pool:
+        # Seeded painting doesn't depend on the worker
+        painted = pool.paint_batch(tiles, z=0.1, seeds=seeds)
+        for tile, seed, p in zip(tiles, seeds, painted):
+            np.testing.assert_allclose(p, painter.paint(tile, z=0.1, seed=seed), rtol=1e-5)
+
+        mock_data.write_mock_SLICS(str(tmp_path / "SLICS"), LOS=74, z_SLICS=mock_data.SLICS_redshifts[:2], 
+                                   n_massplane=1, n_pixel_delta=96, n_pixel_massplane=128)
+        kwargs = dict(tile_size=100.0, n_pixel_tile=32,
+                      LOS=74, z_SLICS=mock_data.SLICS_redshifts[:2], delta_size=[50.0, 150.0],
+                      delta_path=str(tmp_path / "SLICS" / "delta"),
+                      massplane_path=str(tmp_path / "SLICS" / "massplanes"),
+                      shifts_path=str(tmp_path / "SLICS" / "random_shifts"),
+                      z_slice=[0.0, 0.1],
+                      n_pixel_delta=96, n_pixel_massplane=128,
+                      seed=42, verbose=False)
+        planes_pool = baryon_painter.process_SLICS.process_SLICS(pool, **kwargs)
+    planes = baryon_painter.process_SLICS.process_SLICS(painter, **kwargs)
+    for p_pool, p in zip(planes_pool, planes):
+        np.testing.assert_allclose(p_pool, p, rtol=1e-5)
+
+    assert get_layouts(4) == [(4, 1), (2, 2), (1, 4)]
+    best, results = autotune(painter_factory, tile_shape=(32, 32), layouts=[(1, 1), (2, 1)], 
+                             n_tile_per_worker=2, verbose=False)
+    assert len(results) == 2
+    assert all(r["tiles_per_s"] > 0 for r in results)
+    assert (best["n_worker"], best["n_thread_per_worker"]) in [(1, 1), (2, 1)]
+
+def test_painter_pool_startup_failure(tmp_path):
+    mock_data.create_mock_painter(str(tmp_path / "model"), tile_size=32, width=0.25)
+    painter_factory = functools.partial(_exit_first_worker, str(tmp_path / "lock"),
+                                        functools.partial(CVAEPainter, (str(tmp_path / "model" / "model_state"),
+                                                                        str(tmp_path / "model" / "model_meta"))))
+    # The worker that did start gets stopped
+    with pytest.raises(RuntimeError, match="exit code 3"):
+        PainterPool(painter_factory, n_worker=2)
+    assert multiprocessing.active_children() == []
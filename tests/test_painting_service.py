@@ -0,0 +1,72 @@
+import threading
+
+import numpy as np
+
+from baryon_painter.painting_service import PaintingService, PaintingClient, create_server
+
+from helpers import create_painter
+
+def run_requests(service, server, client_kwargs, tiles):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    results = [None]*len(tiles)
+    def request(i):
+        client = PaintingClient(**client_kwargs)
+        results[i] = client.paint(tiles[i], z=0.0, seed=(1, i))
+        client.close()
+    try:
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(len(tiles))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        client = PaintingClient(**client_kwargs)
+        metrics = client.get_metrics()
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results, metrics
+
+def test_painting_service(tmp_path):
+    painter = create_painter(tmp_path)
+    rng = np.random.default_rng(1)
+    tiles = rng.lognormal(size=(12, 16, 16)).astype(np.float32)
+    expected = [painter.paint(t, z=0.0, inverse_transform=False, seed=(1, i)) for i, t in enumerate(tiles)]
+
+    service = PaintingService(painter, max_batch_size=8, max_latency=0.2,
+                              paint_kwargs={"inverse_transform" : False})
+
+    for client_kwargs, server in [({"socket_path" : str(tmp_path / "painter.sock")},
+                                   create_server(service, socket_path=str(tmp_path / "painter.sock"))),
+                                  ({"port" : None}, create_server(service, port=0))]:
+        if "port" in client_kwargs:
+            client_kwargs["port"] = server.server_address[1]
+        results, metrics = run_requests(service, server, client_kwargs, tiles)
+
+        for r, e in zip(results, expected):
+            assert r.shape == e.shape
+            assert np.allclose(r, e, atol=1e-6)
+
+    service.close()
+    # Requests got batched
+    assert metrics["n_request"] == 2*len(tiles)
+    assert metrics["n_batch"] < 2*len(tiles)
+    assert metrics["queue_depth"] == 0
+    assert max(int(k) for k in metrics["batch_size_histogram"]) <= 8
+
+class DoublingPainter:
+    def paint_batch(self, inputs, z=0.0, seeds=None):
+        return 2*np.asarray(inputs, dtype=np.float64)
+
+def test_painting_service_dtype(tmp_path):
+    service = PaintingService(DoublingPainter(), max_batch_size=4)
+    server = create_server(service, port=0)
+    # Values that aren't representable in single precision
+    tiles = np.random.default_rng(2).normal(size=(3, 8, 8))
+    results, _ = run_requests(service, server, {"port" : server.server_address[1]}, tiles)
+    service.close()
+
+    for r, t in zip(results, tiles):
+        assert r.dtype == np.float64
+        assert np.array_equal(r, 2*t)
@@ -0,0 +1,75 @@
+import numpy as np
+
+from baryon_painter.utils import power_spectrum
+
+pi = np.pi
+
+def reference_Pofk(A, B, L, n_k_bin=20):
+    # Straightforward per-map estimator with the full complex FFT. Empty bins
+    # are NaN, as for the batched estimator.
+    n = A.shape[0]
+    A_k = np.fft.fft2(A)
+    B_k = np.fft.fft2(B)
+    P = (A_k*B_k.conj()).real*L**2/n**4
+    k_x = np.fft.fftfreq(n, d=L/n)*2*pi
+    k_mag = np.sqrt(k_x[:,None]**2 + k_x[None,:]**2)
+    k_bin_edges = np.logspace(np.log10(2*pi/L), np.log10(2*pi/L*n/2), n_k_bin+1, endpoint=True)
+    n_mode, _ = np.histogram(k_mag, bins=k_bin_edges)
+    Pk, _ = np.histogram(k_mag, bins=k_bin_edges, weights=P)
+    k, _ = np.histogram(k_mag, bins=k_bin_edges, weights=k_mag)
+    with np.errstate(invalid="ignore"):
+        return Pk/n_mode, k/n_mode
+
+def test_power_spectrum():
+    rng = np.random.default_rng(0)
+    L = 100.0
+    A = rng.normal(size=(3, 2, 64, 64))
+    B = A + rng.normal(size=(3, 2, 64, 64))
+
+    Pk, k, Pk_var, n_mode = power_spectrum.power_spectrum(A, B, L=L, n_k_bin=10)
+    assert Pk.shape == (3, 2, 10)
+    for i in range(3):
+        for j in range(2):
+            Pk_ref, k_ref = reference_Pofk(A[i,j], B[i,j], L, n_k_bin=10)
+            np.testing.assert_allclose(Pk[i,j], Pk_ref, rtol=1e-10)
+            np.testing.assert_allclose(k, k_ref, rtol=1e-10)
+
+    # Auto spectrum is the cross spectrum with itself
+    Pk_auto, _, _, _ = power_spectrum.power_spectrum(A, L=L, n_k_bin=10)
+    Pk_cross, _, _, _ = power_spectrum.power_spectrum(A, A, L=L, n_k_bin=10)
+    np.testing.assert_allclose(Pk_auto, Pk_cross)
+
+    # White noise has a flat spectrum with the variance times the pixel area
+    np.testing.assert_allclose(Pk_auto.mean(axis=(0,1))[n_mode > 100], (L/64)**2, rtol=0.1)
+
+    # The binning is only computed once
+    info = power_spectrum.get_k_binning.cache_info()
+    power_spectrum.power_spectrum(B, L=L, n_k_bin=10)
+    assert power_spectrum.get_k_binning.cache_info().hits == info.hits + 1
+    assert power_spectrum.get_k_binning.cache_info().misses == info.misses
+
+def test_compute_spectra():
+    rng = np.random.default_rng(1)
+    L = 50.0
+    n_sample, n_field = 4, 2
+    output_true = rng.lognormal(size=(n_sample, n_field, 32, 32))
+    output_pred = rng.lognormal(size=(n_sample, n_field, 32, 32))
+    input = rng.lognormal(size=(n_sample, 1, 32, 32))
+    output_transforms = [[lambda x: 2*x, np.log]]*n_sample
+    input_transform = [lambda x: x - 1]*n_sample
+
+    spectra = power_spectrum.compute_spectra(output_true, output_pred, input, L,
+                                             input_transform=input_transform,
+                                             output_transforms=output_transforms)
+    for key in ["auto_true", "auto_pred", "cross_true", "cross_pred"]:
+        assert spectra[key].shape == (n_sample, n_field, 20)
+
+    for j in range(n_sample):
+        B = input[j,0] - 1
+        for i in range(n_field):
+            A_true = output_transforms[j][i](output_true[j,i])
+            A_pred = output_transforms[j][i](output_pred[j,i])
+            np.testing.assert_allclose(spectra["auto_true"][j,i], reference_Pofk(A_true, A_true, L)[0], rtol=1e-10)
+            np.testing.assert_allclose(spectra["auto_pred"][j,i], reference_Pofk(A_pred, A_pred, L)[0], rtol=1e-10)
+            np.testing.assert_allclose(spectra["cross_true"][j,i], reference_Pofk(A_true, B, L)[0], rtol=1e-10)
+            np.testing.assert_allclose(spectra["cross_pred"][j,i], reference_Pofk(A_pred, B, L)[0], rtol=1e-10)
@@ -0,0 +1,78 @@
+import json
+import time
+
+from baryon_painter.utils import profiling
+
+def test_stage_timer():
+    timer = profiling.StageTimer()
+    # Stages of the module-level function are only recorded while active
+    with profiling.stage("inactive"):
+        pass
+
+    timer.start_plane("0.042")
+    with timer.stage("read", n_byte=100):
+        time.sleep(0.01)
+    with timer.stage("paint"), timer.activate():
+        with profiling.stage("paint.forward"):
+            time.sleep(0.01)
+    timer.start_plane("0.130")
+    with timer.stage("read", n_byte=50):
+        pass
+    timer.end_plane()
+    with timer.stage("read", n_byte=10):
+        pass
+
+    report = timer.get_report(LOS=74)
+    assert report["metadata"]["LOS"] == 74
+    assert "inactive" not in report["stages"]
+    assert report["stages"]["read"]["count"] == 3
+    assert report["stages"]["read"]["n_byte"] == 160
+    assert report["stages"]["paint"]["time"] >= report["stages"]["paint.forward"]["time"] >= 0.01
+    assert report["planes"]["0.042"]["stages"]["read"]["n_byte"] == 100
+    assert report["planes"]["0.042"]["wall_time"] >= 0.02
+    assert report["planes"]["0.130"]["stages"]["read"]["count"] == 1
+    if profiling.get_rss() is not None:
+        assert all(p["peak_rss"] >= p["rss"] > 0 for p in report["planes"].values())
+
+    aggregate = profiling.aggregate_reports([report, report])
+    assert aggregate["n_report"] == 2
+    assert aggregate["stages"]["read"]["n_byte"] == 320
+    assert aggregate["planes"]["0.130"]["stages"]["read"]["count"] == 2
+
+def test_step_timer(tmp_path):
+    timer = profiling.StepTimer(str(tmp_path / "timings.jsonl"), buffer_size=2)
+    for i in range(3):
+        time.sleep(0.01)
+        timer.lap("data_wait")
+        time.sleep(0.001)
+        timer.lap("forward")
+        timer.end_step(4, batch=i)
+    summary = timer.get_summary()
+    timer.close()
+
+    assert summary["n_step"] == 3
+    assert 0.5 < summary["data_wait_fraction"] < 1
+    assert summary["phases"]["forward"] >= 0.001
+    assert summary["samples_per_s"] > 0
+    assert summary["peak_rss"] > 0
+
+    with open(tmp_path / "timings.jsonl", "r") as f:
+        records = [json.loads(l) for l in f]
+    assert [r["batch"] for r in records] == [0, 1, 2]
+    assert records[0]["phases"]["data_wait"] >= 0.01
+    assert records[0]["step_time"] == sum(records[0]["phases"].values())
+
+def test_training_timings(tmp_path):
+    from baryon_painter.painter import CVAEPainter
+    from helpers import create_dataset, create_architecture, train
+
+    painter = CVAEPainter(training_data_set=create_dataset(), test_data_set=create_dataset(),
+                          architecture=create_architecture())
+    training_stats, _ = train(painter, str(tmp_path))
+
+    with open(tmp_path / "training_timings.jsonl", "r") as f:
+        records = [json.loads(l) for l in f]
+    assert len(records) == records[-1]["batch"]
+    assert records[-1]["sample"] == sum(r["n_sample"] for r in records)
+    for phase in ["data_wait", "h2d", "forward", "backward", "optimizer", "stats", "checkpoint"]:
+        assert any(phase in r["phases"] for r in records)
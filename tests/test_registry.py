@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from baryon_painter.registry import PainterRegistry, get_model_memory
+
+from helpers import create_painter
+
+def test_registry(tmp_path):
+    painter = create_painter(tmp_path)
+    filenames = (str(tmp_path / "model_state"), str(tmp_path / "model_meta"))
+    model_memory = get_model_memory(painter.model)
+
+    registry = PainterRegistry(memory_budget=2*model_memory)
+    a = registry.get(filenames)
+    assert registry.get(filenames) is a
+    assert registry.n_hit == 1 and registry.n_miss == 1
+    assert not a.model.training
+    assert not any(p.requires_grad for p in a.model.parameters())
+    with pytest.raises(RuntimeError):
+        a.train()
+
+    # Modified files get loaded again and replace the old version
+    stat = os.stat(filenames[0])
+    os.utime(filenames[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    b = registry.get(filenames)
+    assert b is not a
+    assert len(registry) == 1
+
+    # Least recently used painters are evicted
+    for i in range(3):
+        os.makedirs(tmp_path / f"{i}")
+        create_painter(tmp_path / f"{i}")
+    painters = [registry.get((str(tmp_path / f"{i}" / "model_state"), str(tmp_path / f"{i}" / "model_meta")))
+                for i in range(3)]
+    assert len(registry) == 2
+    assert registry.memory_usage <= 2*model_memory
+    assert registry.get((str(tmp_path / "2" / "model_state"), str(tmp_path / "2" / "model_meta"))) is painters[2]
+
+    # Content hash keys
+    registry = PainterRegistry(key="hash")
+    a = registry.get(filenames)
+    os.utime(filenames[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 2000))
+    assert registry.get(filenames) is a
@@ -0,0 +1,69 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+import torch
+
+from baryon_painter.painter import CVAEPainter
+
+from helpers import create_dataset, create_architecture, train
+
+def test_resume(tmp_path):
+    """Tests that resuming from a checkpoint reproduces an uninterrupted run."""
+    dataset = create_dataset()
+    path_full = str(tmp_path / "full")
+    path_resumed = str(tmp_path / "resumed")
+
+    torch.manual_seed(1)
+    painter = CVAEPainter(training_data_set=dataset, test_data_set=dataset,
+                          architecture=create_architecture())
+    train(painter, path_full)
+
+    # Simulate a run that got interrupted after the third checkpoint by 
+    # resuming from it in a copy of the output directory.
+    shutil.copytree(path_full, path_resumed)
+    checkpoints = sorted(f for f in os.listdir(path_resumed) if f.endswith("_train"))
+    assert len(checkpoints) > 3
+
+    painter = CVAEPainter(training_data_set=dataset, test_data_set=dataset,
+                          architecture=create_architecture())
+    train(painter, path_resumed, resume_from=os.path.join(path_resumed, checkpoints[2]))
+
+    state_full = torch.load(os.path.join(path_full, "model_state"))
+    state_resumed = torch.load(os.path.join(path_resumed, "model_state"))
+    for k in state_full:
+        assert torch.allclose(state_full[k].float(), state_resumed[k].float())
+
+    for filename in ["training_stats.txt", "validation_stats.txt", "training_sample_indicies.bin"]:
+        with open(os.path.join(path_full, filename), "rb") as f:
+            full = f.read()
+        with open(os.path.join(path_resumed, filename), "rb") as f:
+            resumed = f.read()
+        assert full == resumed
+
+    # Steps recorded after the checkpoint are removed from the timings
+    batches = {}
+    for path in [path_full, path_resumed]:
+        with open(os.path.join(path, "training_timings.jsonl"), "r") as f:
+            batches[path] = [json.loads(l)["batch"] for l in f]
+    assert batches[path_resumed] == batches[path_full]
+
+def test_resume_finished(tmp_path):
+    """Tests that resuming a finished run doesn't train or overwrite the model."""
+    painter = CVAEPainter(training_data_set=create_dataset(), test_data_set=create_dataset(),
+                          architecture=create_architecture())
+    training_stats, _ = train(painter, str(tmp_path))
+    assert len([f for f in os.listdir(tmp_path) if f.endswith("_final_train")]) == 1
+
+    mtime = os.path.getmtime(tmp_path / "model_state")
+    with open(tmp_path / "training_stats.txt", "rb") as f:
+        stats_file = f.read()
+    painter = CVAEPainter(training_data_set=create_dataset(), test_data_set=create_dataset(),
+                          architecture=create_architecture())
+    resumed_stats, _ = train(painter, str(tmp_path), resume_from="latest")
+    assert os.path.getmtime(tmp_path / "model_state") == mtime
+    with open(tmp_path / "training_stats.txt", "rb") as f:
+        assert f.read() == stats_file
+    assert np.array_equal(resumed_stats.state_dict()["n_sample"], training_stats.state_dict()["n_sample"])
@@ -0,0 +1,23 @@
+import numpy as np
+
+from baryon_painter.utils.sample_index_log import SampleIndexLog, load_sample_index_log
+
+def test_sample_index_log(tmp_path):
+    """Tests that chunked writes and appends round-trip through the memmap reader."""
+    filename = str(tmp_path / "training_sample_indicies.bin")
+
+    batches = [np.random.randint(0, 10**12, size=n) for n in [3, 5, 1, 7, 2]]
+    with SampleIndexLog(filename, chunk_size=4) as log:
+        for i, b in enumerate(batches[:3]):
+            log.append(b, i)
+        assert len(log) == 9
+
+    with SampleIndexLog(filename, chunk_size=4, append=True) as log:
+        assert log.n_written == 9
+        for i, b in enumerate(batches[3:]):
+            log.append(b, i+3)
+
+    log = load_sample_index_log(filename)
+    assert len(log) == sum(len(b) for b in batches)
+    assert np.all(log["sample_idx"] == np.concatenate(batches))
+    assert np.all(log["batch"] == np.concatenate([[i]*len(b) for i, b in enumerate(batches)]))
@@ -0,0 +1,69 @@
+import numpy as np
+
+import torch
+
+from baryon_painter.utils.training_stats import TrainingStats
+
+def test_moving_average():
+    """Tests that the incremental moving average matches a direct computation."""
+    n_batch = 57
+    window = 10
+    values = np.random.randn(n_batch, 3)
+
+    stats = TrainingStats(["a", "b", "c"], moving_average_window=window,
+                          dump_to_file_frequency=7, initial_capacity=4)
+    for i in range(n_batch):
+        # Mix of device tensors and scalars, as pushed by CVAEPainter.train
+        stats.push_loss(i*4, torch.tensor(values[i,:2]), values[i,2])
+
+    assert stats.n_batches == n_batch
+    assert np.allclose(stats.n_processed_samples, np.arange(n_batch)*4)
+    for j, term in enumerate(["a", "b", "c"]):
+        mavg = [values[max(0, i-window+1):i+1,j].mean() for i in range(n_batch)]
+        assert np.allclose(stats.loss_terms[term]["all"], values[:,j])
+        assert np.allclose(stats.loss_terms[term]["mavg"], mavg)
+        assert np.isclose(stats.get_mavg(term), mavg[-1])
+
+def test_format(tmp_path):
+    """Tests that values are written like the scalars they were pushed as."""
+    filename = tmp_path / "stats.txt"
+    stats = TrainingStats(["a", "b", "lr", "batch_size"], stats_filename=str(filename))
+    assert np.isnan(stats.get_mavg("a"))
+    assert np.isnan(stats.get_last("a"))
+
+    stats.push_loss(4, torch.tensor([1.0, 0.1]), 1.0, 3)
+    stats.flush_to_file()
+    assert stats.get_str(-1) == "0 4 1.0 0.1 1.0 3 "
+    with open(filename, "r") as f:
+        assert f.readlines()[-1] == "0 4 1.0 0.1 1.0 3 \n"
+
+def test_history_ring_buffer(tmp_path):
+    """Tests that a bounded history keeps the last entries and writes all of them to file."""
+    filename = tmp_path / "stats.txt"
+    stats = TrainingStats(["a"], moving_average_window=5, dump_to_file_frequency=3,
+                          stats_filename=str(filename), history_size=8)
+    for i in range(20):
+        stats.push_loss(i, float(i))
+    stats.flush_to_file()
+
+    assert np.allclose(stats.loss_terms["a"]["all"], np.arange(12, 20))
+    assert np.allclose(stats.loss_terms["a"]["mavg"], np.arange(12, 20)-2)
+    assert stats.get_str(-1) == "19 19 19.0 "
+
+    d = np.loadtxt(filename)
+    assert d.shape == (20, 3)
+    assert np.allclose(d[:,2], np.arange(20))
+
+def test_reduce():
+    calls = []
+    def reduce(t):
+        calls.append(t.numel())
+        return 2*t
+    stats = TrainingStats(["a", "b", "lr"], dump_to_file_frequency=4, reduce=reduce)
+    for i in range(6):
+        stats.push_loss(i, torch.tensor([i, -i], dtype=torch.float64), 0.1)
+    # Tensors are reduced in one call per synchronisation, other values not
+    assert calls == [8]
+    assert np.allclose(stats.loss_terms["a"]["all"], 2*np.arange(6))
+    assert np.allclose(stats.loss_terms["lr"]["all"], 0.1)
+    assert calls == [8, 4]
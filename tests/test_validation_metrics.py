@@ -0,0 +1,50 @@
+import numpy as np
+
+from baryon_painter.utils import validation_metrics
+
+def test_validation_metrics():
+    rng = np.random.default_rng(0)
+    output_true = rng.lognormal(size=(4, 2, 32, 32))
+    input = rng.lognormal(size=(4, 1, 32, 32))
+    labels = validation_metrics.get_validation_metric_labels(["pressure", "gas"])
+
+    # A perfect prediction has no deviations
+    metrics = validation_metrics.compute_validation_metrics(output_true, output_true, input, L=50.0)
+    assert metrics.shape == (len(labels),)
+    np.testing.assert_allclose(metrics, 0, atol=1e-12)
+
+    # Doubling the prediction quadruples the auto and doubles the cross power
+    metrics = validation_metrics.compute_validation_metrics(output_true, 2*output_true, input, L=50.0)
+    metrics = dict(zip(labels, metrics))
+    np.testing.assert_allclose(metrics["pressure_auto_Pk_ratio_k1"], 3)
+    np.testing.assert_allclose(metrics["gas_cross_Pk_ratio_k2"], 1)
+    assert metrics["gas_PDF_KS"] > 0.1
+
+    # Metrics are computed after the transforms, where the prediction is only
+    # offset by a constant, which doesn't change the power at k > 0
+    output_transforms = [[np.log, np.log]]*4
+    metrics = validation_metrics.compute_validation_metrics(output_true, output_true*np.e, input, L=50.0,
+                                                            output_transforms=output_transforms)
+    metrics = dict(zip(labels, metrics))
+    np.testing.assert_allclose(metrics["pressure_auto_Pk_ratio_k0"], 0, atol=1e-10)
+    assert metrics["pressure_PDF_KS"] > 0.1
+
+    assert validation_metrics.ks_distance(np.arange(10), np.arange(10)) == 0
+    assert validation_metrics.ks_distance(np.arange(10), np.arange(10)+10) == 1
+
+def test_validation_stats_columns(tmp_path):
+    from baryon_painter.painter import CVAEPainter
+    from helpers import create_dataset, create_architecture, train
+
+    painter = CVAEPainter(training_data_set=create_dataset(), test_data_set=create_dataset(),
+                          architecture=create_architecture())
+    _, validation_stats = train(painter, str(tmp_path))
+
+    labels = validation_metrics.get_validation_metric_labels(["pressure"])
+    assert all(l in validation_stats.labels for l in labels)
+    with open(tmp_path / "validation_stats.txt", "r") as f:
+        header = f.readline()
+        stats = np.loadtxt(f, ndmin=2)
+    assert "pressure_PDF_KS" in header
+    assert stats.shape[1] == len(validation_stats.labels) + 2
+    assert np.all(np.isfinite(stats))